@@ -0,0 +1,169 @@
+# core/auth/hashers.py
+"""
+Control de admisión para el trabajo de Argon2.
+
+Cada hash o verificación de Argon2 ocupa ~64 MiB y decenas de ms de CPU. Un
+login hace dos (contraseña y respuesta de seguridad), un registro tres. Una
+ráfaga de logins dejaba a los workers ocupados y el resto de los endpoints
+esperando detrás.
+
+Cada proceso admite como mucho VAULT_HASH_CONCURRENCIA hashes a la vez y deja
+esperar a otros VAULT_HASH_COLA, cada uno hasta VAULT_HASH_ESPERA segundos.
+Si la cola está llena o la espera se vence, se responde 503 con Retry-After
+sin hacer el trabajo.
+
+Argon2Limitado pasa todo hash por aquí, así que el límite también cubre el
+admin y cualquier check_password. Las vistas que hacen varios hashes seguidos
+envuelven el bloque entero en trabajo_de_hash(): un request ocupa un solo
+lugar de principio a fin y no queda a medias por un rechazo entre dos hashes.
+
+El límite es por proceso. Sirve con workers de varios hilos (gunicorn
+--threads): los hilos que no hashean siguen atendiendo. argon2-cffi suelta el
+GIL mientras calcula.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class ServidorOcupado(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "El servidor está ocupado verificando otras contraseñas. Intenta de nuevo en unos segundos."
+    default_code = 'servidor_ocupado'
+
+    def __init__(self, wait, detail=None):
+        # El exception_handler de DRF lo pone en el header Retry-After
+        self.wait = wait
+        super().__init__(detail)
+
+
+class Admision:
+    """Semáforo con cola acotada y espera máxima, con contadores para las métricas."""
+
+    def __init__(self, concurrencia, cola, espera):
+        self.concurrencia = concurrencia
+        self.cola = cola
+        self.espera = espera
+        self._cond = threading.Condition()
+        self._hilo = threading.local()
+
+        self.en_curso = 0
+        self.en_cola = 0
+        self.admitidos = 0
+        self.rechazados_cola_llena = 0
+        self.rechazados_espera_vencida = 0
+        self.segundos_espera = 0.0
+        self.espera_max = 0.0
+        self.segundos_trabajo = 0.0
+
+    @classmethod
+    def desde_settings(cls):
+        return cls(settings.VAULT_HASH_CONCURRENCIA, settings.VAULT_HASH_COLA, settings.VAULT_HASH_ESPERA)
+
+    @contextmanager
+    def entrar(self):
+        """
+        Ocupa un lugar mientras dura el bloque o lanza ServidorOcupado. Dentro de
+        un bloque ya admitido (mismo hilo) no se vuelve a pedir lugar.
+        """
+        if self.concurrencia <= 0 or getattr(self._hilo, 'dentro', False):
+            yield
+            return
+
+        inicio = time.monotonic()
+        with self._cond:
+            if self.en_curso >= self.concurrencia:
+                if self.en_cola >= self.cola:
+                    self.rechazados_cola_llena += 1
+                    raise ServidorOcupado(self._reintentar_en())
+                self.en_cola += 1
+                try:
+                    libre = self._cond.wait_for(lambda: self.en_curso < self.concurrencia, timeout=self.espera)
+                finally:
+                    self.en_cola -= 1
+                if not libre:
+                    self.rechazados_espera_vencida += 1
+                    raise ServidorOcupado(self._reintentar_en())
+            self.en_curso += 1
+            self.admitidos += 1
+            espera = time.monotonic() - inicio
+            self.segundos_espera += espera
+            self.espera_max = max(self.espera_max, espera)
+
+        self._hilo.dentro = True
+        try:
+            yield
+        finally:
+            self._hilo.dentro = False
+            with self._cond:
+                self.en_curso -= 1
+                self.segundos_trabajo += time.monotonic() - inicio - espera
+                self._cond.notify()
+
+    def _reintentar_en(self):
+        # Lo que tarda en vaciarse la cola al ritmo medio actual (se llama con el lock tomado)
+        promedio = self.segundos_trabajo / self.admitidos if self.admitidos else 0.1
+        return max(1, math.ceil(promedio * (self.en_cola + 1) / max(1, self.concurrencia)))
+
+    def metricas(self):
+        with self._cond:
+            admitidos = self.admitidos
+            return {
+                "concurrencia": self.concurrencia,
+                "cola": self.cola,
+                "espera_max_permitida_s": self.espera,
+                "en_curso": self.en_curso,
+                "en_cola": self.en_cola,
+                "admitidos": admitidos,
+                "rechazados_cola_llena": self.rechazados_cola_llena,
+                "rechazados_espera_vencida": self.rechazados_espera_vencida,
+                "espera_media_ms": round(self.segundos_espera / admitidos * 1000, 1) if admitidos else 0,
+                "espera_max_ms": round(self.espera_max * 1000, 1),
+                "trabajo_medio_ms": round(self.segundos_trabajo / admitidos * 1000, 1) if admitidos else 0,
+            }
+
+
+_admision = None
+_lock_admision = threading.Lock()
+
+
+def get_admision():
+    global _admision
+    if _admision is None:
+        with _lock_admision:
+            if _admision is None:
+                _admision = Admision.desde_settings()
+    return _admision
+
+
+def set_admision(admision):
+    """Reemplaza el controlador del proceso (lo usa bench_login para comparar)."""
+    global _admision
+    _admision = admision
+
+
+def trabajo_de_hash():
+    """Bloque de trabajo de hash admitido: `with trabajo_de_hash(): ...`."""
+    return get_admision().entrar()
+
+
+class Argon2Limitado(Argon2PasswordHasher):
+    """Argon2PasswordHasher que pasa cada hash por el control de admisión."""
+
+    def encode(self, password, salt):
+        with trabajo_de_hash():
+            return super().encode(password, salt)
+
+    def verify(self, password, encoded):
+        with trabajo_de_hash():
+            return super().verify(password, encoded)
+
+    def harden_runtime(self, password, encoded):
+        with trabajo_de_hash():
+            return super().harden_runtime(password, encoded)
@@ -0,0 +1,144 @@
+# core/auth/jwt.py
+"""
+Autenticación JWT sin consultar al usuario en cada request.
+
+JWTAuthentication de simplejwt lee el User de la base en cada request, y
+después las vistas piden request.user.profile y a veces profile.plan. Aquí el
+access token lleva lo necesario en claims firmados (username, email y versión
+de cupos), y JWTSinConsulta arma con ellos un User vía from_db sin
+tocar la base:
+
+- Sirve tal cual para filtrar (Account.objects.filter(user=request.user)) y
+  para asignarlo a una FK: solo hace falta el pk.
+- Los campos que no vienen en el token (is_staff, password, last_login...)
+  quedan diferidos: solo se leen de la base en las vistas que los usan.
+  No guardar este User con save(): pisaría datos con los del token.
+- request.user.profile se carga solo si la vista lo pide (cupos_de, etc.).
+
+La versión de cupos (Profile.version_cupos) sube al cambiar el plan, los
+extras o al bloquear la cuenta. Si la del token no coincide con la actual, o
+el usuario ya no está activo (is_active se consulta junto con la versión),
+el request se rechaza con 401 token_not_valid y el cliente renueva el token;
+/api/token/refresh/ (RefreshConClaimsSerializer) emite el access con los
+claims al día. La versión actual se lee de la caché de Django
+(VAULT_JWT_VERSION_TTL segundos) y, si no está, con una consulta de una sola
+columna. Guardar el User (desactivarlo en el admin, por ejemplo) borra esa
+entrada. Con LocMemCache cada worker tiene su caché, así que otro proceso
+puede tardar hasta ese TTL en notar el cambio; con una caché compartida es
+inmediato.
+
+Los tokens emitidos antes de este esquema (sin el claim de versión) siguen
+funcionando por el camino de siempre, leyendo el User.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import router, transaction
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+# Campos del User que viaja en el token; el resto queda diferido
+CAMPOS_USUARIO = ('username', 'email')
+CLAIM_VERSION = 'version_cupos'
+
+
+def _cache():
+    return caches[settings.VAULT_JWT_CACHE]
+
+
+def _llave(user_id):
+    return f"jwt:version_cupos:{user_id}"
+
+
+def agregar_claims(token, user, profile):
+    """Pone en `token` los claims que JWTSinConsulta necesita para no leer la base."""
+    for campo in CAMPOS_USUARIO:
+        token[campo] = getattr(user, campo)
+    token[CLAIM_VERSION] = profile.version_cupos
+    return token
+
+
+def version_cupos(user_id):
+    """Versión de cupos vigente del usuario, o None si ya no tiene perfil o está inactivo."""
+    cache = _cache()
+    version = cache.get(_llave(user_id))
+    if version is None:
+        from cuentas.models import Profile
+        version = Profile.objects.filter(user_id=user_id, user__is_active=True).values_list(
+            'version_cupos', flat=True).first()
+        if version is not None:
+            cache.set(_llave(user_id), version, settings.VAULT_JWT_VERSION_TTL)
+    return version
+
+
+def olvidar_versiones(user_ids):
+    """Tras subir version_cupos: los tokens viejos se rechazan en cuanto se confirme."""
+    llaves = [_llave(user_id) for user_id in user_ids]
+    if llaves:
+        transaction.on_commit(lambda: _cache().delete_many(llaves))
+
+
+def olvidar_version_al_guardar(sender, instance, **kwargs):
+    """post_save del User (ver CuentasConfig.ready): is_active pudo cambiar."""
+    olvidar_versiones([instance.pk])
+
+
+class JWTSinConsulta(JWTAuthentication):
+    def get_user(self, validated_token):
+        if CLAIM_VERSION not in validated_token:
+            return super().get_user(validated_token)
+
+        try:
+            # simplejwt guarda el id como texto; el User armado debe tener el pk
+            # del mismo tipo que uno leído de la base (obj.user_id == user.pk)
+            user_id = get_user_model()._meta.pk.to_python(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, ValidationError):
+            raise InvalidToken("El token no identifica a ningún usuario.")
+
+        actual = version_cupos(user_id)
+        if actual is None:
+            raise AuthenticationFailed("Usuario no encontrado o inactivo.", code="user_not_found")
+        if validated_token[CLAIM_VERSION] != actual:
+            # Cambió el plan o la cuenta se bloqueó: el cliente debe renovar el token
+            raise InvalidToken("Tu plan cambió. Renueva el token.")
+
+        return usuario_de_token(validated_token, user_id)
+
+
+def usuario_de_token(token, user_id):
+    User = get_user_model()
+    campos = [api_settings.USER_ID_FIELD, *CAMPOS_USUARIO, 'is_active']
+    valores = [user_id, *(token.get(campo, "") for campo in CAMPOS_USUARIO), True]
+    return User.from_db(router.db_for_read(User), campos, valores)
+
+
+class RefreshConClaimsSerializer(TokenRefreshSerializer):
+    """
+    Renovación que arma el access con los claims leídos de la base, no copiados
+    del refresh: así trae el plan y la versión de cupos actuales.
+    """
+
+    def validate(self, attrs):
+        User = get_user_model()
+        try:
+            data = super().validate(attrs)
+        except User.DoesNotExist:
+            raise AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+
+        refresh = self.token_class(data.get('refresh', attrs['refresh']))
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM)
+        user = User.objects.select_related('profile').filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        if user is None:
+            raise AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+
+        access = AccessToken.for_user(user)
+        profile = getattr(user, 'profile', None)
+        if profile is not None:
+            agregar_claims(access, user, profile)
+        data['access'] = str(access)
+        return data
@@ -0,0 +1,225 @@
+# core/crypto.py
+"""
+Llavero de cifrado con versiones, para poder rotar la llave maestra.
+
+Las llaves vienen de settings.ENCRYPTION_KEYS (separadas por coma, la primera
+es la vigente) o, si no está, de la ENCRYPTION_KEY de siempre. La vigente cifra
+todo lo nuevo; cualquiera de la lista sirve para descifrar. Para rotar:
+
+  1. agregar la llave nueva al inicio de ENCRYPTION_KEYS y reiniciar,
+  2. correr `manage.py recifrar --solo llaves` (re-envuelve las DEK; sin --solo
+     además pasa a la DEK lo que siga cifrado con una maestra),
+  3. quitar la llave vieja de la lista.
+
+El llavero se arma una sola vez por proceso (y se rehace solo si cambian los settings).
+
+Cifrado de sobre: cada usuario tiene su propia llave de datos (DEK), guardada en
+Profile.dek_cifrada envuelta con la llave maestra. Sus cuentas y archivos se cifran
+con la DEK, así rotar la maestra solo re-envuelve una llave por usuario y borrar la
+DEK deja ilegible toda su bóveda. Las DEK ya abiertas viven en una caché acotada
+con vencimiento, para no desenvolverlas en cada request.
+"""
+import base64
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from django.conf import settings
+
+
+def _derive(raw, info):
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info).derive(raw)
+
+
+class Llave:
+    """Una versión de la llave maestra y todo lo que se deriva de ella."""
+
+    def __init__(self, fernet_key):
+        self.fernet_key = fernet_key
+        self.fernet = Fernet(fernet_key)
+        raw = base64.urlsafe_b64decode(fernet_key)
+        # Llave AES-256 para los .enc segmentados y su id (va en la cabecera)
+        self.stream_key = _derive(raw, b"niun-vault-stream")
+        self.id = hashlib.sha256(self.stream_key).digest()[:4]
+        self.dedup_key = _derive(raw, b"niun-vault-dedup")
+
+
+class Llavero:
+    def __init__(self, fernet_keys):
+        if not fernet_keys:
+            raise ValueError("No se encontró la ENCRYPTION_KEY en el archivo .env")
+        self.llaves = [Llave(k) for k in fernet_keys]
+        self.vigente = self.llaves[0]
+        self.fernet = MultiFernet([llave.fernet for llave in self.llaves])
+        self._por_id = {llave.id: llave for llave in reversed(self.llaves)}
+
+    def stream_key(self, kid=None):
+        """Llave de archivos para un id de cabecera (None = la vigente)."""
+        if kid is None:
+            return self.vigente.stream_key
+        llave = self._por_id.get(bytes(kid))
+        if llave is None:
+            raise KeyError("El archivo fue cifrado con una llave que ya no está en ENCRYPTION_KEYS.")
+        return llave.stream_key
+
+    def es_vigente(self, token):
+        """True si el token Fernet ya está cifrado con la llave vigente."""
+        try:
+            self.vigente.fernet.decrypt(token)
+            return True
+        except InvalidToken:
+            return False
+
+    def rotar(self, token):
+        """Re-cifra un token Fernet con la llave vigente (falla si ninguna llave lo abre)."""
+        return self.fernet.rotate(token)
+
+    def envolver(self, dek):
+        return self.fernet.encrypt(dek).decode()
+
+    def desenvolver(self, dek_cifrada):
+        return self.fernet.decrypt(dek_cifrada.encode())
+
+
+def _keys_configuradas():
+    keys = getattr(settings, 'ENCRYPTION_KEYS', None) or getattr(settings, 'ENCRYPTION_KEY', None) or ""
+    if isinstance(keys, str):
+        keys = keys.split(",")
+    return tuple(k.strip() for k in keys if k and k.strip())
+
+
+@lru_cache(maxsize=4)
+def _llavero(keys):
+    return Llavero([k.encode() for k in keys])
+
+
+def get_llavero():
+    return _llavero(_keys_configuradas())
+
+
+# --- Llaves de datos por usuario ---
+
+# Marca de los textos cifrados con la DEK del usuario (los tokens Fernet empiezan con "gAAAA")
+DEK_PREFIX = "u1$"
+# Valor de Profile.dek_cifrada tras destruirla: no se vuelve a generar otra
+DEK_DESTRUIDA = "!destruida"
+
+
+class CacheLlaves:
+    """LRU con vencimiento por tiempo, segura entre hilos (la subida en lote usa un pool)."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            item = self._datos.get(clave)
+            if item is None:
+                return None
+            valor, vence = item
+            if vence < time.monotonic():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def put(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (valor, time.monotonic() + self.ttl)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_size:
+                self._datos.popitem(last=False)
+
+    def olvidar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+_cache_llaves = CacheLlaves(
+    max_size=getattr(settings, 'VAULT_DEK_CACHE_SIZE', 1024),
+    ttl=getattr(settings, 'VAULT_DEK_CACHE_TTL', 300),
+)
+
+
+def llave_de_usuario(user_id):
+    """
+    Llave de datos del usuario, ya desenvuelta. Se crea la primera vez que se pide.
+    Otro proceso puede tenerla en caché hasta VAULT_DEK_CACHE_TTL segundos después
+    de destruirla; en este, olvidar_llave() la saca al instante.
+    """
+    llave = _cache_llaves.get(user_id)
+    if llave is not None:
+        return llave
+
+    # Import tardío: core no depende de cuentas al cargar
+    from cuentas.models import Profile
+    dek_cifrada = Profile.objects.filter(user_id=user_id).values_list('dek_cifrada', flat=True).first()
+    if dek_cifrada is None:
+        raise ValueError(f"El usuario {user_id} no tiene perfil: no hay llave de datos.")
+    if dek_cifrada == DEK_DESTRUIDA:
+        raise ValueError(f"La llave de datos del usuario {user_id} fue destruida.")
+    if not dek_cifrada:
+        nueva = get_llavero().envolver(base64.urlsafe_b64encode(os.urandom(32)))
+        # Solo gana el primero que la crea; los demás leen la suya
+        Profile.objects.filter(user_id=user_id, dek_cifrada="").update(dek_cifrada=nueva)
+        dek_cifrada = Profile.objects.filter(user_id=user_id).values_list('dek_cifrada', flat=True).get()
+
+    llave = Llave(get_llavero().desenvolver(dek_cifrada))
+    _cache_llaves.put(user_id, llave)
+    return llave
+
+
+def olvidar_llave(user_id):
+    _cache_llaves.olvidar(user_id)
+
+
+def es_texto_de_usuario(token):
+    return bool(token) and token.startswith(DEK_PREFIX)
+
+
+# --- Operaciones por lote ---
+
+def encrypt_many(textos, llave=None):
+    """
+    Cifra una lista de textos; los vacíos quedan en None, como encrypt_text.
+    Con `llave` (ver llave_de_usuario) se cifra con la DEK del usuario.
+    """
+    if llave is None:
+        f, prefijo = get_llavero().vigente.fernet, ""
+    else:
+        f, prefijo = llave.fernet, DEK_PREFIX
+    return [prefijo + f.encrypt(t.encode()).decode() if t else None for t in textos]
+
+
+def decrypt_many(tokens, llave=None, error="Error al desencriptar"):
+    """Descifra una lista de tokens; los que no abren quedan como `error`."""
+    maestra = get_llavero().fernet
+    resultado = []
+    for token in tokens:
+        if not token:
+            resultado.append(None)
+            continue
+        try:
+            if es_texto_de_usuario(token):
+                if llave is None:
+                    raise InvalidToken
+                resultado.append(llave.fernet.decrypt(token[len(DEK_PREFIX):].encode()).decode())
+            else:
+                # Cifrado con la maestra, de antes de las llaves por usuario
+                resultado.append(maestra.decrypt(token.encode()).decode())
+        except InvalidToken:
+            resultado.append(error)
+    return resultado
@@ -0,0 +1,244 @@
+# core/middleware.py
+import hashlib
+import json
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.http.multipartparser import MultiPartParserError
+from django.utils.module_loading import import_string
+
+from core.auth.hashers import ServidorOcupado
+
+
+class ServidorOcupadoMiddleware:
+    """
+    503 con Retry-After cuando el control de admisión de Argon2 rechaza un hash
+    fuera de DRF (login del admin, por ejemplo). En las vistas de DRF ya lo
+    resuelve su exception_handler.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, ServidorOcupado):
+            return None
+        respuesta = JsonResponse({"detail": str(exception.detail)}, status=exception.status_code)
+        respuesta['Retry-After'] = str(exception.wait)
+        return respuesta
+
+
+# --- Límite de intentos (ventana deslizante) ---
+#
+# Login, registro y PIN cuestan Argon2, y a los 10 fallos la cuenta se borra:
+# un atacante que prueba contraseñas gasta CPU y además elimina cuentas ajenas.
+# Este middleware corta esos intentos antes de que DRF autentique o se haga un
+# solo hash, según las reglas de VAULT_RATELIMIT_REGLAS:
+#     (método, ruta, clave, límite, ventana en segundos)
+# donde la clave es 'ip', 'email' (del cuerpo del request) o 'user' (del JWT).
+# El email se lee de cuerpos JSON, de formulario o multipart de hasta
+# VAULT_RATELIMIT_MAX_CUERPO bytes; uno más grande se rechaza con 413, y sin un
+# correo legible el intento se cuenta por IP bajo la misma regla: cambiar el
+# formato del cuerpo no saca al request del límite.
+#
+# Cada clave lleva un contador por ventana fija y se estima la ventana
+# deslizante ponderando la anterior por lo que aún cubre:
+#     anterior * (1 - transcurrido / ventana) + actual
+# Los contadores viven en VAULT_RATELIMIT_BACKEND. ContadorEnCache usa la caché
+# de Django, compartida entre workers si CACHES apunta a Redis o Memcached (sin
+# CACHES es LocMemCache, que vale como reemplazo local). ContadorEnMemoria
+# cuenta solo en el proceso. Aparte, cada proceso recuerda las claves ya
+# bloqueadas y las rechaza hasta que vence el bloqueo sin consultar el backend.
+
+class CuerpoDemasiadoGrande(Exception):
+    pass
+
+
+class ContadorEnMemoria:
+    """Contadores en el proceso: cada worker de gunicorn lleva los suyos."""
+    MAX_CLAVES = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores = {}  # clave -> [ventana, número de ventana, actual, anterior]
+
+    def contar(self, clave, ventana, ahora):
+        numero = int(ahora // ventana)
+        with self._lock:
+            entrada = self._contadores.get(clave)
+            if entrada is None or entrada[1] < numero - 1:
+                entrada = self._contadores[clave] = [ventana, numero, 0, 0]
+            elif entrada[1] == numero - 1:
+                entrada[1:] = [numero, 0, entrada[2]]
+            entrada[2] += 1
+            if len(self._contadores) > self.MAX_CLAVES:
+                self._podar(ahora)
+            return entrada[2], entrada[3]
+
+    def _podar(self, ahora):
+        vencidas = [c for c, (v, n, _, _) in self._contadores.items() if n < int(ahora // v) - 1]
+        for clave in vencidas:
+            del self._contadores[clave]
+
+
+class ContadorEnCache:
+    """Contadores en la caché de Django (VAULT_RATELIMIT_CACHE)."""
+
+    def __init__(self):
+        self.cache = caches[settings.VAULT_RATELIMIT_CACHE]
+
+    def contar(self, clave, ventana, ahora):
+        numero = int(ahora // ventana)
+        llave = f"rl:{clave}:{numero}"
+        # Dura dos ventanas: la siguiente la usa como "anterior"
+        self.cache.add(llave, 0, timeout=2 * ventana + 1)
+        try:
+            actual = self.cache.incr(llave)
+        except ValueError:
+            # Venció entre el add y el incr
+            self.cache.set(llave, 1, timeout=2 * ventana + 1)
+            actual = 1
+        anterior = self.cache.get(f"rl:{clave}:{numero - 1}", 0)
+        return actual, anterior
+
+
+def _segundos_de_espera(limite, actual, anterior, transcurrido, ventana):
+    """Cuánto falta para que la estimación vuelva a quedar dentro del límite."""
+    if actual < limite and anterior:
+        # Basta con que la ventana anterior pese menos
+        return ventana * (1 - (limite - actual) / anterior) - transcurrido
+    # Hay que esperar a la ventana siguiente y que esta pese lo suficiente poco
+    return (ventana - transcurrido) + ventana * (1 - limite / max(actual, 1))
+
+
+class LimiteDeIntentosMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.contador = import_string(settings.VAULT_RATELIMIT_BACKEND)()
+        self.reglas = {}
+        for metodo, ruta, clave, limite, ventana in settings.VAULT_RATELIMIT_REGLAS:
+            self.reglas.setdefault((metodo, ruta), []).append((clave, limite, ventana))
+        self._lock = threading.Lock()
+        self._bloqueadas = {}  # clave del contador -> bloqueada hasta (time.time())
+
+    def __call__(self, request):
+        reglas = self.reglas.get((request.method, request.path_info))
+        if reglas and settings.VAULT_RATELIMIT_ACTIVO:
+            try:
+                espera = self.revisar(request, reglas)
+            except CuerpoDemasiadoGrande:
+                return JsonResponse({"detail": "El cuerpo del request es demasiado grande."}, status=413)
+            if espera:
+                respuesta = JsonResponse(
+                    {"detail": f"Demasiados intentos. Intenta de nuevo en {espera} segundos."}, status=429)
+                respuesta['Retry-After'] = str(espera)
+                return respuesta
+        return self.get_response(request)
+
+    def revisar(self, request, reglas):
+        """Cuenta el intento en cada regla, en orden. Devuelve los segundos de espera o 0."""
+        ahora = time.time()
+        for tipo, limite, ventana in reglas:
+            valor = self.identificar(request, tipo)
+            if not valor:
+                # Solo 'user' sin token: la vista responde 401 antes de hashear
+                continue
+            clave = f"{request.method}:{request.path_info}:{tipo}:{valor}:{ventana}"
+
+            hasta = self._bloqueadas.get(clave)
+            if hasta and hasta > ahora:
+                return math.ceil(hasta - ahora)
+
+            actual, anterior = self.contador.contar(clave, ventana, ahora)
+            transcurrido = ahora % ventana
+            if anterior * (1 - transcurrido / ventana) + actual > limite:
+                espera = max(1, math.ceil(_segundos_de_espera(limite, actual, anterior, transcurrido, ventana)))
+                self.bloquear(clave, ahora + espera, ahora)
+                return espera
+        return 0
+
+    def bloquear(self, clave, hasta, ahora):
+        with self._lock:
+            if len(self._bloqueadas) > ContadorEnMemoria.MAX_CLAVES:
+                self._bloqueadas = {c: h for c, h in self._bloqueadas.items() if h > ahora}
+            self._bloqueadas[clave] = hasta
+
+    def identificar(self, request, tipo):
+        if tipo == 'ip':
+            return ip_de(request)
+        if tipo == 'email':
+            email = email_del_cuerpo(request)
+            if not email:
+                return f"sin-email:{ip_de(request)}"
+            # En las llaves de la caché no queda el correo en claro
+            return hashlib.sha256(email.encode()).hexdigest()[:32]
+        if tipo == 'user':
+            return usuario_del_token(request)
+        raise ValueError(f"Clave de límite desconocida: {tipo}")
+
+
+def ip_de(request):
+    """IP del cliente; detrás de VAULT_RATELIMIT_PROXIES proxies propios se lee X-Forwarded-For."""
+    proxies = settings.VAULT_RATELIMIT_PROXIES
+    if proxies:
+        saltos = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+        # El último lo agregó nuestro proxy; los anteriores los pudo inventar el cliente
+        if len(saltos) >= proxies:
+            return saltos[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def email_del_cuerpo(request):
+    """
+    El campo 'email' de un cuerpo JSON, de formulario o multipart, normalizado,
+    o "" si no hay uno legible. Lanza CuerpoDemasiadoGrande si pasa de
+    VAULT_RATELIMIT_MAX_CUERPO.
+    """
+    tipo = request.content_type
+    try:
+        largo = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return ""
+    if largo > settings.VAULT_RATELIMIT_MAX_CUERPO:
+        raise CuerpoDemasiadoGrande()
+    if not largo:
+        return ""
+    # Se lee entero (ya acotado) antes de parsearlo: request.POST lo toma de
+    # request.body y DRF lo puede volver a leer después
+    cuerpo = request.body
+    if tipo == 'application/json':
+        try:
+            datos = json.loads(cuerpo)
+        except ValueError:
+            return ""
+    elif tipo in ('application/x-www-form-urlencoded', 'multipart/form-data'):
+        try:
+            datos = request.POST
+        except MultiPartParserError:
+            return ""
+    else:
+        return ""
+    email = datos.get('email') if hasattr(datos, 'get') else None
+    return email.strip().lower() if isinstance(email, str) else ""
+
+
+def usuario_del_token(request):
+    """Id del usuario del access token (firma y vencimiento), sin ir a la base."""
+    from rest_framework_simplejwt.exceptions import TokenError
+    from rest_framework_simplejwt.settings import api_settings
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    partes = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(partes) != 2 or partes[0] not in api_settings.AUTH_HEADER_TYPES:
+        return ""
+    try:
+        return str(AccessToken(partes[1])[api_settings.USER_ID_CLAIM])
+    except (TokenError, KeyError):
+        return ""
@@ -1,3 +1,256 @@
 from django.test import TestCase
 
-# Create your tests here.
+import io
+import threading
+from unittest import mock
+
+from cryptography.exceptions import InvalidTag
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from core.auth.hashers import Admision, ServidorOcupado, get_admision, set_admision
+from core.crypto import CacheLlaves
+from core.middleware import ContadorEnMemoria
+from core.utils import (
+    HEADER_SIZE, TAG_SIZE, EncryptedFormatError, StreamDecryptor, StreamEncryptor, encrypt_bytes,
+    iter_decrypt, stream_encrypted_size,
+)
+from cuentas.tests import PASSWORD, PIN, VaultTestCase, crear_usuario
+
+
+class LimiteDeIntentosTests(VaultTestCase):
+    def intento_login(self, client, email, formato='json', **extra):
+        datos = {'email': email, 'password': 'incorrecta', 'security_answer': 'incorrecta', **extra}
+        return client.post('/api/auth/login/', datos, format=formato)
+
+    def test_email_se_cuenta_en_cualquier_formato(self):
+        client = APIClient()
+        # Cambiar de JSON a formulario o multipart no reinicia el contador del correo
+        for formato in ('json', 'json', 'multipart', 'multipart', 'json'):
+            self.assertEqual(self.intento_login(client, self.user.email, formato).status_code, 401)
+        r = self.intento_login(client, self.user.email.upper(), 'multipart')
+        self.assertEqual(r.status_code, 429)
+        self.assertTrue(int(r['Retry-After']) > 0)
+
+        r = client.post('/api/auth/login/', f"email={self.user.email}&password=x",
+                        content_type='application/x-www-form-urlencoded')
+        self.assertEqual(r.status_code, 429)
+
+    def test_otro_correo_no_queda_bloqueado(self):
+        client = APIClient()
+        for _ in range(6):
+            self.intento_login(client, self.user.email)
+        beto = crear_usuario('beto')
+        r = client.post('/api/auth/login/', {
+            'email': beto.email, 'password': PASSWORD, 'security_answer': 'azul'}, format='json')
+        self.assertEqual(r.status_code, 200)
+
+    def test_cuerpo_grande_se_rechaza(self):
+        r = self.intento_login(APIClient(), self.user.email, 'multipart', relleno='x' * 20000)
+        self.assertEqual(r.status_code, 413)
+
+    def test_sin_correo_legible_se_cuenta_por_ip(self):
+        client = APIClient()
+        for _ in range(5):
+            r = client.post('/api/auth/login/', '{"email": ', content_type='application/json')
+            self.assertEqual(r.status_code, 400)
+        r = client.post('/api/auth/login/', self.user.email, content_type='text/plain')
+        self.assertEqual(r.status_code, 429)
+
+    def test_ip(self):
+        client = APIClient()
+        for i in range(20):
+            self.assertEqual(self.intento_login(client, f"otro{i}@niun.local").status_code, 401)
+        self.assertEqual(self.intento_login(client, 'otro99@niun.local').status_code, 429)
+        # Otra IP sigue entrando
+        r = client.post('/api/auth/login/', {'email': 'otro99@niun.local', 'password': 'x', 'security_answer': 'x'},
+                        format='json', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(r.status_code, 401)
+
+    def test_registro_por_ip(self):
+        client = APIClient()
+        for i in range(5):
+            r = client.post('/api/auth/register/', {
+                'username': f"nuevo{i}", 'email': f"nuevo{i}@niun.local", 'password': PASSWORD,
+                'pregunta_seguridad': 'color', 'respuesta_seguridad': 'azul', 'pin_boveda': PIN,
+            }, format='json')
+            self.assertEqual(r.status_code, 201, r.content)
+        r = client.post('/api/auth/register/', {'username': 'nuevo9'}, format='json')
+        self.assertEqual(r.status_code, 429)
+
+    def test_pin_por_usuario(self):
+        jwt = self.cliente_jwt(self.login(self.user)['access'])
+        for _ in range(5):
+            self.assertEqual(jwt.post('/api/security/', {'pin_boveda': '0000'}, format='json').status_code, 401)
+        self.assertEqual(jwt.post('/api/security/', {'pin_boveda': PIN}, format='json').status_code, 429)
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.intentos_fallidos, 5)
+
+    @override_settings(VAULT_RATELIMIT_ACTIVO=False)
+    def test_desactivado(self):
+        client = APIClient()
+        for _ in range(7):
+            self.assertEqual(self.intento_login(client, self.user.email).status_code, 401)
+
+
+class ContadorEnMemoriaTests(TestCase):
+    def test_ventana_anterior_pasa_a_ser_la_anterior(self):
+        contador = ContadorEnMemoria()
+        for _ in range(3):
+            contador.contar('k', 60, 100)
+        self.assertEqual(contador.contar('k', 60, 130), (1, 3))
+        # Dos ventanas después no queda nada
+        self.assertEqual(contador.contar('k', 60, 250), (1, 0))
+
+
+def cifrar(datos, segment_size=16):
+    return b''.join(StreamEncryptor(segment_size).iter_encrypt(io.BytesIO(datos)))
+
+
+class CifradoSegmentadoTests(TestCase):
+    def test_ida_y_vuelta(self):
+        for largo in (0, 1, 15, 16, 17, 100):
+            datos = bytes(range(largo))
+            enc = cifrar(datos)
+            self.assertEqual(len(enc), stream_encrypted_size(largo, 16))
+            self.assertEqual(b''.join(iter_decrypt(io.BytesIO(enc))), datos)
+
+    def test_rango_solo_lee_sus_segmentos(self):
+        datos = bytes(range(100))
+        decryptor = StreamDecryptor(io.BytesIO(cifrar(datos)))
+        self.assertEqual(decryptor.size, 100)
+        self.assertEqual(b''.join(decryptor.iter_range(20, 37)), datos[20:37])
+        self.assertEqual(b''.join(decryptor.iter_range(90)), datos[90:])
+
+    def test_truncado_se_detecta(self):
+        enc = cifrar(bytes(100))
+        # Sin el último segmento el que queda no lleva la bandera de cierre
+        with self.assertRaises(InvalidTag):
+            b''.join(iter_decrypt(io.BytesIO(enc[:HEADER_SIZE + 2 * (16 + TAG_SIZE)])))
+
+    def test_segmentos_reordenados_se_detectan(self):
+        enc = cifrar(bytes(range(64)))
+        seg = 16 + TAG_SIZE
+        cuerpo = enc[HEADER_SIZE:]
+        reordenado = enc[:HEADER_SIZE] + cuerpo[seg:2 * seg] + cuerpo[:seg] + cuerpo[2 * seg:]
+        with self.assertRaises(InvalidTag):
+            b''.join(iter_decrypt(io.BytesIO(reordenado)))
+
+    def test_cabecera_manipulada_se_detecta(self):
+        enc = bytearray(cifrar(b'hola'))
+        enc[HEADER_SIZE - 1] ^= 1
+        with self.assertRaises(InvalidTag):
+            b''.join(iter_decrypt(io.BytesIO(bytes(enc))))
+
+    def test_version_desconocida(self):
+        enc = bytearray(cifrar(b'hola'))
+        enc[4] = 9
+        with self.assertRaises(EncryptedFormatError):
+            b''.join(iter_decrypt(io.BytesIO(bytes(enc))))
+
+    def test_blob_fernet_antiguo(self):
+        self.assertEqual(b''.join(iter_decrypt(io.BytesIO(encrypt_bytes(b'antiguo')))), b'antiguo')
+
+
+class CacheLlavesTests(TestCase):
+    def test_saca_la_menos_usada(self):
+        cache = CacheLlaves(max_size=2, ttl=60)
+        cache.put(1, 'a')
+        cache.put(2, 'b')
+        cache.get(1)
+        cache.put(3, 'c')
+        self.assertEqual((cache.get(1), cache.get(2), cache.get(3)), ('a', None, 'c'))
+
+    def test_vence(self):
+        cache = CacheLlaves(max_size=2, ttl=60)
+        with mock.patch('core.crypto.time.monotonic', return_value=1000):
+            cache.put(1, 'a')
+        with mock.patch('core.crypto.time.monotonic', return_value=1061):
+            self.assertIsNone(cache.get(1))
+
+
+def ocupar(prueba, admision):
+    """Otro hilo toma un lugar de `admision`; lo suelta la función devuelta (o el cleanup)."""
+    dentro, soltar = threading.Event(), threading.Event()
+
+    def trabajo():
+        with admision.entrar():
+            dentro.set()
+            soltar.wait(5)
+
+    hilo = threading.Thread(target=trabajo)
+    hilo.start()
+    dentro.wait(5)
+
+    def liberar():
+        soltar.set()
+        hilo.join()
+    prueba.addCleanup(liberar)
+    return liberar
+
+
+class AdmisionTests(TestCase):
+    def test_cola_llena(self):
+        admision = Admision(1, 0, 1)
+        ocupar(self, admision)
+        with self.assertRaises(ServidorOcupado) as error:
+            with admision.entrar():
+                pass
+        self.assertGreaterEqual(error.exception.wait, 1)
+        self.assertEqual(admision.metricas()['rechazados_cola_llena'], 1)
+
+    def test_espera_vencida(self):
+        admision = Admision(1, 1, 0.05)
+        ocupar(self, admision)
+        with self.assertRaises(ServidorOcupado):
+            with admision.entrar():
+                pass
+        self.assertEqual(admision.metricas()['rechazados_espera_vencida'], 1)
+
+    def test_espera_y_entra_al_liberarse(self):
+        admision = Admision(1, 1, 5)
+        liberar = ocupar(self, admision)
+        threading.Timer(0.05, liberar).start()
+        with admision.entrar():
+            self.assertEqual(admision.metricas()['en_curso'], 1)
+        self.assertEqual(admision.metricas()['admitidos'], 2)
+
+    def test_bloque_anidado_ocupa_un_solo_lugar(self):
+        admision = Admision(1, 0, 0)
+        with admision.entrar():
+            with admision.entrar():
+                self.assertEqual(admision.en_curso, 1)
+
+
+@override_settings(PASSWORD_HASHERS=['core.auth.hashers.Argon2Limitado'])
+class Argon2LimitadoTests(VaultTestCase):
+    def setUp(self):
+        super().setUp()
+        anterior = get_admision()
+        self.addCleanup(set_admision, anterior)
+        self.admision = Admision(1, 0, 0)
+        set_admision(self.admision)
+
+    def test_login_con_el_servidor_ocupado(self):
+        ocupar(self, self.admision)
+        r = APIClient().post('/api/auth/login/', {
+            'email': self.user.email, 'password': PASSWORD, 'security_answer': 'azul'}, format='json')
+        self.assertEqual(r.status_code, 503)
+        self.assertTrue(int(r['Retry-After']) >= 1)
+
+    def test_todo_hash_pasa_por_la_admision(self):
+        make_password('x')
+        self.assertEqual(self.admision.metricas()['admitidos'], 1)
+        ocupar(self, self.admision)
+        with self.assertRaises(ServidorOcupado):
+            make_password('x')
+
+    def test_metricas_solo_staff(self):
+        self.assertEqual(self.client.get('/api/metricas/hash/').status_code, 403)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.user.refresh_from_db()
+        r = self.cliente(self.user).get('/api/metricas/hash/')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()['concurrencia'], 1)
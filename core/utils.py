@@ -1,32 +1,387 @@
-from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.core.files.base import File
+import hashlib
+import hmac
 import os
+import struct
+import zlib
 from django.conf import settings
+from .crypto import get_llavero, encrypt_many, decrypt_many
 
 def get_fernet():
-    key = os.environ.get('ENCRYPTION_KEY')
-    if not key:
-        raise ValueError("No se encontró la ENCRYPTION_KEY en el archivo .env")
-    return Fernet(key)
+    # MultiFernet del llavero: cifra con la llave vigente y descifra con cualquiera
+    return get_llavero().fernet
 
-def encrypt_text(text):
-    if not text:
-        return None
-    f = get_fernet()
-    return f.encrypt(text.encode()).decode()
+def encrypt_text(text, llave=None):
+    # Con `llave` (DEK del usuario, ver core.crypto.llave_de_usuario) el token lleva prefijo
+    return encrypt_many([text], llave)[0]
+
+def decrypt_text(encrypted_text, llave=None):
+    return decrypt_many([encrypted_text], llave)[0]
 
-def decrypt_text(encrypted_text):
-    if not encrypted_text:
-        return None
-    f = get_fernet()
-    try:
-        return f.decrypt(encrypted_text.encode()).decode()
-    except Exception:
-        return "Error al desencriptar"
-    
 def encrypt_bytes(data_bytes):
     f = get_fernet() # Ahora: Usa la misma lógica que el resto
     return f.encrypt(data_bytes)
 
 def decrypt_bytes(encrypted_data_bytes):
     f = get_fernet() # Ahora: Usa la misma lógica que el resto
-    return f.decrypt(encrypted_data_bytes)
\ No newline at end of file
+    return f.decrypt(encrypted_data_bytes)
+
+
+# --- Cifrado por segmentos para archivos de la bóveda ---
+#
+# Formato (.enc v1):
+#   cabecera = MAGIC (4) | versión (1) | tamaño de segmento (4) | id de llave (4) | prefijo nonce (7)
+#   luego N segmentos AES-GCM de hasta SEGMENT_SIZE bytes de texto plano + 16 de tag.
+# El nonce de cada segmento es prefijo + contador (4) + bandera de último segmento (1),
+# así no se pueden reordenar, duplicar ni truncar segmentos sin que falle la verificación.
+# La cabecera completa va como dato asociado de cada segmento.
+
+STREAM_MAGIC = b"NIUN"
+STREAM_VERSION = 1
+SEGMENT_SIZE = 64 * 1024
+TAG_SIZE = 16
+_HEADER = struct.Struct(">4sBI4s7s")
+HEADER_SIZE = _HEADER.size
+
+
+class EncryptedFormatError(ValueError):
+    pass
+
+
+def get_stream_key(kid=None, llave=None):
+    """
+    Llave AES-256 para archivos. Sin `kid` es la de cifrar: la DEK del usuario si
+    viene `llave`, si no la maestra vigente. Con `kid` (de una cabecera) es la que
+    corresponde: la DEK si coincide, o alguna maestra del llavero (archivos antiguos).
+    """
+    if llave is not None and (kid is None or bytes(kid) == llave.id):
+        return llave.stream_key
+    return get_llavero().stream_key(kid)
+
+
+def content_hasher(llave):
+    """
+    HMAC-SHA256 del texto plano, con la llave de deduplicación de la DEK del usuario.
+    Sirve para deduplicar sin que el mismo archivo de dos usuarios dé el mismo hash.
+    """
+    return hmac.new(llave.dedup_key, digestmod=hashlib.sha256)
+
+
+def content_digest(llave, chunks):
+    mac = content_hasher(llave)
+    for chunk in chunks:
+        mac.update(chunk)
+    return mac.hexdigest()
+
+
+def key_id(key):
+    return hashlib.sha256(key).digest()[:4]
+
+
+def _segment_nonce(prefix, index, last):
+    return prefix + struct.pack(">IB", index, 1 if last else 0)
+
+
+def stream_encrypted_size(plain_size, segment_size=SEGMENT_SIZE):
+    """Tamaño exacto del .enc segmentado para un texto plano de `plain_size` bytes."""
+    segments = max(1, -(-plain_size // segment_size))
+    return HEADER_SIZE + plain_size + segments * TAG_SIZE
+
+
+class StreamEncryptor:
+    """Cifra un flujo segmento a segmento sin tenerlo completo en memoria."""
+
+    def __init__(self, segment_size=SEGMENT_SIZE, header=None, llave=None):
+        if header is None:
+            key = get_stream_key(llave=llave)
+            header = _HEADER.pack(
+                STREAM_MAGIC, STREAM_VERSION, segment_size, key_id(key), os.urandom(7)
+            )
+        else:
+            # Continuar un archivo ya empezado (subidas reanudables), con su misma llave
+            _, _, segment_size, kid, _ = _HEADER.unpack(bytes(header))
+            try:
+                key = get_stream_key(kid, llave)
+            except KeyError as e:
+                raise EncryptedFormatError(str(e))
+        self.aead = AESGCM(key)
+        self.segment_size = segment_size
+        self.header = bytes(header)
+        self.prefix = self.header[-7:]
+
+    def encrypt_segment(self, index, data, last):
+        nonce = _segment_nonce(self.prefix, index, last)
+        return self.aead.encrypt(nonce, data, self.header)
+
+    def iter_encrypt(self, source):
+        """Genera cabecera + segmentos cifrados leyendo `source` por bloques."""
+        yield self.header
+        index = 0
+        current = _read_full(source, self.segment_size)
+        while True:
+            following = _read_full(source, self.segment_size) if len(current) == self.segment_size else b""
+            last = not following
+            yield self.encrypt_segment(index, current, last)
+            if last:
+                break
+            current = following
+            index += 1
+
+
+    def iter_encrypt_chunk(self, source, first_index, length, final):
+        """
+        Cifra exactamente `length` bytes de `source` como los segmentos que parten
+        en `first_index`. Si `final` es True el último lleva la bandera de cierre.
+        """
+        index = first_index
+        remaining = length
+        while True:
+            expected = min(self.segment_size, remaining)
+            data = _read_full(source, expected)
+            if len(data) != expected:
+                raise EncryptedFormatError("El trozo llegó incompleto.")
+            remaining -= expected
+            done = remaining == 0
+            yield self.encrypt_segment(index, data, final and done)
+            if done:
+                break
+            index += 1
+        if source.read(1):
+            raise EncryptedFormatError("El trozo trae más datos de los declarados.")
+
+
+def _read_full(source, size):
+    # read() de un upload puede devolver menos de lo pedido sin estar en EOF
+    parts = []
+    remaining = size
+    while remaining > 0:
+        chunk = source.read(remaining)
+        if not chunk:
+            break
+        parts.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(parts)
+
+
+# --- Compresión previa al cifrado ---
+# Lo cifrado no se puede comprimir, así que se comprime antes. Se decide con una
+# muestra del inicio: si no baja lo suficiente (JPEG, ZIP, video...) se guarda tal cual.
+
+CODEC_IDENTITY = 'identity'
+CODEC_ZLIB = 'zlib'
+COMPRESSION_SAMPLE_SIZE = 256 * 1024
+COMPRESSION_MIN_RATIO = 0.9
+_ALREADY_COMPRESSED = (
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/heic',
+    'video/', 'audio/',
+    'application/zip', 'application/gzip', 'application/x-7z-compressed',
+    'application/x-rar-compressed', 'application/x-bzip2', 'application/x-xz',
+)
+
+
+def choose_codec(source, content_type=None):
+    """Elige el codec para `source` comprimiendo una muestra del inicio."""
+    if content_type and content_type.startswith(_ALREADY_COMPRESSED):
+        return CODEC_IDENTITY
+    source.seek(0)
+    sample = _read_full(source, COMPRESSION_SAMPLE_SIZE)
+    source.seek(0)
+    return choose_codec_for_sample(sample)
+
+
+def choose_codec_for_sample(sample, content_type=None):
+    if content_type and content_type.startswith(_ALREADY_COMPRESSED):
+        return CODEC_IDENTITY
+    if not sample:
+        return CODEC_IDENTITY
+    ratio = len(zlib.compress(sample, 1)) / len(sample)
+    return CODEC_ZLIB if ratio < COMPRESSION_MIN_RATIO else CODEC_IDENTITY
+
+
+class CompressingReader:
+    """Vista de solo lectura que entrega `source` comprimido con zlib, de a poco."""
+
+    def __init__(self, source, level=6, block_size=SEGMENT_SIZE):
+        self.source = source
+        self.block_size = block_size
+        self._compressor = zlib.compressobj(level)
+        self._buffer = b""
+        self._eof = False
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            block = self.source.read(self.block_size)
+            if block:
+                self._buffer += self._compressor.compress(block)
+            else:
+                self._buffer += self._compressor.flush()
+                self._eof = True
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def iter_decompress(chunks, codec):
+    if codec == CODEC_IDENTITY:
+        yield from chunks
+        return
+    decompressor = zlib.decompressobj()
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+def iter_slice(chunks, start, stop):
+    """Recorta un flujo de bytes al rango [start, stop) sin juntarlo en memoria."""
+    offset = 0
+    for chunk in chunks:
+        end = offset + len(chunk)
+        if end > start and offset < stop:
+            yield chunk[max(start - offset, 0):stop - offset]
+        offset = end
+        if offset >= stop:
+            break
+
+
+class StreamEncryptedFile(File):
+    """
+    Envuelve un archivo subido y entrega su versión cifrada por `chunks()`.
+    El storage escribe segmento a segmento, así el worker nunca tiene
+    el archivo completo (ni en claro ni cifrado) en memoria.
+    Con codec 'zlib' el contenido se comprime antes de cifrarlo.
+    """
+
+    def __init__(self, source, name=None, segment_size=SEGMENT_SIZE, codec=CODEC_IDENTITY, llave=None):
+        super().__init__(source, name=name)
+        self.segment_size = segment_size
+        self.codec = codec
+        self.llave = llave
+        self._plain_size = source.size
+        self._written = None
+
+    @property
+    def size(self):
+        if self.codec == CODEC_IDENTITY:
+            return stream_encrypted_size(self._plain_size, self.segment_size)
+        # Comprimido: solo se sabe después de escribirlo
+        return self._written
+
+    def chunks(self, chunk_size=None):
+        if hasattr(self.file, 'seek'):
+            self.file.seek(0)
+        source = self.file
+        if self.codec == CODEC_ZLIB:
+            source = CompressingReader(source)
+        written = 0
+        for chunk in StreamEncryptor(self.segment_size, llave=self.llave).iter_encrypt(source):
+            written += len(chunk)
+            yield chunk
+        self._written = written
+
+    def multiple_chunks(self, chunk_size=None):
+        return True
+
+
+class GeneratedFile(File):
+    """File cuyo contenido sale de un iterable de bytes, para guardarlo en streaming."""
+
+    def __init__(self, chunks, name=None):
+        super().__init__(None, name=name)
+        self._chunks = chunks
+
+    def chunks(self, chunk_size=None):
+        yield from self._chunks
+
+    def multiple_chunks(self, chunk_size=None):
+        return True
+
+
+def read_stream_header(fileobj):
+    """Lee la cabecera v1. Devuelve None si el archivo es un token Fernet antiguo."""
+    head = fileobj.read(HEADER_SIZE)
+    if len(head) < HEADER_SIZE or not head.startswith(STREAM_MAGIC):
+        fileobj.seek(0)
+        return None
+    magic, version, segment_size, kid, prefix = _HEADER.unpack(head)
+    if version != STREAM_VERSION:
+        raise EncryptedFormatError(f"Versión de formato no soportada: {version}")
+    return {
+        'raw': head,
+        'version': version,
+        'segment_size': segment_size,
+        'key_id': kid,
+        'prefix': prefix,
+    }
+
+
+class StreamDecryptor:
+    """
+    Descifra un .enc abierto en modo binario, completo o por rangos de bytes.
+    En el formato segmentado solo se leen y descifran los segmentos que cubren
+    el rango pedido. Los blobs antiguos de un solo token Fernet se descifran
+    completos en memoria (no admiten otra cosa).
+    """
+
+    def __init__(self, fileobj, llave=None):
+        self.fileobj = fileobj
+        self.header = read_stream_header(fileobj)
+        self._legacy = None
+
+        if self.header is None:
+            self._legacy = decrypt_bytes(fileobj.read())
+            self.size = len(self._legacy)
+            return
+
+        try:
+            self.aead = AESGCM(get_stream_key(self.header['key_id'], llave))
+        except KeyError as e:
+            raise EncryptedFormatError(str(e))
+        self.segment_size = self.header['segment_size']
+        self.stored_segment = self.segment_size + TAG_SIZE
+        fileobj.seek(0, os.SEEK_END)
+        body = fileobj.tell() - HEADER_SIZE
+        self.segments = max(1, -(-body // self.stored_segment))
+        self.size = body - self.segments * TAG_SIZE
+        if self.size < 0:
+            raise EncryptedFormatError("Archivo cifrado truncado.")
+
+    def _decrypt_segment(self, index):
+        self.fileobj.seek(HEADER_SIZE + index * self.stored_segment)
+        data = _read_full(self.fileobj, self.stored_segment)
+        last = index == self.segments - 1
+        nonce = _segment_nonce(self.header['prefix'], index, last)
+        return self.aead.decrypt(nonce, data, self.header['raw'])
+
+    def iter_range(self, start=0, stop=None):
+        """Genera el texto plano de los bytes [start, stop)."""
+        if stop is None or stop > self.size:
+            stop = self.size
+        if self._legacy is not None:
+            yield self._legacy[start:stop]
+            return
+        if start >= stop:
+            if self.size == 0:
+                # Igual se verifica el único segmento (vacío) para detectar manipulación
+                self._decrypt_segment(0)
+            return
+
+        first = start // self.segment_size
+        last = (stop - 1) // self.segment_size
+        for index in range(first, last + 1):
+            plain = self._decrypt_segment(index)
+            offset = index * self.segment_size
+            yield plain[max(start - offset, 0):stop - offset]
+
+
+def iter_decrypt(fileobj, llave=None):
+    """
+    Genera el texto plano de un .enc abierto en modo binario.
+    Soporta el formato segmentado y los blobs antiguos de un solo token Fernet.
+    """
+    yield from StreamDecryptor(fileobj, llave).iter_range()
@@ -1,6 +1,25 @@
+import os
+
 from django.shortcuts import render
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from core.auth.hashers import get_admision
 
 # Create your views here.
 def test():
     print("Este es solo para saber si actions de github funciona, test 5")
-    pass
\ No newline at end of file
+    pass
+
+
+class MetricasHashView(APIView):
+    """
+    Contadores del control de admisión de Argon2 del proceso que responde.
+    Uso: GET /api/metricas/hash/ (solo staff). Cada worker lleva los suyos:
+    el pid dice cuál contestó.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({"pid": os.getpid(), **get_admision().metricas()})
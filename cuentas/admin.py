@@ -1,7 +1,7 @@
 from django.contrib import admin
-from django.db.models import Sum, Count
+from django.db.models import Sum
 from django.utils.timezone import now
-from .models import Account, Profile, PlanConfig, PackConfig, Anuncio, VaultFile
+from .models import Account, Profile, PlanConfig, PackConfig, Anuncio, VaultBlob, PurgaCuenta
 
 
 @admin.register(Anuncio)
@@ -27,6 +27,22 @@ class PackConfigAdmin(admin.ModelAdmin):
     list_editable = ('precio', 'extra_slots_cuentas', 'extra_gb')
 
 
+@admin.register(PurgaCuenta)
+class PurgaCuentaAdmin(admin.ModelAdmin):
+    list_display = ('user_id_original', 'motivo', 'estado', 'cuentas_borradas',
+                    'archivos_borrados', 'espacio_liberado', 'creada_en', 'completada_en')
+    list_filter = ('estado', 'motivo')
+    readonly_fields = [f.name for f in PurgaCuenta._meta.fields]
+
+    def espacio_liberado(self, obj):
+        return f"{round(obj.bytes_liberados / (1024 * 1024), 2)} MB"
+
+    espacio_liberado.short_description = "Espacio liberado"
+
+    def has_add_permission(self, request):
+        return False
+
+
 class ProfileInline(admin.StackedInline):
     model = Profile
     can_delete = False
@@ -39,20 +55,13 @@ class ProfileAdmin(admin.ModelAdmin):
                     'total_anuncios_vistos', 'fecha_registro')
     list_filter = ('plan', 'fecha_registro')
     search_fields = ('user__username', 'user__email')
-    
+    list_select_related = ('user', 'plan')
+
     def uso_almacenamiento(self, obj):
-        # Sumar bytes de todos los archivos del usuario
-        used_bytes = VaultFile.objects.filter(user=obj.user).aggregate(
-            Sum('size_bytes'))['size_bytes__sum'] or 0
-        
-        # Convertir a MB para visualización
-        used_mb = round(used_bytes / (1024 * 1024), 2)
-
-        # Calcular límite total (Plan Base + Extras)
-        base_gb = obj.plan.limite_gb_base if obj.plan else 0
-        total_gb = base_gb + obj.extra_gb_almacenamiento
-        
-        return f"{used_mb} MB / {total_gb} GB"
+        # Contador desnormalizado del perfil y límite del plan + extras
+        cupos = obj.cupos
+        used_mb = round(cupos.bytes_usados / (1024 * 1024), 2)
+        return f"{used_mb} MB / {cupos.gb} GB"
     
     uso_almacenamiento.short_description = "Almacenamiento (Usado / Total)"
 
@@ -86,8 +95,9 @@ class DashboardAdmin(admin.ModelAdmin):
         ingresos_mrr = Profile.objects.filter(plan__isnull=False).aggregate(
             Sum('plan__precio_mensual'))['plan__precio_mensual__sum'] or 0
 
-        total_bytes_app = VaultFile.objects.aggregate(
-            Sum('size_bytes'))['size_bytes__sum'] or 0
+        # Espacio real en disco (comprimido y deduplicado)
+        total_bytes_app = VaultBlob.objects.aggregate(
+            Sum('stored_bytes'))['stored_bytes__sum'] or 0
 
         # Convertir a GB
         total_gb_app = total_bytes_app / (1024 * 1024 * 1024)
@@ -132,5 +142,5 @@ class DashboardAdmin(admin.ModelAdmin):
 
 @admin.register(Account)
 class AccountAdmin(admin.ModelAdmin):
-    list_display = ('site_name', 'email', 'user', 'created_at')
+    list_display = ('site_name', 'email', 'user', 'created_at', 'congelada')
     search_fields = ('site_name', 'email', 'user__username')
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class CuentasConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cuentas'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+        from django.db.models.signals import post_save
+        from core.auth.jwt import olvidar_version_al_guardar
+
+        # Desactivar a un usuario invalida al instante sus access tokens (ver core/auth/jwt.py)
+        post_save.connect(olvidar_version_al_guardar, sender=User, dispatch_uid='jwt_olvidar_version')
@@ -0,0 +1,371 @@
+# cuentas/backup.py
+"""
+Respaldo completo de la bóveda de un usuario como un .tar generado en streaming.
+
+Contenido del archivo:
+  manifest.json             versión del formato y totales
+  cuentas/000001.jsonl ...  cuentas ya descifradas, una por línea, en bloques
+  archivos/<id>-<nombre>    contenido original de cada VaultFile; nombre, fecha y
+                            huella van en cabeceras PAX (niun.*)
+
+La exportación no usa archivos temporales: cada entrada se descifra y se envía
+segmento a segmento. La restauración lee el tar en modo stream y es reanudable:
+las cuentas que ya existen y los archivos ya restaurados se omiten.
+"""
+import json
+import mimetypes
+import tarfile
+import time
+import uuid
+
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from core.utils import (
+    StreamDecryptor, StreamEncryptedFile, CODEC_IDENTITY, COMPRESSION_SAMPLE_SIZE,
+    iter_decompress, choose_codec_for_sample, content_hasher, encrypt_text,
+    _read_full,
+)
+from core.crypto import llave_de_usuario, decrypt_many
+from .models import Account, VaultFile, VaultBlob, Profile, CuotaExcedida
+
+BACKUP_VERSION = 1
+ACCOUNTS_PER_MEMBER = 500
+FILES_PER_INSERT = 50
+BLOCK = tarfile.BLOCKSIZE
+# bulk_create no valida: al restaurar se revisan estos campos con clean_fields
+CAMPOS_VALIDADOS = {'email', 'site_url', 'site_name'}
+CAMPOS_TEXTO = ('password', 'secret', 'site_url', 'site_name', 'site_icon_url')
+MAX_LINEA = 1024 * 1024  # una cuenta exportada ocupa mucho menos
+
+
+class BackupInvalido(Exception):
+    pass
+
+
+# --- Exportación ---
+
+def _header(name, size, mtime=None, pax=None):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = mtime or time.time()
+    info.mode = 0o600
+    if pax:
+        info.pax_headers = pax
+    return info.tobuf(tarfile.PAX_FORMAT)
+
+
+def _padding(size):
+    return b"\0" * ((BLOCK - size % BLOCK) % BLOCK)
+
+
+def _bytes_member(name, data):
+    yield _header(name, len(data))
+    yield data
+    yield _padding(len(data))
+
+
+def _account_dict(account, password, secret):
+    return {
+        'id': str(account.id),
+        'email': account.email,
+        'password': password,
+        'secret': secret,
+        'site_url': account.site_url,
+        'site_name': account.site_name,
+        'site_icon_url': account.site_icon_url,
+        'created_at': account.created_at.isoformat(),
+    }
+
+
+def _accounts_member(numero, accounts, llave):
+    passwords = decrypt_many([a.password_encrypted for a in accounts], llave)
+    secrets = decrypt_many([a.secret_encrypted for a in accounts], llave)
+    lineas = [json.dumps(_account_dict(a, p, s)) for a, p, s in zip(accounts, passwords, secrets)]
+    yield from _bytes_member(f"cuentas/{numero:06d}.jsonl", ("\n".join(lineas) + "\n").encode())
+
+
+def _file_member(vault_file, llave):
+    codec = vault_file.blob.codec if vault_file.blob_id else CODEC_IDENTITY
+    safe_name = vault_file.name.replace('/', '_').replace('\\', '_')
+    pax = {
+        'niun.name': vault_file.name,
+        'niun.created_at': vault_file.created_at.isoformat(),
+        'niun.digest': (vault_file.blob.digest or '') if vault_file.blob_id else '',
+    }
+    yield _header(f"archivos/{vault_file.id}-{safe_name}", vault_file.size_bytes,
+                  mtime=vault_file.created_at.timestamp(), pax=pax)
+
+    written = 0
+    with vault_file.file.open('rb') as f:
+        for chunk in iter_decompress(StreamDecryptor(f, llave).iter_range(), codec):
+            written += len(chunk)
+            yield chunk
+    if written != vault_file.size_bytes:
+        # La cabecera ya salió con otro tamaño: mejor cortar que entregar un tar corrupto
+        raise BackupInvalido(f"El archivo {vault_file.pk} no tiene el tamaño registrado.")
+    yield _padding(written)
+
+
+def iter_backup(user):
+    """Genera el .tar completo de la bóveda de `user`, en memoria constante."""
+    llave = llave_de_usuario(user.id)
+    accounts = Account.objects.filter(user=user).order_by('created_at', 'id')
+    files = VaultFile.objects.filter(user=user).select_related('blob').order_by('created_at', 'id')
+
+    manifest = {
+        'version': BACKUP_VERSION,
+        'exportado_en': timezone.now().isoformat(),
+        'usuario': user.email,
+        'cuentas': accounts.count(),
+        'archivos': files.count(),
+    }
+    yield from _bytes_member('manifest.json', json.dumps(manifest).encode())
+
+    lote, numero = [], 0
+    for account in accounts.iterator(chunk_size=ACCOUNTS_PER_MEMBER):
+        lote.append(account)
+        if len(lote) == ACCOUNTS_PER_MEMBER:
+            numero += 1
+            yield from _accounts_member(numero, lote, llave)
+            lote = []
+    if lote:
+        numero += 1
+        yield from _accounts_member(numero, lote, llave)
+
+    for vault_file in files.iterator(chunk_size=100):
+        yield from _file_member(vault_file, llave)
+
+    # Fin del tar: dos bloques vacíos
+    yield b"\0" * (BLOCK * 2)
+
+
+# --- Restauración ---
+
+class _HashingReader:
+    """Lee la muestra ya leída y luego el resto, calculando la huella de paso."""
+
+    def __init__(self, sample, rest, hasher, size):
+        self.sample = sample
+        self.rest = rest
+        self.hasher = hasher
+        self.size = size
+        self.read_bytes = 0
+
+    def read(self, size=-1):
+        if self.sample:
+            data, self.sample = (self.sample, b"") if size < 0 else (self.sample[:size], self.sample[size:])
+        else:
+            data = self.rest.read(size)
+        self.hasher.update(data)
+        self.read_bytes += len(data)
+        return data
+
+
+def _nuevo_resumen():
+    return {
+        'cuentas_restauradas': 0,
+        'cuentas_omitidas': 0,
+        'cuentas_sin_cupo': 0,
+        'archivos_restaurados': 0,
+        'archivos_omitidos': 0,
+        'archivos_sin_espacio': 0,
+    }
+
+
+def _id_derivado(user, account_id):
+    return str(uuid.uuid5(uuid.UUID(account_id), str(user.id)))
+
+
+def _leer_registros(member, f):
+    """Registros de un cuentas/*.jsonl, línea a línea. Lanza BackupInvalido si alguno no sirve."""
+    # En modo stream el miembro no admite seek (TextIOWrapper lo pide): se leen
+    # bytes por línea, con tope, y se decodifican una por una
+    for numero, linea in enumerate(iter(lambda: f.readline(MAX_LINEA + 1), b""), start=1):
+        if len(linea) > MAX_LINEA:
+            raise BackupInvalido(f"{member.name}, línea {numero}: supera {MAX_LINEA} bytes.")
+        if not linea.strip():
+            continue
+        try:
+            registro = json.loads(linea.decode('utf-8'))
+            uuid.UUID(registro['id'])
+            if not isinstance(registro['email'], str):
+                raise ValueError("email no es texto")
+            for campo in CAMPOS_TEXTO:
+                if not isinstance(registro.get(campo), (str, type(None))):
+                    raise ValueError(f"{campo} no es texto")
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise BackupInvalido(f"{member.name}, línea {numero}: registro inválido ({e}).")
+        yield numero, registro
+
+
+def _restaurar_cuentas(user, member, f, resumen):
+    lote = []
+    for numero, registro in _leer_registros(member, f):
+        lote.append((numero, registro))
+        if len(lote) >= ACCOUNTS_PER_MEMBER:
+            _restaurar_lote(user, member, lote, resumen)
+            lote = []
+    _restaurar_lote(user, member, lote, resumen)
+
+
+def _restaurar_lote(user, member, lote, resumen):
+    if not lote:
+        return
+    llave = llave_de_usuario(user.id)
+    sin_validar = {campo.name for campo in Account._meta.fields} - CAMPOS_VALIDADOS
+    ids = [r['id'] for _, r in lote] + [_id_derivado(user, r['id']) for _, r in lote]
+    existentes = dict(Account.objects.filter(id__in=ids).values_list('id', 'user_id'))
+    existentes = {str(k): v for k, v in existentes.items()}
+
+    nuevas = []
+    for numero, registro in lote:
+        propietario = existentes.get(registro['id'])
+        if propietario == user.id or existentes.get(_id_derivado(user, registro['id'])) == user.id:
+            # Ya restaurada en un intento anterior (o repetida en el archivo)
+            resumen['cuentas_omitidas'] += 1
+            continue
+        account = Account(
+            user=user,
+            email=registro['email'],
+            password_encrypted=encrypt_text(registro.get('password'), llave) or '',
+            secret_encrypted=encrypt_text(registro.get('secret'), llave),
+            site_url=registro.get('site_url'),
+            site_name=registro.get('site_name'),
+            site_icon_url=registro.get('site_icon_url'),
+        )
+        # Si el id ya es de otro usuario se usa uno derivado, estable entre reintentos
+        account.id = registro['id'] if propietario is None else _id_derivado(user, registro['id'])
+        try:
+            account.clean_fields(exclude=sin_validar)
+        except ValidationError as e:
+            raise BackupInvalido(f"{member.name}, línea {numero}: {' '.join(e.messages)}")
+        account.preparar()
+        existentes[str(account.id)] = user.id
+        nuevas.append(account)
+
+    with transaction.atomic():
+        profile = Profile.objects.select_related('plan').select_for_update(of=('self',)).get(user=user)
+        cupo = max(0, profile.total_cuentas_permitidas - profile.cuentas_usadas)
+        aceptadas = Account.insertar_lote(user, nuevas[:cupo])
+
+    resumen['cuentas_restauradas'] += len(aceptadas)
+    resumen['cuentas_sin_cupo'] += len(nuevas) - len(aceptadas)
+
+
+def _restaurar_archivo(user, member, f, resumen):
+    """Cifra y guarda un archivo del tar. Devuelve el VaultFile por insertar (o None)."""
+    pax = member.pax_headers
+    try:
+        # Viene del tar: sin directorios, como los nombres de una subida
+        name = VaultFile.limpiar_nombre(pax.get('niun.name') or member.name)
+    except ValueError as e:
+        raise BackupInvalido(f"{member.name}: {e}")
+    digest_origen = pax.get('niun.digest')
+    size = member.size
+
+    if digest_origen and VaultFile.objects.filter(
+            user=user, name=name, blob__digest=digest_origen).exists():
+        resumen['archivos_omitidos'] += 1
+        return None
+
+    try:
+        Profile.reservar(user, bytes=size)
+    except CuotaExcedida:
+        resumen['archivos_sin_espacio'] += 1
+        return None
+
+    path = None
+    try:
+        sample = _read_full(f, COMPRESSION_SAMPLE_SIZE)
+        codec = choose_codec_for_sample(sample, mimetypes.guess_type(name)[0])
+        llave = llave_de_usuario(user.id)
+        reader = _HashingReader(sample, f, content_hasher(llave), size)
+
+        campo = VaultBlob._meta.get_field('file')
+        path = campo.generate_filename(None, f"{name}.enc")
+        path = default_storage.save(
+            path, StreamEncryptedFile(reader, name=path, codec=codec, llave=llave), max_length=campo.max_length)
+        if reader.read_bytes != size:
+            raise BackupInvalido(f"El archivo {name} llegó incompleto.")
+    except Exception:
+        Profile.ajustar_uso(user, bytes=-size)
+        if path:
+            default_storage.delete(path)
+        raise
+
+    digest = reader.hasher.hexdigest()
+    if VaultFile.objects.filter(user=user, name=name, blob__digest=digest).exists():
+        # Respaldo de otro usuario (su huella no sirve aquí) ya restaurado antes
+        Profile.ajustar_uso(user, bytes=-size)
+        default_storage.delete(path)
+        resumen['archivos_omitidos'] += 1
+        return None
+
+    contenido = _ArchivoGuardado(path, codec)
+    blob, _ = VaultBlob.guardar(user, digest, size, contenido, reservado=True)
+    return VaultFile(user=user, blob=blob, file=blob.file.name, name=name, size_bytes=size)
+
+
+class _ArchivoGuardado(str):
+    """Nombre de un .enc ya escrito en storage, con el codec que se usó."""
+
+    def __new__(cls, path, codec):
+        obj = super().__new__(cls, path)
+        obj.codec = codec
+        return obj
+
+
+def _insertar_archivos(pendientes, resumen):
+    if not pendientes:
+        return
+    try:
+        VaultFile.objects.bulk_create(pendientes)
+        Profile.tocar(pendientes[0].user_id, 'archivos')
+    except Exception:
+        # Sin fila que los use, los blobs vuelven a quedar libres
+        for vault_file in pendientes:
+            VaultBlob.liberar(vault_file.blob_id)
+        raise
+    resumen['archivos_restaurados'] += len(pendientes)
+    pendientes.clear()
+
+
+def restaurar_backup(user, stream, resumen=None):
+    """
+    Restaura un respaldo leyendo `stream` de forma secuencial.
+    Lo restaurado antes de un error queda guardado; volver a enviar el mismo
+    archivo continúa donde quedó. `resumen` se completa en el camino.
+    """
+    if resumen is None:
+        resumen = {}
+    resumen.update(_nuevo_resumen())
+    pendientes = []
+    try:
+        with tarfile.open(fileobj=stream, mode='r|') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                f = tar.extractfile(member)
+                if member.name == 'manifest.json':
+                    try:
+                        version = json.loads(f.read()).get('version')
+                    except (ValueError, AttributeError):
+                        raise BackupInvalido("El manifest.json del respaldo no es válido.")
+                    if version != BACKUP_VERSION:
+                        raise BackupInvalido(f"Versión de respaldo no soportada: {version}")
+                elif member.name.startswith('cuentas/'):
+                    _restaurar_cuentas(user, member, f, resumen)
+                elif member.name.startswith('archivos/'):
+                    vault_file = _restaurar_archivo(user, member, f, resumen)
+                    if vault_file is not None:
+                        pendientes.append(vault_file)
+                    if len(pendientes) >= FILES_PER_INSERT:
+                        _insertar_archivos(pendientes, resumen)
+    except tarfile.TarError as e:
+        raise BackupInvalido(f"El archivo no es un respaldo válido: {e}")
+    finally:
+        _insertar_archivos(pendientes, resumen)
+    return resumen
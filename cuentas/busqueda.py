@@ -0,0 +1,64 @@
+# cuentas/busqueda.py
+"""
+Normalización para el índice de búsqueda de cuentas (ver TerminoBusqueda).
+
+Todo se guarda en minúsculas, sin tildes y partido en palabras de [a-z0-9], así
+una búsqueda por prefijo se resuelve con un rango sobre un índice B-tree
+(termino >= 'git' AND termino < 'git\\uffff'), que sirve igual en SQLite y Postgres.
+"""
+import re
+import unicodedata
+from urllib.parse import urlparse
+
+TIPO_PALABRA = 0
+TIPO_DOMINIO = 1
+
+MAX_LARGO = 100
+_NO_ALFANUMERICO = re.compile(r"[^a-z0-9]+")
+# Segundos niveles comunes bajo un ccTLD: mercadolibre.com.ar, bbc.co.uk...
+_SEGUNDO_NIVEL = {'com', 'co', 'org', 'net', 'gob', 'gov', 'edu', 'ac', 'nom', 'mil'}
+
+
+def plegar(texto):
+    """Minúsculas y sin tildes ni diacríticos: 'Árbol Ñandú' -> 'arbol nandu'."""
+    texto = unicodedata.normalize('NFKD', texto or "")
+    return "".join(c for c in texto if not unicodedata.combining(c)).casefold()
+
+
+def palabras(texto):
+    return [p[:MAX_LARGO] for p in _NO_ALFANUMERICO.split(plegar(texto)) if p]
+
+
+def host_de(url):
+    if not url:
+        return ""
+    parsed = urlparse(url if "//" in url else f"//{url}")
+    host = (parsed.hostname or "").rstrip(".")
+    return plegar(host)
+
+
+def dominio_registrado(url):
+    """
+    Dominio registrado (sin subdominios) de una URL: https://mail.google.com/x -> google.com.
+    Heurística sin lista de sufijos públicos: cubre los casos tipo .com.ar / .co.uk.
+    """
+    etiquetas = [e for e in host_de(url).split(".") if e]
+    if len(etiquetas) < 2:
+        return ".".join(etiquetas)
+    if len(etiquetas) >= 3 and len(etiquetas[-1]) == 2 and etiquetas[-2] in _SEGUNDO_NIVEL:
+        return ".".join(etiquetas[-3:])
+    return ".".join(etiquetas[-2:])
+
+
+def terminos_de(account):
+    """Pares (termino, tipo) que se indexan para una cuenta, sin repetidos."""
+    terminos = set()
+    dominio = dominio_registrado(account.site_url)
+    if dominio:
+        terminos.add((dominio[:MAX_LARGO], TIPO_DOMINIO))
+    fuentes = [account.site_name, account.email, host_de(account.site_url)]
+    for fuente in fuentes:
+        for palabra in palabras(fuente):
+            if palabra != "www":
+                terminos.add((palabra, TIPO_PALABRA))
+    return terminos
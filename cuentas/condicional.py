@@ -0,0 +1,69 @@
+# cuentas/condicional.py
+"""
+GET condicional (ETag / If-None-Match) para los endpoints que los clientes
+consultan seguido: perfil, cuentas, archivos y anuncios.
+
+El ETag no sale de serializar la respuesta sino de las versiones del perfil
+(Profile.version_*, que cada escritura sube con Profile.tocar), así que un 304
+cuesta una sola lectura de una fila. Se calcula antes de correr la vista: si algo
+cambia mientras tanto, el cliente recibe datos nuevos con un ETag viejo y solo
+pierde el 304 siguiente, nunca se queda con datos viejos.
+"""
+import hashlib
+from functools import wraps
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from .models import Anuncio, Profile
+
+# Campos del perfil de los que depende cada recurso
+CAMPOS = {
+    # El perfil muestra el uso y los límites: cambia con cuentas, archivos y plan
+    'perfil': ('version_perfil', 'version_cuentas', 'version_archivos',
+               'bytes_usados', 'cuentas_usadas', 'plan_id'),
+    'cuentas': ('version_cuentas',),
+    'archivos': ('version_archivos',),
+}
+
+
+def calcular_etag(request, recurso):
+    """ETag fuerte para `recurso` tal como lo vería este request, o None si no aplica."""
+    if recurso == 'anuncios':
+        # Crear, editar o borrar uno cambia la fecha máxima o la cantidad
+        datos = Anuncio.objects.aggregate(cantidad=Count('id'), ultimo=Max('actualizado_en'))
+        partes = [datos['cantidad'], datos['ultimo'] and datos['ultimo'].isoformat()]
+    else:
+        fila = Profile.objects.filter(user=request.user).values_list(*CAMPOS[recurso]).first()
+        if fila is None:
+            return None
+        user = request.user
+        partes = [user.pk, user.username, user.email, *fila]
+    # La misma versión sirve para cualquier página, búsqueda o formato
+    partes += [request.get_full_path(), request.META.get('HTTP_ACCEPT', '')]
+    return '"%s"' % hashlib.sha256(repr(partes).encode()).hexdigest()[:32]
+
+
+def con_etag(recurso):
+    """
+    Decorador para el método GET de una vista DRF (get, list). Responde 304 sin
+    ejecutar la vista si el If-None-Match del cliente coincide.
+    """
+    def decorador(metodo):
+        @wraps(metodo)
+        def envoltura(self, request, *args, **kwargs):
+            etag = calcular_etag(request, recurso)
+            if etag is None:
+                return metodo(self, request, *args, **kwargs)
+
+            respuesta = get_conditional_response(request, etag=etag)
+            if respuesta is None:
+                respuesta = metodo(self, request, *args, **kwargs)
+            if respuesta.status_code in (200, 304):
+                respuesta['ETag'] = etag
+            # Cada cliente revalida su copia; ningún proxy la comparte
+            patch_cache_control(respuesta, private=True, no_cache=True)
+            patch_vary_headers(respuesta, ('Authorization',))
+            return respuesta
+        return envoltura
+    return decorador
@@ -0,0 +1,98 @@
+# cuentas/cupos.py
+"""
+Cupos de un usuario: lo que le dan su plan más los extras (packs, recompensas)
+y cuánto lleva usado. Es la única fuente de esa cuenta; vistas, serializers,
+permisos y el admin la piden aquí en vez de repetir la aritmética.
+
+Dentro de un request se usa cupos_de(request), que lee el perfil con su plan
+(select_related) una sola vez y lo deja guardado en el request.
+"""
+
+GB = 1024 * 1024 * 1024
+
+# Perfil sin plan asignado (perfiles antiguos o un plan borrado)
+SIN_PLAN = {
+    'nombre': "Plan Gratuito",
+    'cuentas': 10,
+    'gb': 0,
+    'notas': 10,
+    'recordatorios': 1,
+}
+
+
+class Cupos:
+    def __init__(self, profile):
+        plan = profile.plan
+        self.profile = profile
+        self.nombre_plan = plan.nombre if plan else SIN_PLAN['nombre']
+        self.es_premium = bool(plan and plan.sin_anuncios)
+
+        self.cuentas = (plan.slots_cuentas_base if plan else SIN_PLAN['cuentas']) + profile.extra_slots_cuentas
+        self.gb = (plan.limite_gb_base if plan else SIN_PLAN['gb']) + profile.extra_gb_almacenamiento
+        self.notas = (plan.slots_notas_base if plan else SIN_PLAN['notas']) + profile.extra_slots_notas
+        self.recordatorios = (
+            (plan.slots_recordatorios_base if plan else SIN_PLAN['recordatorios'])
+            + profile.extra_slots_recordatorios
+        )
+
+        # Contadores desnormalizados del perfil (ver Profile.reservar / ajustar_uso)
+        self.cuentas_usadas = profile.cuentas_usadas
+        self.bytes_usados = profile.bytes_usados
+
+    @property
+    def bytes(self):
+        return self.gb * GB
+
+    @property
+    def cuentas_restantes(self):
+        return max(0, self.cuentas - self.cuentas_usadas)
+
+    def cabe(self, cuentas=0, bytes=0):
+        """Chequeo rápido contra el uso leído; la reserva real va con el perfil bloqueado."""
+        if cuentas and self.cuentas_usadas + cuentas > self.cuentas:
+            return False
+        if bytes and self.bytes_usados + bytes > self.bytes:
+            return False
+        return True
+
+    def resumen(self):
+        """Límites y uso de todos los recursos juntos, como los muestra /api/profile/me/."""
+        usado_mb = round(self.bytes_usados / (1024 * 1024), 2)
+        total_mb = self.gb * 1024
+        return {
+            "cuentas": {
+                "usadas": self.cuentas_usadas,
+                "total": self.cuentas,
+                "restantes": self.cuentas_restantes,
+            },
+            "almacenamiento": {
+                "usado_mb": usado_mb,
+                "total_gb": self.gb,
+                "porcentaje": round((usado_mb / total_mb) * 100, 1) if total_mb > 0 else 0,
+            },
+            # Notas y recordatorios todavía no tienen modelo: no hay uso que contar
+            "notas": {
+                "total": self.notas,
+            },
+            "recordatorios": {
+                "total": self.recordatorios,
+            },
+        }
+
+
+def cupos_de(request):
+    """Cupos del usuario del request, calculados una sola vez por request."""
+    # En un Request de DRF se guarda en el HttpRequest de Django, que es el que vive todo el ciclo
+    base = getattr(request, '_request', request)
+    cupos = getattr(base, '_cupos', None)
+    if cupos is None:
+        from .models import Profile
+        profile, _ = Profile.objects.select_related('plan').get_or_create(user=request.user)
+        cupos = base._cupos = Cupos(profile)
+    return cupos
+
+
+def olvidar_cupos(request):
+    """Tras cambiar el plan o los extras dentro del mismo request."""
+    base = getattr(request, '_request', request)
+    base.__dict__.pop('_cupos', None)
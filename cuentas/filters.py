@@ -0,0 +1,88 @@
+# cuentas/filters.py
+from django.conf import settings
+from django.db.models import Case, When, IntegerField
+from rest_framework.filters import BaseFilterBackend
+
+from .busqueda import palabras, plegar, TIPO_DOMINIO
+from .models import TerminoBusqueda
+
+# Puntaje por palabra buscada y bono por dominio
+EXACTA = 2
+PREFIJO = 1
+DOMINIO_EXACTO = 10
+DOMINIO_PREFIJO = 5
+
+
+class BusquedaIndexada(BaseFilterBackend):
+    """
+    Reemplaza a SearchFilter en el listado de cuentas (?search=...).
+    Cada palabra se busca por prefijo en TerminoBusqueda con un rango sobre el
+    índice (user, termino), en vez de un ILIKE '%x%' por columna. Todas las
+    palabras deben aparecer; los resultados salen ordenados por relevancia
+    (dominio exacto > dominio por prefijo > palabra exacta > palabra por prefijo)
+    y se cortan en VAULT_SEARCH_MAX_RESULTS.
+    """
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        consulta = request.query_params.get(self.search_param, '').strip()
+        if not consulta:
+            return queryset
+
+        puntajes = buscar(request.user, consulta)
+        if not puntajes:
+            return queryset.none()
+
+        mejores = sorted(puntajes, key=puntajes.get, reverse=True)[:settings.VAULT_SEARCH_MAX_RESULTS]
+        ranking = Case(
+            *[When(pk=pk, then=puntajes[pk]) for pk in mejores],
+            output_field=IntegerField(),
+        )
+        return queryset.filter(pk__in=mejores).annotate(relevancia=ranking).order_by(
+            '-relevancia', '-created_at', '-id')
+
+
+def _rango(prefijo):
+    return {'termino__gte': prefijo, 'termino__lt': prefijo + '\uffff'}
+
+
+def buscar(user, consulta):
+    """Devuelve {account_id: puntaje} de las cuentas de `user` que calzan con `consulta`."""
+    # Un prefijo corto ("a") puede calzar con miles de términos: se leen en orden
+    # del índice (las coincidencias exactas quedan primero) y hasta un tope
+    tope = settings.VAULT_SEARCH_MAX_RESULTS * 20
+    puntajes = None
+    for palabra in palabras(consulta)[:5]:
+        encontrados = {}
+        filas = TerminoBusqueda.objects.filter(user=user, **_rango(palabra)).order_by(
+            'termino').values_list('account_id', 'termino')[:tope]
+        for account_id, termino in filas:
+            puntaje = EXACTA if termino == palabra else PREFIJO
+            encontrados[account_id] = max(encontrados.get(account_id, 0), puntaje)
+        if puntajes is None:
+            puntajes = encontrados
+        else:
+            puntajes = {pk: puntajes[pk] + p for pk, p in encontrados.items() if pk in puntajes}
+        if not puntajes:
+            break
+
+    # Búsquedas tipo "github.com" o "mercadolibre.c": se compara contra el dominio completo
+    dominio = plegar(consulta).replace(" ", "")
+    if "." in dominio:
+        filas = TerminoBusqueda.objects.filter(
+            user=user, tipo=TIPO_DOMINIO, **_rango(dominio)).order_by(
+            'termino').values_list('account_id', 'termino')[:tope]
+        puntajes = dict(puntajes or {})
+        for account_id, termino in filas:
+            bono = DOMINIO_EXACTO if termino == dominio else DOMINIO_PREFIJO
+            puntajes[account_id] = puntajes.get(account_id, 0) + bono
+    elif puntajes:
+        # Una palabra que es el nombre del dominio ("github") también lo prioriza
+        filas = TerminoBusqueda.objects.filter(
+            user=user, tipo=TIPO_DOMINIO, account_id__in=list(puntajes),
+            **_rango(dominio)).values_list('account_id', 'termino')
+        for account_id, termino in filas:
+            exacto = termino.split(".", 1)[0] == dominio
+            puntajes[account_id] += DOMINIO_EXACTO if exacto else DOMINIO_PREFIJO
+
+    return puntajes or {}
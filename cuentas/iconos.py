@@ -0,0 +1,140 @@
+# cuentas/iconos.py
+"""
+Caché de favicons en el servidor, compartida entre usuarios (ver Icono).
+
+Antes cada cuenta apuntaba a icons.duckduckgo.com y cada cliente bajaba los
+mismos iconos de un tercero. Ahora las cuentas apuntan a /api/iconos/<dominio>/
+y el comando `actualizar_iconos` los descarga una vez por dominio y los
+refresca cada VAULT_ICONOS_TTL_DIAS.
+
+La descarga la hace la función de VAULT_ICONOS_FETCHER: recibe el dominio y
+devuelve (contenido, content_type), o None si el sitio no tiene icono; ante un
+error pasajero lanza una excepción y se reintenta más tarde. Lo que entrega se
+valida con tipo_de_imagen(). `sin_red` sirve de
+reemplazo local para desarrollo y pruebas.
+
+El dominio lo escribe el usuario, así que descargar_favicon no debe servir
+para llegar a la red interna: dominio_de descarta IPs y nombres internos, la
+conexión se hace solo a direcciones públicas (la misma IP que se verificó, no
+una segunda resolución) y las redirecciones no se siguen.
+"""
+import http.client
+import ipaddress
+import re
+import socket
+import ssl
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Ruta de IconoView (cuentas/urls.py); va guardada en Account.site_icon_url
+PREFIJO_URL = "/api/iconos/"
+PREFIJO_DUCKDUCKGO = "https://icons.duckduckgo.com/ip3/"
+
+# El TLD empieza con letra: descarta IPs escritas como dominio (169.254.169.254, 127.1)
+_DOMINIO_VALIDO = re.compile(r"^[a-z0-9-]+(\.[a-z0-9-]+)*\.[a-z][a-z0-9-]*$")
+# Nombres que solo resuelven dentro de una red privada
+_SUFIJOS_INTERNOS = ('.localhost', '.localdomain', '.local', '.internal', '.lan', '.arpa')
+# SVG no: se sirve desde nuestro dominio y puede traer scripts
+TIPOS_IMAGEN = ('image/x-icon', 'image/vnd.microsoft.icon', 'image/png', 'image/gif',
+                'image/jpeg', 'image/webp')
+# Muchos sitios sirven el favicon como application/octet-stream
+_FIRMAS = [
+    (b"\x00\x00\x01\x00", 'image/x-icon'),
+    (b"\x89PNG", 'image/png'),
+    (b"GIF8", 'image/gif'),
+    (b"\xff\xd8\xff", 'image/jpeg'),
+]
+
+
+def dominio_de(url):
+    """Host de una URL listo para usar de llave: minúsculas, sin www. y en IDNA."""
+    if not url:
+        return ""
+    try:
+        host = urlparse(url if "//" in url else f"//{url}").hostname or ""
+        host = host.rstrip(".").lower().encode("idna").decode("ascii")
+    except (UnicodeError, ValueError):
+        return ""
+    if host.startswith("www."):
+        host = host[4:]
+    if len(host) > 253 or not _DOMINIO_VALIDO.match(host) or f".{host}".endswith(_SUFIJOS_INTERNOS):
+        return ""
+    return host
+
+
+def url_de_icono(dominio):
+    return f"{PREFIJO_URL}{dominio}/"
+
+
+def es_url_de_icono(url):
+    """True si `url` es un icono de esta caché (o de DuckDuckGo), no uno propio del usuario."""
+    return bool(url) and url.startswith((PREFIJO_URL, PREFIJO_DUCKDUCKGO))
+
+
+def get_fetcher():
+    return import_string(settings.VAULT_ICONOS_FETCHER)
+
+
+class DireccionNoPermitida(Exception):
+    pass
+
+
+def direccion_publica(host, puerto):
+    """IP a la que conectarse para `host`, si todas las que resuelve son públicas."""
+    ips = {ipaddress.ip_address(info[4][0])
+           for info in socket.getaddrinfo(host, puerto, type=socket.SOCK_STREAM)}
+    if not ips or any(not ip.is_global for ip in ips):
+        raise DireccionNoPermitida(f"{host} resuelve a una dirección no pública.")
+    return str(min(ips, key=lambda ip: ip.version))
+
+
+class _ConexionPublica(http.client.HTTPSConnection):
+    """HTTPS que se conecta a la IP verificada por direccion_publica, con SNI y certificado del host."""
+
+    def __init__(self, host, **kwargs):
+        self.contexto = ssl.create_default_context()
+        super().__init__(host, context=self.contexto, **kwargs)
+
+    def connect(self):
+        sock = socket.create_connection((direccion_publica(self.host, self.port), self.port), self.timeout)
+        self.sock = self.contexto.wrap_socket(sock, server_hostname=self.host)
+
+
+def descargar_favicon(dominio):
+    """Fetcher por defecto: https://<dominio>/favicon.ico, sin seguir redirecciones."""
+    limite = settings.VAULT_ICONOS_MAX_BYTES
+    conexion = _ConexionPublica(dominio, timeout=settings.VAULT_ICONOS_TIMEOUT)
+    try:
+        conexion.request('GET', '/favicon.ico', headers={'User-Agent': 'niun-vault-iconos/1.0'})
+        respuesta = conexion.getresponse()
+        # Una redirección podría llevar a la red interna: se trata como sitio sin icono
+        if respuesta.status in (404, 410) or 300 <= respuesta.status < 400:
+            return None
+        if respuesta.status != 200:
+            raise OSError(f"HTTP {respuesta.status} al pedir el icono de {dominio}")
+        content_type = respuesta.headers.get_content_type()
+        contenido = respuesta.read(limite + 1)
+    except DireccionNoPermitida:
+        return None
+    finally:
+        conexion.close()
+    return contenido, content_type
+
+
+def tipo_de_imagen(contenido, content_type):
+    """
+    Content-Type con que se sirve lo que entregó el fetcher, o None si no es
+    un icono aceptable (vacío, muy grande, SVG, HTML de error...).
+    """
+    if not contenido or len(contenido) > settings.VAULT_ICONOS_MAX_BYTES:
+        return None
+    if content_type in TIPOS_IMAGEN:
+        return content_type
+    return next((tipo for firma, tipo in _FIRMAS if contenido.startswith(firma)), None)
+
+
+def sin_red(dominio):
+    """Fetcher local: nunca sale a internet y ningún sitio tiene icono."""
+    return None
@@ -0,0 +1,206 @@
+# cuentas/importacion.py
+"""
+Importación de contraseñas exportadas desde el navegador o un gestor, en CSV.
+
+Formatos reconocidos por su cabecera:
+  chrome     name,url,username,password[,note]  (también Edge, Brave, Opera)
+  firefox    url,username,password,httpRealm,formActionOrigin,guid,...
+  bitwarden  folder,favorite,type,name,notes,fields,reprompt,login_uri,
+             login_username,login_password,login_totp
+
+El CSV se lee fila a fila sin cargarlo entero. Las contraseñas se cifran en
+lotes con la DEK del usuario, el cupo se verifica una sola vez para todo el
+archivo y las cuentas se insertan con bulk_create. Se informan las filas
+duplicadas (mismo usuario en el mismo sitio, ya en la bóveda o repetidas en
+el archivo) y las rechazadas, con su número de fila y el motivo.
+"""
+import csv
+import io
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator, validate_email
+from django.db import transaction
+
+from core.crypto import llave_de_usuario, encrypt_many
+from .busqueda import plegar
+from .iconos import dominio_de
+from .models import Account, Profile
+
+LOTE = 500
+MAX_URL = Account._meta.get_field('site_url').max_length
+MAX_NOMBRE = Account._meta.get_field('site_name').max_length
+MAX_EMAIL = Account._meta.get_field('email').max_length
+# bulk_create no corre los validadores de los campos: se validan aquí
+_validar_url = URLValidator(schemes=['http', 'https'])
+
+
+class ImportacionInvalida(Exception):
+    pass
+
+
+# --- Formatos ---
+
+def _chrome(fila):
+    return {
+        'site_name': fila.get('name'),
+        'site_url': fila.get('url'),
+        'email': fila.get('username'),
+        'password': fila.get('password'),
+    }
+
+
+def _firefox(fila):
+    return {
+        'site_name': None,
+        'site_url': fila.get('url'),
+        'email': fila.get('username'),
+        'password': fila.get('password'),
+    }
+
+
+def _bitwarden(fila):
+    if (fila.get('type') or 'login') != 'login':
+        raise ValidationError("No es un login (nota, tarjeta o identidad).")
+    return {
+        'site_name': fila.get('name'),
+        # Bitwarden puede traer varias URIs separadas por coma: vale la primera
+        'site_url': (fila.get('login_uri') or '').split(',')[0],
+        'email': fila.get('login_username'),
+        'password': fila.get('login_password'),
+        'secret': fila.get('login_totp'),
+    }
+
+
+def detectar_formato(cabecera):
+    campos = set(cabecera or [])
+    if {'login_uri', 'login_username', 'login_password'} <= campos:
+        return 'bitwarden', _bitwarden
+    if {'url', 'username', 'password', 'httpRealm'} <= campos:
+        return 'firefox', _firefox
+    if {'name', 'url', 'username', 'password'} <= campos:
+        return 'chrome', _chrome
+    raise ImportacionInvalida(
+        "Formato no reconocido. Exporta el CSV desde Chrome, Firefox o Bitwarden sin modificar la cabecera.")
+
+
+# --- Normalización ---
+
+def _limpiar_url(url):
+    url = (url or '').strip()
+    if not url:
+        return None
+    if '//' not in url:
+        url = f"https://{url}"
+    if len(url) > MAX_URL:
+        # Las URLs de login suelen traer parámetros largos: basta el origen
+        esquema, _, resto = url.partition('//')
+        url = f"{esquema}//{resto.split('/', 1)[0]}"
+    return url[:MAX_URL]
+
+
+def _normalizar(datos):
+    email = (datos.get('email') or '').strip()
+    password = datos.get('password') or ''
+    if not email:
+        raise ValidationError("Sin usuario.")
+    if not password:
+        raise ValidationError("Sin contraseña.")
+    if len(email) > MAX_EMAIL:
+        raise ValidationError(f"El usuario tiene más de {MAX_EMAIL} caracteres.")
+    try:
+        validate_email(email)
+    except ValidationError:
+        # Account.email es un correo: los usuarios sin @ no se pueden guardar
+        raise ValidationError("El usuario no es un correo electrónico.")
+
+    site_url = _limpiar_url(datos.get('site_url'))
+    if site_url:
+        try:
+            _validar_url(site_url)
+        except ValidationError:
+            raise ValidationError("La URL del sitio no es válida (debe ser http o https).")
+    site_name = (datos.get('site_name') or '').strip() or dominio_de(site_url) or None
+    return {
+        'email': email,
+        'password': password,
+        'secret': (datos.get('secret') or '').strip() or None,
+        'site_url': site_url,
+        'site_name': site_name[:MAX_NOMBRE] if site_name else None,
+    }
+
+
+def _clave(email, site_url, site_name):
+    """Dos cuentas son la misma si comparten usuario y sitio (dominio, o nombre si no hay URL)."""
+    sitio = dominio_de(site_url) or plegar(site_name or '')
+    return (email.strip().lower(), sitio)
+
+
+# --- Importación ---
+
+def leer_csv(archivo):
+    """Filas del CSV como dicts, decodificando en streaming (acepta BOM)."""
+    texto = io.TextIOWrapper(archivo, encoding='utf-8-sig', errors='replace', newline='')
+    return csv.DictReader(texto)
+
+
+def importar_csv(user, archivo):
+    """
+    Importa las cuentas de `archivo` (binario) para `user`. Devuelve el resumen.
+    Lanza ImportacionInvalida si el archivo no es un CSV reconocible.
+    """
+    lector = leer_csv(archivo)
+    try:
+        formato, extraer = detectar_formato(lector.fieldnames)
+    except csv.Error as e:
+        raise ImportacionInvalida(f"El CSV no se pudo leer: {e}")
+
+    existentes = {
+        _clave(*fila) for fila in Account.objects.filter(user=user).values_list('email', 'site_url', 'site_name')
+    }
+    resumen = {'formato': formato, 'importadas': 0, 'sin_cupo': 0, 'duplicadas': [], 'rechazadas': []}
+    candidatas = []
+    try:
+        # La fila 1 es la cabecera
+        for numero, fila in enumerate(lector, start=2):
+            if len(candidatas) >= settings.VAULT_IMPORT_MAX_FILAS:
+                raise ImportacionInvalida(
+                    f"El archivo tiene más de {settings.VAULT_IMPORT_MAX_FILAS} cuentas. Divídelo en partes.")
+            try:
+                datos = _normalizar(extraer(fila))
+            except ValidationError as e:
+                resumen['rechazadas'].append({'fila': numero, 'motivo': " ".join(e.messages)})
+                continue
+            clave = _clave(datos['email'], datos['site_url'], datos['site_name'])
+            if clave in existentes:
+                resumen['duplicadas'].append({'fila': numero, 'sitio': datos['site_name'], 'email': datos['email']})
+                continue
+            existentes.add(clave)
+            candidatas.append(datos)
+    except csv.Error as e:
+        raise ImportacionInvalida(f"El CSV no se pudo leer (fila {lector.line_num}): {e}")
+
+    # Un solo chequeo de cupo para todo el archivo, con el perfil bloqueado
+    llave = llave_de_usuario(user.id)
+    with transaction.atomic():
+        profile = Profile.objects.select_related('plan').select_for_update(of=('self',)).get(user=user)
+        cupo = max(0, profile.cupos.cuentas - profile.cuentas_usadas)
+        resumen['sin_cupo'] = max(0, len(candidatas) - cupo)
+        candidatas = candidatas[:cupo]
+
+        for inicio in range(0, len(candidatas), LOTE):
+            lote = candidatas[inicio:inicio + LOTE]
+            passwords = encrypt_many([d['password'] for d in lote], llave)
+            secrets = encrypt_many([d['secret'] for d in lote], llave)
+            cuentas = []
+            for datos, password, secret in zip(lote, passwords, secrets):
+                account = Account(
+                    user=user, email=datos['email'], password_encrypted=password, secret_encrypted=secret,
+                    site_url=datos['site_url'], site_name=datos['site_name'],
+                )
+                account.preparar()
+                cuentas.append(account)
+            Account.insertar_lote(user, cuentas)
+            resumen['importadas'] += len(cuentas)
+
+    return resumen
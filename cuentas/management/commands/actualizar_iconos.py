@@ -0,0 +1,91 @@
+import hashlib
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from cuentas.iconos import get_fetcher, tipo_de_imagen
+from cuentas.models import Icono
+
+# Tiempo que un worker se reserva un lote mientras lo descarga
+RESERVA = timedelta(minutes=10)
+
+
+class Command(BaseCommand):
+    help = (
+        "Descarga los favicons pendientes o vencidos (Icono) con el fetcher de "
+        "VAULT_ICONOS_FETCHER, varios a la vez. Los que fallan se reintentan con "
+        "espera creciente. Con --loop queda corriendo como worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=50)
+        parser.add_argument('--hilos', type=int, default=8,
+                            help="Descargas simultáneas.")
+        parser.add_argument('--loop', action='store_true',
+                            help="No termina: revisa la cola cada --intervalo segundos.")
+        parser.add_argument('--intervalo', type=float, default=30)
+
+    def handle(self, *args, **options):
+        self.fetcher = get_fetcher()
+        self.ttl = timedelta(days=settings.VAULT_ICONOS_TTL_DIAS)
+        with ThreadPoolExecutor(max_workers=options['hilos']) as pool:
+            while True:
+                listos = fallidos = 0
+                while True:
+                    iconos = self.reservar(options['lote'])
+                    if not iconos:
+                        break
+                    for icono, resultado in zip(iconos, pool.map(self.descargar, iconos)):
+                        if self.guardar(icono, resultado):
+                            listos += 1
+                        else:
+                            fallidos += 1
+                if listos or fallidos:
+                    self.stdout.write(self.style.SUCCESS(f"Iconos: {listos} actualizados, {fallidos} con error"))
+                if not options['loop']:
+                    break
+                time.sleep(options['intervalo'])
+
+    def reservar(self, lote):
+        ahora = timezone.now()
+        with transaction.atomic():
+            iconos = list(Icono.objects.select_for_update(skip_locked=True).filter(
+                vence_en__lte=ahora).order_by('vence_en').only('pk', 'dominio', 'estado', 'intentos')[:lote])
+            # Otro worker no los toma mientras se descargan; si este se cae, vuelven a vencer
+            Icono.objects.filter(pk__in=[i.pk for i in iconos]).update(vence_en=ahora + RESERVA)
+        return iconos
+
+    def descargar(self, icono):
+        try:
+            return self.fetcher(icono.dominio)
+        except Exception as e:
+            return e
+
+    def guardar(self, icono, resultado):
+        ahora = timezone.now()
+        if isinstance(resultado, Exception):
+            # Espera creciente: 1h, 2h, 4h... hasta el TTL
+            espera = min(timedelta(hours=2 ** min(icono.intentos, 16)), self.ttl)
+            # Si ya había uno descargado se sigue sirviendo mientras tanto
+            estado = 'listo' if icono.estado == 'listo' else 'error'
+            Icono.objects.filter(pk=icono.pk).update(
+                estado=estado, intentos=icono.intentos + 1, vence_en=ahora + espera,
+                error="".join(traceback.format_exception_only(resultado)).strip()[:500])
+            return False
+
+        content_type = resultado and tipo_de_imagen(*resultado)
+        if not content_type:
+            cambios = {'estado': 'sin_icono', 'contenido': b"", 'content_type': "", 'huella': ""}
+        else:
+            contenido = resultado[0]
+            cambios = {'estado': 'listo', 'contenido': contenido, 'content_type': content_type,
+                       'huella': hashlib.sha256(contenido).hexdigest()}
+        Icono.objects.filter(pk=icono.pk).update(
+            intentos=0, error="", obtenido_en=ahora, vence_en=ahora + self.ttl, **cambios)
+        return True
@@ -0,0 +1,112 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from core.crypto import llave_de_usuario
+from core.utils import encrypt_text
+from cuentas.models import Account, Profile, TerminoBusqueda
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark del listado de cuentas: siembra N cuentas para un usuario y mide "
+        "la primera página, una página profunda (siguiendo el cursor), una búsqueda y, hasta "
+        "--max-completo filas, el listado completo sin paginar. Para la primera página "
+        "informa también cuántas filas trae y cuántas consultas hace el request: con "
+        "menos cuentas que --page-size la página viene incompleta y no es comparable. "
+        "Corre dentro de una transacción que se deshace, así no deja datos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanos', default='10,1000,10000,100000',
+                            help="Cantidades de cuentas a probar, separadas por coma.")
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeticiones', type=int, default=20)
+        parser.add_argument('--max-completo', type=int, default=10000,
+                            help="Sobre este tamaño no se mide el listado sin paginar (tarda demasiado).")
+
+    def handle(self, *args, **options):
+        tamanos = [int(t) for t in options['tamanos'].split(',')]
+        self.repeticiones = options['repeticiones']
+        page = options['page_size']
+
+        self.stdout.write(
+            f"{'cuentas':>8} | {'filas':>5} | {'consultas':>9} | {'1ª página':>10} | {'página +10':>10} | "
+            f"{'búsqueda':>10} | {'sin paginar':>11}")
+        with override_settings(ALLOWED_HOSTS=['*']):
+            for n in tamanos:
+                with transaction.atomic():
+                    client = self.sembrar(n)
+                    url = f"/api/cuentas/?modo=metadatos&page_size={page}"
+                    filas, consultas = self.contar(client, url)
+                    primera = self.medir(client, url)
+                    profunda = self.medir_profunda(client, page, saltos=10)
+                    busqueda = self.medir(client, f"/api/cuentas/?modo=metadatos&search=sitio{n // 2}")
+                    completo = (
+                        self.medir(client, "/api/cuentas/?modo=metadatos")
+                        if n <= options['max_completo'] else None
+                    )
+                    transaction.set_rollback(True)
+
+                self.stdout.write(
+                    f"{n:>8} | {filas:>5} | {consultas:>9} | {primera:>8.1f}ms | "
+                    + (f"{profunda:>8.1f}ms" if profunda is not None else f"{'-':>10}")
+                    + f" | {busqueda:>8.1f}ms | "
+                    + (f"{completo:>9.1f}ms" if completo is not None else f"{'-':>11}")
+                )
+
+    def sembrar(self, n):
+        user = User.objects.create_user(username='bench-listado', email='bench-listado@niun.local')
+        Profile.objects.create(user=user, extra_slots_cuentas=n)
+        # Un solo token cifrado para todas: lo que se mide es el listado, no el cifrado
+        token = encrypt_text("bench", llave_de_usuario(user.id))
+        lote = []
+        for i in range(n):
+            account = Account(
+                user=user, email=f"c{i}@bench.local", password_encrypted=token,
+                site_name=f"sitio {i}", site_url=f"https://sitio{i}.bench.local",
+            )
+            account.preparar()
+            lote.append(account)
+            if len(lote) == 5000:
+                Account.objects.bulk_create(lote)
+                TerminoBusqueda.indexar(lote)
+                lote = []
+        Account.objects.bulk_create(lote)
+        TerminoBusqueda.indexar(lote)
+        Profile.objects.filter(user=user).update(cuentas_usadas=n)
+
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def contar(self, client, url):
+        """Filas de la página y consultas SQL del request (tras uno de calentamiento)."""
+        client.get(url)
+        with CaptureQueriesContext(connection) as consultas:
+            r = client.get(url)
+        return len(r.json()['results']), len(consultas)
+
+    def medir(self, client, url):
+        tiempos = []
+        for _ in range(self.repeticiones):
+            inicio = time.perf_counter()
+            r = client.get(url)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+            assert r.status_code == 200, r.content
+        return statistics.median(tiempos)
+
+    def medir_profunda(self, client, page, saltos):
+        # Se avanza con el cursor y se mide la página a la que se llega; si no
+        # hay tantas páginas no se mide (sería otra vez una de las primeras)
+        url = f"/api/cuentas/?modo=metadatos&page_size={page}"
+        for _ in range(saltos):
+            url = client.get(url).json().get('next')
+            if not url:
+                return None
+        return self.medir(client, url)
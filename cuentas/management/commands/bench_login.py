@@ -0,0 +1,144 @@
+import statistics
+import threading
+import time
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from core.auth.hashers import Admision, get_admision, set_admision
+from cuentas.models import Profile
+
+EMAIL = 'bench-login@niun.local'
+PASSWORD = 'bench-login-pw'
+RESPUESTA = 'azul'
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark de carga mixta en un proceso (como un worker gthread): unos hilos "
+        "hacen login sin parar y otros piden /api/profile/me/. Compara sin control "
+        "de admisión y con él: logins por segundo, 503 y la latencia p99 del resto. "
+        "Crea un usuario de prueba y lo borra al terminar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos-login', type=int, default=8)
+        parser.add_argument('--hilos-otros', type=int, default=4)
+        parser.add_argument('--segundos', type=float, default=10)
+        parser.add_argument('--concurrencia', type=int, default=None,
+                            help="Hashes simultáneos con control (por defecto VAULT_HASH_CONCURRENCIA).")
+        parser.add_argument('--cola', type=int, default=None)
+        parser.add_argument('--espera', type=float, default=None)
+
+    def handle(self, *args, **options):
+        base = Admision.desde_settings()
+        modos = [
+            ("sin control", Admision(0, 0, 0)),
+            ("con control", Admision(
+                options['concurrencia'] if options['concurrencia'] is not None else base.concurrencia,
+                options['cola'] if options['cola'] is not None else base.cola,
+                options['espera'] if options['espera'] is not None else base.espera,
+            )),
+        ]
+
+        anterior = get_admision()
+        user = self.sembrar()
+        try:
+            self.stdout.write(
+                f"{'modo':>12} | {'logins/s':>8} | {'503':>5} | {'login p50':>9} | {'login p99':>9} | "
+                f"{'otros/s':>7} | {'otros p50':>9} | {'otros p99':>9}")
+            # Todos los logins vienen de la misma IP y el mismo correo: sin esto el límite
+            # de intentos respondería 429 y se mediría otra cosa
+            with override_settings(ALLOWED_HOSTS=['*'], VAULT_RATELIMIT_ACTIVO=False):
+                for nombre, admision in modos:
+                    set_admision(admision)
+                    r = self.correr(user, options)
+                    if r['inesperados']:
+                        # Un hilo que falla deja de medir: las cifras no servirían
+                        raise CommandError(f"{nombre}: respuestas inesperadas {dict(r['inesperados'])}")
+                    self.stdout.write(
+                        f"{nombre:>12} | {r['logins_s']:>8.1f} | {r['rechazados']:>5} | "
+                        f"{r['login_p50']:>7.0f}ms | {r['login_p99']:>7.0f}ms | {r['otros_s']:>7.1f} | "
+                        f"{r['otros_p50']:>7.0f}ms | {r['otros_p99']:>7.0f}ms")
+                    if admision.concurrencia:
+                        self.stdout.write(f"{'':>12}   {admision.metricas()}")
+        finally:
+            set_admision(anterior)
+            user.delete()
+
+    def sembrar(self):
+        User.objects.filter(email=EMAIL).delete()
+        user = User.objects.create_user(username='bench-login', email=EMAIL)
+        # Siempre Argon2, aunque el settings de pruebas ponga otro hasher primero
+        user.password = make_password(PASSWORD, hasher='argon2')
+        user.save(update_fields=['password'])
+        Profile.objects.create(user=user, pregunta_seguridad='color',
+                               respuesta_seguridad=make_password(RESPUESTA, hasher='argon2'))
+        return user
+
+    def correr(self, user, options):
+        fin = time.monotonic() + options['segundos']
+        logins, otros, rechazados, inesperados = [], [], [], []
+
+        def login(client):
+            datos = {'email': EMAIL, 'password': PASSWORD, 'security_answer': RESPUESTA}
+            while time.monotonic() < fin:
+                inicio = time.perf_counter()
+                r = client.post('/api/auth/login/', datos, format='json')
+                if r.status_code == 503:
+                    rechazados.append(1)
+                    # Como haría un cliente que respeta Retry-After, pero sin dormir segundos enteros
+                    time.sleep(0.05)
+                    continue
+                if r.status_code != 200:
+                    inesperados.append(f"login {r.status_code}")
+                    continue
+                logins.append(time.perf_counter() - inicio)
+
+        def otro(client):
+            client.force_authenticate(user)
+            while time.monotonic() < fin:
+                inicio = time.perf_counter()
+                r = client.get('/api/profile/me/')
+                if r.status_code != 200:
+                    inesperados.append(f"perfil {r.status_code}")
+                    continue
+                otros.append(time.perf_counter() - inicio)
+
+        def vigilar(trabajo):
+            try:
+                trabajo(APIClient())
+            except Exception as e:
+                # Se informa al final en vez de morir en silencio dentro del hilo
+                inesperados.append(f"{trabajo.__name__}: {type(e).__name__}")
+            finally:
+                connection.close()
+
+        hilos = ([threading.Thread(target=vigilar, args=(login,)) for _ in range(options['hilos_login'])]
+                 + [threading.Thread(target=vigilar, args=(otro,)) for _ in range(options['hilos_otros'])])
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        return {
+            'logins_s': len(logins) / options['segundos'],
+            'rechazados': len(rechazados),
+            'login_p50': percentil(logins, 50),
+            'login_p99': percentil(logins, 99),
+            'otros_s': len(otros) / options['segundos'],
+            'otros_p50': percentil(otros, 50),
+            'otros_p99': percentil(otros, 99),
+            'inesperados': Counter(inesperados),
+        }
+
+
+def percentil(tiempos, p):
+    if len(tiempos) < 2:
+        return tiempos[0] * 1000 if tiempos else 0
+    return statistics.quantiles(tiempos, n=100)[p - 1] * 1000
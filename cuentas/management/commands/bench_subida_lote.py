@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from cuentas.models import Profile
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark: N subidas individuales a /api/files/ contra una sola subida "
+        "en lote a /api/files/batch/. Corre dentro de una transacción que se "
+        "deshace y con un MEDIA_ROOT temporal, así no deja datos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--archivos', type=int, default=20)
+        parser.add_argument('--kb', type=int, default=512, help="Tamaño de cada archivo en KB.")
+        parser.add_argument('--contenido', choices=['texto', 'aleatorio'], default='aleatorio')
+
+    def handle(self, *args, **options):
+        n = options['archivos']
+        size = options['kb'] * 1024
+        media = tempfile.mkdtemp(prefix='bench_vault_')
+
+        try:
+            with override_settings(MEDIA_ROOT=media, ALLOWED_HOSTS=['*'],
+                                   VAULT_BATCH_MAX_FILES=max(n, 50)):
+                with transaction.atomic():
+                    client = self.preparar_cliente()
+
+                    individuales = self.generar(n, size, options['contenido'], 'uno')
+                    inicio = time.perf_counter()
+                    for archivo in individuales:
+                        r = client.post('/api/files/', {'file': archivo}, format='multipart')
+                        assert r.status_code == 201, r.content
+                    t_individual = time.perf_counter() - inicio
+
+                    lote = self.generar(n, size, options['contenido'], 'lote')
+                    inicio = time.perf_counter()
+                    r = client.post('/api/files/batch/', {'files': lote}, format='multipart')
+                    assert r.status_code == 201 and r.data['fallidos'] == 0, r.content
+                    t_lote = time.perf_counter() - inicio
+
+                    transaction.set_rollback(True)
+        finally:
+            shutil.rmtree(media, ignore_errors=True)
+
+        total_mb = n * size / (1024 * 1024)
+        self.stdout.write(f"{n} archivos de {options['kb']} KB ({options['contenido']}), {total_mb:.1f} MB en total")
+        self.stdout.write(f"  {n} subidas individuales: {t_individual:.3f}s ({total_mb / t_individual:.1f} MB/s)")
+        self.stdout.write(f"  1 subida en lote:        {t_lote:.3f}s ({total_mb / t_lote:.1f} MB/s)")
+        self.stdout.write(self.style.SUCCESS(f"  Aceleración: x{t_individual / t_lote:.2f}"))
+
+    def preparar_cliente(self):
+        user = User.objects.create_user(username='bench-subidas', email='bench@niun.local')
+        Profile.objects.create(user=user, extra_gb_almacenamiento=100)
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def generar(self, n, size, contenido, prefijo):
+        archivos = []
+        for i in range(n):
+            if contenido == 'texto':
+                linea = f"{prefijo} archivo {i} linea de texto de prueba\n".encode()
+                data = (linea * (size // len(linea) + 1))[:size]
+            else:
+                data = os.urandom(size)
+            archivos.append(SimpleUploadedFile(f"{prefijo}-{i}.bin", data))
+        return archivos
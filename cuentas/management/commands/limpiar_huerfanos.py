@@ -0,0 +1,153 @@
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from cuentas.models import VaultBlob, VaultFile, UploadSession, CursorMantenimiento
+
+RAIZ = "vault"
+CURSOR = "limpiar_huerfanos"
+
+
+class Command(BaseCommand):
+    help = (
+        "Busca en MEDIA_ROOT/vault/ los .enc que ya no usa ningún archivo de la BD "
+        "(usuarios borrados, filas eliminadas a mano...) y los borra. Recorre el árbol "
+        "en orden y guarda el avance, así cada ejecución sigue donde quedó la anterior."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Solo informa lo que borraría. No borra ni mueve el cursor.")
+        parser.add_argument('--reiniciar', action='store_true',
+                            help="Olvida el avance guardado y empieza desde el principio.")
+        parser.add_argument('--limite', type=int, default=0,
+                            help="Máximo de archivos a revisar en esta ejecución (0 = todos).")
+        parser.add_argument('--lote', type=int, default=500,
+                            help="Archivos que se contrastan con la BD por consulta.")
+        parser.add_argument('--pausa', type=float, default=0.05,
+                            help="Segundos de espera entre lotes, para no saturar el disco.")
+        parser.add_argument('--borrados-por-segundo', type=float, default=20,
+                            help="Tope de borrados por segundo (0 = sin tope).")
+        parser.add_argument('--gracia-horas', type=float, default=24,
+                            help="No toca archivos más nuevos que esto: pueden ser subidas en curso.")
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.intervalo = 1 / options['borrados_por_segundo'] if options['borrados_por_segundo'] > 0 else 0
+        self.ultimo_borrado = 0.0
+        self.limite_fecha = timezone.now() - timedelta(hours=options['gracia_horas'])
+        self.examinados = self.huerfanos = self.bytes_liberados = 0
+
+        if options['reiniciar'] and not self.dry_run:
+            CursorMantenimiento.guardar(CURSOR, "")
+        cursor = "" if options['reiniciar'] else CursorMantenimiento.leer(CURSOR)
+        self.ultimo_path = cursor
+        if cursor:
+            self.stdout.write(f"Continuando desde {cursor}")
+
+        completo = True
+        lote = []
+        for path in self.recorrer(RAIZ, tuple(cursor.split('/')) if cursor else ()):
+            if options['limite'] and self.examinados >= options['limite']:
+                completo = False
+                break
+            self.examinados += 1
+            lote.append(path)
+            if len(lote) >= options['lote']:
+                self.procesar(lote)
+                lote = []
+                time.sleep(options['pausa'])
+        self.procesar(lote)
+
+        if completo and not self.dry_run:
+            # Recorrido terminado: la próxima ejecución vuelve a empezar
+            CursorMantenimiento.guardar(CURSOR, "")
+
+        accion = "recuperables" if self.dry_run else "recuperados"
+        self.stdout.write(self.style.SUCCESS(
+            f"Revisados: {self.examinados}, huérfanos: {self.huerfanos}, "
+            f"{accion}: {self.bytes_liberados / (1024 * 1024):.2f} MB"
+            + ("" if completo else " (quedan archivos, vuelve a ejecutar para seguir)")
+        ))
+
+    def recorrer(self, directorio, cursor):
+        """
+        Recorre `directorio` en orden alfabético y devuelve las rutas de los archivos
+        que van después de `cursor` (tupla de partes de la ruta). Las carpetas que
+        quedan completas antes del cursor ni se listan.
+        """
+        try:
+            carpetas, archivos = default_storage.listdir(directorio)
+        except FileNotFoundError:
+            return
+        partes = tuple(directorio.split('/'))
+        nivel = len(partes) + 1
+
+        hijos = sorted([(n, True) for n in carpetas] + [(n, False) for n in archivos])
+        for nombre, es_carpeta in hijos:
+            ruta = partes + (nombre,)
+            if cursor and ruta < cursor[:nivel]:
+                continue
+            path = '/'.join(ruta)
+            if es_carpeta:
+                if self.subida_activa(ruta):
+                    continue
+                yield from self.recorrer(path, cursor if cursor[:nivel] == ruta else ())
+            elif not cursor or ruta > cursor:
+                yield path
+
+    def subida_activa(self, ruta):
+        # vault/uploads/<id>: los trozos de una sesión viva no se tocan
+        if ruta[:2] != (RAIZ, 'uploads') or len(ruta) != 3:
+            return False
+        return UploadSession.objects.filter(pk=ruta[2]).exists() if _es_uuid(ruta[2]) else False
+
+    def procesar(self, lote):
+        if not lote:
+            return
+        self.ultimo_path = lote[-1]
+        en_uso = set(VaultBlob.objects.filter(file__in=lote).values_list('file', flat=True))
+        # Filas antiguas que todavía no apuntan a un blob
+        en_uso |= set(VaultFile.objects.filter(file__in=lote).values_list('file', flat=True))
+
+        for path in lote:
+            if path in en_uso:
+                continue
+            try:
+                if default_storage.get_modified_time(path) > self.limite_fecha:
+                    continue
+                size = default_storage.size(path)
+            except FileNotFoundError:
+                continue
+
+            self.huerfanos += 1
+            self.bytes_liberados += size
+            if self.dry_run:
+                self.stdout.write(f"  huérfano: {path} ({size} bytes)")
+                continue
+
+            self.esperar_turno()
+            default_storage.delete(path)
+
+        if not self.dry_run:
+            CursorMantenimiento.guardar(CURSOR, self.ultimo_path)
+
+    def esperar_turno(self):
+        if not self.intervalo:
+            return
+        espera = self.ultimo_borrado + self.intervalo - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+        self.ultimo_borrado = time.monotonic()
+
+
+def _es_uuid(valor):
+    try:
+        uuid.UUID(valor)
+        return True
+    except ValueError:
+        return False
@@ -0,0 +1,37 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from cuentas.models import Borrado
+
+
+class Command(BaseCommand):
+    help = (
+        "Elimina por lotes las lápidas de borrados (Borrado) más viejas que "
+        "VAULT_SYNC_RETENCION_DIAS. Los clientes con un token de sincronización "
+        "anterior reciben 410 y vuelven a sincronizar todo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=None,
+                            help="Retención en días (por defecto VAULT_SYNC_RETENCION_DIAS).")
+        parser.add_argument('--lote', type=int, default=1000)
+        parser.add_argument('--pausa', type=float, default=0,
+                            help="Segundos de espera entre lotes, para no acaparar la BD.")
+
+    def handle(self, *args, **options):
+        dias = options['dias'] if options['dias'] is not None else settings.VAULT_SYNC_RETENCION_DIAS
+        limite = timezone.now() - timedelta(days=dias)
+        total = 0
+        while True:
+            ids = list(Borrado.objects.filter(borrado_en__lt=limite).values_list('pk', flat=True)[:options['lote']])
+            if not ids:
+                break
+            Borrado.objects.filter(pk__in=ids).delete()
+            total += len(ids)
+            time.sleep(options['pausa'])
+
+        self.stdout.write(self.style.SUCCESS(f"Lápidas eliminadas: {total} (anteriores a {limite:%Y-%m-%d %H:%M})"))
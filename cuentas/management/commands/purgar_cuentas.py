@@ -0,0 +1,115 @@
+import time
+import traceback
+
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from cuentas.models import PurgaCuenta, Account, VaultFile, VaultBlob, UploadSession
+
+
+class Command(BaseCommand):
+    help = (
+        "Procesa las purgas de cuentas autodestruidas: borra cuentas, archivos y "
+        "blobs por lotes acotados (cada lote en su transacción) y al final el usuario. "
+        "Con --loop queda corriendo como worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=500,
+                            help="Filas borradas por transacción.")
+        parser.add_argument('--loop', action='store_true',
+                            help="No termina: revisa la cola cada --intervalo segundos.")
+        parser.add_argument('--intervalo', type=float, default=10)
+        parser.add_argument('--pausa', type=float, default=0,
+                            help="Segundos de espera entre lotes, para no acaparar la BD.")
+
+    def handle(self, *args, **options):
+        self.lote = options['lote']
+        self.pausa = options['pausa']
+        while True:
+            procesadas = self.procesar_cola()
+            if procesadas:
+                self.stdout.write(self.style.SUCCESS(f"Purgas completadas: {procesadas}"))
+            if not options['loop']:
+                break
+            time.sleep(options['intervalo'])
+
+    def procesar_cola(self):
+        procesadas = 0
+        # Las que quedaron "en curso" por un worker caído se retoman
+        for purga_id in PurgaCuenta.objects.filter(
+                estado__in=['pendiente', 'en_curso']).order_by('creada_en').values_list('id', flat=True):
+            with transaction.atomic():
+                purga = PurgaCuenta.objects.select_for_update(skip_locked=True).filter(pk=purga_id).first()
+                if purga is None or purga.estado not in ('pendiente', 'en_curso'):
+                    continue
+                purga.estado = 'en_curso'
+                purga.save(update_fields=['estado', 'actualizada_en'])
+
+            try:
+                self.purgar(purga)
+            except Exception:
+                traceback.print_exc()
+                PurgaCuenta.objects.filter(pk=purga.pk).update(
+                    estado='error', error=traceback.format_exc(), actualizada_en=timezone.now())
+                continue
+            procesadas += 1
+        return procesadas
+
+    def purgar(self, purga):
+        user_id = purga.user_id_original
+        self.stdout.write(f"Purgando user {user_id}...")
+
+        while self.borrar_lote(purga, Account.objects.filter(user_id=user_id), 'cuentas_borradas'):
+            pass
+        while self.borrar_lote(purga, VaultFile.objects.filter(user_id=user_id), 'archivos_borrados'):
+            pass
+        while self.borrar_blobs(purga, user_id):
+            pass
+        for session in UploadSession.objects.filter(user_id=user_id):
+            session.cancelar()
+
+        # Lo que queda (perfil, sesiones, tokens...) ya es liviano
+        with transaction.atomic():
+            User.objects.filter(pk=user_id).delete()
+            PurgaCuenta.objects.filter(pk=purga.pk).update(
+                estado='completada', error='', completada_en=timezone.now(), actualizada_en=timezone.now())
+
+    def borrar_lote(self, purga, queryset, contador):
+        ids = list(queryset.values_list('pk', flat=True)[:self.lote])
+        if not ids:
+            return False
+        with transaction.atomic():
+            queryset.model.objects.filter(pk__in=ids).delete()
+            PurgaCuenta.objects.filter(pk=purga.pk).update(
+                **{contador: F(contador) + len(ids)}, actualizada_en=timezone.now())
+        self.esperar()
+        return True
+
+    def borrar_blobs(self, purga, user_id):
+        # Ya no quedan VaultFile: los blobs se borran sin pasar por ref_count
+        blobs = list(VaultBlob.objects.filter(user_id=user_id).values_list('pk', 'file', 'stored_bytes')[:self.lote])
+        if not blobs:
+            return False
+        with transaction.atomic():
+            VaultBlob.objects.filter(pk__in=[pk for pk, _, _ in blobs]).delete()
+            PurgaCuenta.objects.filter(pk=purga.pk).update(
+                bytes_liberados=F('bytes_liberados') + sum(size for _, _, size in blobs),
+                actualizada_en=timezone.now())
+            nombres = [name for _, name, _ in blobs]
+            transaction.on_commit(lambda: _borrar_del_storage(nombres))
+        self.esperar()
+        return True
+
+    def esperar(self):
+        if self.pausa:
+            time.sleep(self.pausa)
+
+
+def _borrar_del_storage(nombres):
+    for name in nombres:
+        default_storage.delete(name)
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from cuentas.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = (
+        "Borra las sesiones de subida reanudable vencidas y sus trozos cifrados, y "
+        "devuelve el espacio que tenían reservado. Con --loop queda corriendo como worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help="No termina: revisa las sesiones cada --intervalo segundos.")
+        parser.add_argument('--intervalo', type=float, default=300)
+
+    def handle(self, *args, **options):
+        while True:
+            borradas = UploadSession.purgar_expiradas()
+            if borradas or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f"Sesiones vencidas borradas: {borradas}"))
+            if not options['loop']:
+                break
+            time.sleep(options['intervalo'])
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from cuentas.models import Profile, Account, VaultBlob, UploadSession
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara los contadores de uso del perfil (bytes_usados, cuentas_usadas) "
+        "con los datos reales y corrige los que se desfasaron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Solo informa las diferencias, sin corregir.")
+        parser.add_argument('--user', type=int, help="Revisar solo este user_id.")
+
+    def handle(self, *args, **options):
+        perfiles = Profile.objects.all()
+        if options['user']:
+            perfiles = perfiles.filter(user_id=options['user'])
+
+        revisados = corregidos = 0
+        for profile in perfiles.iterator():
+            revisados += 1
+            with transaction.atomic():
+                # Bloqueado para que ninguna alta/baja cambie el uso mientras contamos
+                profile = Profile.objects.select_for_update().get(pk=profile.pk)
+                cuentas, bytes_usados = self.uso_real(profile.user_id)
+
+                if (cuentas, bytes_usados) == (profile.cuentas_usadas, profile.bytes_usados):
+                    continue
+
+                self.stdout.write(
+                    f"user {profile.user_id}: cuentas {profile.cuentas_usadas} -> {cuentas}, "
+                    f"bytes {profile.bytes_usados} -> {bytes_usados}"
+                )
+                corregidos += 1
+                if not options['dry_run']:
+                    Profile.objects.filter(pk=profile.pk).update(
+                        cuentas_usadas=cuentas, bytes_usados=bytes_usados)
+
+        accion = "con diferencias" if options['dry_run'] else "corregidos"
+        self.stdout.write(self.style.SUCCESS(
+            f"Perfiles revisados: {revisados}, {accion}: {corregidos}"))
+
+    def uso_real(self, user_id):
+        cuentas = Account.objects.filter(user_id=user_id).aggregate(n=Count('id'))['n']
+        blobs = VaultBlob.objects.filter(user_id=user_id).aggregate(n=Sum('size_bytes'))['n'] or 0
+        # Las subidas por partes en curso tienen su espacio reservado
+        sesiones = UploadSession.objects.filter(user_id=user_id).aggregate(n=Sum('size_bytes'))['n'] or 0
+        return cuentas, blobs + sesiones
@@ -0,0 +1,234 @@
+import time
+import traceback
+import zlib
+
+from cryptography.fernet import InvalidToken
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+
+from core.crypto import get_llavero, llave_de_usuario, es_texto_de_usuario, DEK_DESTRUIDA
+from core.utils import (
+    StreamDecryptor, StreamEncryptedFile, read_stream_header, content_hasher, encrypt_text, CODEC_ZLIB,
+)
+from cuentas.models import Account, VaultBlob, VaultFile, Profile, CursorMantenimiento
+
+CURSOR_LLAVES = "recifrar:llaves"
+CURSOR_CUENTAS = "recifrar:cuentas"
+CURSOR_BLOBS = "recifrar:blobs"
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-envuelve las llaves de datos (DEK) de los usuarios con la llave maestra "
+        "vigente, y pasa a la DEK de cada usuario las contraseñas, secretos y blobs que "
+        "todavía estén cifrados con una llave maestra. Trabaja por lotes, guarda el "
+        "avance y se puede cortar y volver a lanzar sin repetir trabajo. Tras rotar la "
+        "maestra basta con --solo llaves."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--solo', choices=['llaves', 'cuentas', 'blobs'],
+                            help="Procesar solo una de las partes.")
+        parser.add_argument('--lote', type=int, default=200)
+        parser.add_argument('--pausa', type=float, default=0.1,
+                            help="Segundos de espera entre lotes, para no acaparar BD y disco.")
+        parser.add_argument('--reiniciar', action='store_true',
+                            help="Olvida el avance guardado y revisa todo de nuevo.")
+
+    def handle(self, *args, **options):
+        self.llavero = get_llavero()
+        self.lote = options['lote']
+        self.pausa = options['pausa']
+        if options['reiniciar']:
+            for nombre in (CURSOR_LLAVES, CURSOR_CUENTAS, CURSOR_BLOBS):
+                CursorMantenimiento.guardar(nombre, "")
+
+        if options['solo'] in (None, 'llaves'):
+            self.reenvolver_llaves()
+        if options['solo'] in (None, 'cuentas'):
+            self.recifrar_cuentas()
+        if options['solo'] in (None, 'blobs'):
+            self.recifrar_blobs()
+
+    # --- Llaves de datos ---
+
+    def reenvolver_llaves(self):
+        cursor = int(CursorMantenimiento.leer(CURSOR_LLAVES) or 0)
+        revisadas = reenvueltas = 0
+        while True:
+            perfiles = list(Profile.objects.filter(pk__gt=cursor).exclude(dek_cifrada__in=["", DEK_DESTRUIDA])
+                            .order_by('pk').only('pk', 'dek_cifrada')[:self.lote])
+            if not perfiles:
+                break
+            cambiados = []
+            for profile in perfiles:
+                data = profile.dek_cifrada.encode()
+                if not self.llavero.es_vigente(data):
+                    profile.dek_cifrada = self.llavero.rotar(data).decode()
+                    cambiados.append(profile)
+            cursor = perfiles[-1].pk
+            with transaction.atomic():
+                Profile.objects.bulk_update(cambiados, ['dek_cifrada'])
+                CursorMantenimiento.guardar(CURSOR_LLAVES, str(cursor))
+            revisadas += len(perfiles)
+            reenvueltas += len(cambiados)
+            time.sleep(self.pausa)
+
+        CursorMantenimiento.guardar(CURSOR_LLAVES, "")
+        self.stdout.write(self.style.SUCCESS(
+            f"Llaves de datos: {revisadas} revisadas, {reenvueltas} re-envueltas"))
+
+    # --- Cuentas ---
+
+    def recifrar_cuentas(self):
+        cursor = CursorMantenimiento.leer(CURSOR_CUENTAS)
+        revisadas = recifradas = fallidas = 0
+        while True:
+            cuentas = Account.objects.order_by('pk').only('pk', 'user_id', 'password_encrypted', 'secret_encrypted')
+            if cursor:
+                cuentas = cuentas.filter(pk__gt=cursor)
+            cuentas = list(cuentas[:self.lote])
+            if not cuentas:
+                break
+
+            cambiadas = []
+            for account in cuentas:
+                try:
+                    llave = llave_de_usuario(account.user_id)
+                    password = self.pasar_a_dek(account.password_encrypted, llave)
+                    secret = self.pasar_a_dek(account.secret_encrypted, llave)
+                except (InvalidToken, ValueError):
+                    # Ninguna llave la abre: se deja igual para revisarla a mano
+                    fallidas += 1
+                    self.stderr.write(f"  cuenta {account.pk}: no se pudo descifrar")
+                    continue
+                if password is not None or secret is not None:
+                    if password is not None:
+                        account.password_encrypted = password
+                    if secret is not None:
+                        account.secret_encrypted = secret
+                    cambiadas.append(account)
+
+            cursor = str(cuentas[-1].pk)
+            with transaction.atomic():
+                # bulk_update no toca updated_at: rotar la llave no es un cambio de la cuenta
+                Account.objects.bulk_update(cambiadas, ['password_encrypted', 'secret_encrypted'])
+                CursorMantenimiento.guardar(CURSOR_CUENTAS, cursor)
+            revisadas += len(cuentas)
+            recifradas += len(cambiadas)
+            self.stdout.write(f"  cuentas: {revisadas} revisadas, {recifradas} re-cifradas")
+            time.sleep(self.pausa)
+
+        CursorMantenimiento.guardar(CURSOR_CUENTAS, "")
+        self.stdout.write(self.style.SUCCESS(
+            f"Cuentas: {revisadas} revisadas, {recifradas} re-cifradas, {fallidas} con error"))
+
+    def pasar_a_dek(self, token, llave):
+        """Devuelve el token cifrado con la DEK, o None si está vacío o ya la usa."""
+        if not token or es_texto_de_usuario(token):
+            return None
+        texto = self.llavero.fernet.decrypt(token.encode()).decode()
+        return encrypt_text(texto, llave)
+
+    # --- Blobs ---
+
+    def recifrar_blobs(self):
+        cursor = int(CursorMantenimiento.leer(CURSOR_BLOBS) or 0)
+        revisados = recifrados = fallidos = 0
+        while True:
+            ids = list(VaultBlob.objects.filter(pk__gt=cursor).order_by('pk').values_list('pk', flat=True)[:self.lote])
+            if not ids:
+                break
+            for blob_id in ids:
+                revisados += 1
+                try:
+                    if self.recifrar_blob(blob_id):
+                        recifrados += 1
+                except Exception:
+                    fallidos += 1
+                    self.stderr.write(f"  blob {blob_id}: {traceback.format_exc(limit=1)}")
+                cursor = blob_id
+                CursorMantenimiento.guardar(CURSOR_BLOBS, str(cursor))
+            self.stdout.write(f"  blobs: {revisados} revisados, {recifrados} re-cifrados")
+            time.sleep(self.pausa)
+
+        CursorMantenimiento.guardar(CURSOR_BLOBS, "")
+        self.stdout.write(self.style.SUCCESS(
+            f"Blobs: {revisados} revisados, {recifrados} re-cifrados, {fallidos} con error"))
+
+    def recifrar_blob(self, blob_id):
+        blob = VaultBlob.objects.filter(pk=blob_id).first()
+        if blob is None:
+            return False
+        viejo = blob.file.name
+        llave = llave_de_usuario(blob.user_id)
+
+        with blob.file.open('rb') as f:
+            header = read_stream_header(f)
+            if header is not None and header['key_id'] == llave.id:
+                return False
+            f.seek(0)
+            decryptor = StreamDecryptor(f)
+            # Se re-cifra lo guardado tal cual (comprimido si el codec es zlib) y,
+            # de paso, se recalcula la huella con la llave de deduplicación de la DEK
+            lector = _LectorConHuella(decryptor, content_hasher(llave), blob.codec)
+            nuevo = default_storage.save(viejo, StreamEncryptedFile(lector, name=viejo, llave=llave))
+
+        with transaction.atomic():
+            actual = VaultBlob.objects.select_for_update().filter(pk=blob_id).first()
+            if actual is None or actual.file.name != viejo:
+                # Se borró (o lo cambió otro proceso) mientras tanto
+                transaction.on_commit(lambda: default_storage.delete(nuevo))
+                return False
+            actual.file.name = nuevo
+            actual.stored_bytes = default_storage.size(nuevo)
+            campos = ['file', 'stored_bytes']
+            digest = lector.hasher.hexdigest()
+            if actual.digest != digest and not VaultBlob.objects.filter(
+                    user_id=actual.user_id, digest=digest).exists():
+                actual.digest = digest
+                campos.append('digest')
+            try:
+                with transaction.atomic():
+                    actual.save(update_fields=campos)
+            except IntegrityError:
+                actual.save(update_fields=['file', 'stored_bytes'])
+            VaultFile.objects.filter(blob_id=blob_id).update(file=nuevo, updated_at=timezone.now())
+            # Cambia la URL de esos archivos en el listado
+            Profile.tocar(actual.user_id, 'archivos')
+            transaction.on_commit(lambda: default_storage.delete(viejo))
+        return True
+
+
+class _LectorConHuella:
+    """Entrega por read() lo descifrado y va calculando la huella del texto original."""
+
+    def __init__(self, decryptor, hasher, codec):
+        self.size = decryptor.size
+        self.hasher = hasher
+        self._chunks = decryptor.iter_range()
+        self._descomprimir = zlib.decompressobj() if codec == CODEC_ZLIB else None
+        self._buffer = b""
+
+    def _huella(self, chunk):
+        if self._descomprimir is None:
+            self.hasher.update(chunk)
+        elif chunk:
+            self.hasher.update(self._descomprimir.decompress(chunk))
+        else:
+            self.hasher.update(self._descomprimir.flush())
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._huella(b"")
+                break
+            self._huella(chunk)
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
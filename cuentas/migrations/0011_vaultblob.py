@@ -0,0 +1,60 @@
+# Generated by Django 5.2.10 on 2026-10-17 05:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def crear_blobs_existentes(apps, schema_editor):
+    # Cada archivo ya subido pasa a ser su propio blob (sin digest: no se puede
+    # calcular sin descifrarlo, así que esos no se deduplican).
+    VaultFile = apps.get_model('cuentas', 'VaultFile')
+    VaultBlob = apps.get_model('cuentas', 'VaultBlob')
+    for vault_file in VaultFile.objects.filter(blob__isnull=True).iterator():
+        blob = VaultBlob.objects.create(
+            user_id=vault_file.user_id,
+            file=vault_file.file.name,
+            size_bytes=vault_file.size_bytes,
+            ref_count=1,
+        )
+        VaultFile.objects.filter(pk=vault_file.pk).update(blob=blob)
+
+
+def borrar_blobs(apps, schema_editor):
+    VaultFile = apps.get_model('cuentas', 'VaultFile')
+    VaultBlob = apps.get_model('cuentas', 'VaultBlob')
+    VaultFile.objects.update(blob=None)
+    VaultBlob.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cuentas', '0010_uploadsession'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VaultBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(blank=True, max_length=64, null=True)),
+                ('file', models.FileField(upload_to='vault/%Y/%m/')),
+                ('size_bytes', models.BigIntegerField()),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blobs', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='vaultfile',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='files', to='cuentas.vaultblob'),
+        ),
+        migrations.AddConstraint(
+            model_name='vaultblob',
+            constraint=models.UniqueConstraint(fields=('user', 'digest'), name='unique_blob_por_usuario'),
+        ),
+        migrations.RunPython(crear_blobs_existentes, borrar_blobs),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.10 on 2026-10-17 05:59
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+
+def calcular_stored_bytes(apps, schema_editor):
+    VaultBlob = apps.get_model('cuentas', 'VaultBlob')
+    for blob in VaultBlob.objects.filter(stored_bytes=0).iterator():
+        try:
+            stored = default_storage.size(blob.file.name)
+        except OSError:
+            stored = blob.size_bytes
+        VaultBlob.objects.filter(pk=blob.pk).update(stored_bytes=stored)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cuentas', '0011_vaultblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vaultblob',
+            name='codec',
+            field=models.CharField(default='identity', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='vaultblob',
+            name='stored_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(calcular_stored_bytes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:01
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def calcular_contadores(apps, schema_editor):
+    Profile = apps.get_model('cuentas', 'Profile')
+    Account = apps.get_model('cuentas', 'Account')
+    VaultBlob = apps.get_model('cuentas', 'VaultBlob')
+    UploadSession = apps.get_model('cuentas', 'UploadSession')
+
+    cuentas = dict(Account.objects.values('user').annotate(n=Count('id')).values_list('user', 'n'))
+    blobs = dict(VaultBlob.objects.values('user').annotate(n=Sum('size_bytes')).values_list('user', 'n'))
+    sesiones = dict(UploadSession.objects.values('user').annotate(n=Sum('size_bytes')).values_list('user', 'n'))
+    for profile in Profile.objects.all().iterator():
+        Profile.objects.filter(pk=profile.pk).update(
+            cuentas_usadas=cuentas.get(profile.user_id, 0),
+            bytes_usados=(blobs.get(profile.user_id) or 0) + (sesiones.get(profile.user_id) or 0),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cuentas', '0012_vaultblob_codec_stored_bytes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='bytes_usados',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='cuentas_usadas',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(calcular_contadores, migrations.RunPython.noop),
+    ]
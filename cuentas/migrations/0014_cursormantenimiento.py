@@ -0,0 +1,26 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cuentas', '0013_profile_contadores_uso'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CursorMantenimiento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100, unique=True)),
+                ('cursor', models.TextField(blank=True, default='')),
+                ('actualizado_en', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Cursor de mantenimiento',
+                'verbose_name_plural': 'Cursores de mantenimiento',
+            },
+        ),
+    ]
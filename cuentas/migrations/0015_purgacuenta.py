@@ -0,0 +1,38 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cuentas', '0014_cursormantenimiento'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurgaCuenta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id_original', models.IntegerField(db_index=True)),
+                ('motivo', models.CharField(choices=[('pin', 'PIN de bóveda'), ('login', 'Inicio de sesión')], max_length=10)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_curso', 'En curso'), ('completada', 'Completada'), ('error', 'Error')], db_index=True, default='pendiente', max_length=12)),
+                ('cuentas_borradas', models.IntegerField(default=0)),
+                ('archivos_borrados', models.IntegerField(default=0)),
+                ('bytes_liberados', models.BigIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('creada_en', models.DateTimeField(auto_now_add=True)),
+                ('actualizada_en', models.DateTimeField(auto_now=True)),
+                ('completada_en', models.DateTimeField(blank=True, null=True)),
+                ('user', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='purga', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Purga de cuenta',
+                'verbose_name_plural': 'Purgas de cuentas',
+                'ordering': ['-creada_en'],
+            },
+        ),
+    ]
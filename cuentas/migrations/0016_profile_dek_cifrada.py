@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cuentas', '0015_purgacuenta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='dek_cifrada',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
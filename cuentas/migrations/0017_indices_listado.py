@@ -0,0 +1,23 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cuentas', '0016_profile_dek_cifrada'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='account_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vaultfile',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='vaultfile_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from cuentas.busqueda import terminos_de
+
+
+def indexar_cuentas(apps, schema_editor):
+    Account = apps.get_model('cuentas', 'Account')
+    TerminoBusqueda = apps.get_model('cuentas', 'TerminoBusqueda')
+    filas = []
+    for account in Account.objects.all().iterator(chunk_size=1000):
+        for termino, tipo in terminos_de(account):
+            filas.append(TerminoBusqueda(
+                account_id=account.pk, user_id=account.user_id, termino=termino, tipo=tipo))
+        if len(filas) >= 5000:
+            TerminoBusqueda.objects.bulk_create(filas)
+            filas = []
+    TerminoBusqueda.objects.bulk_create(filas)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cuentas', '0017_indices_listado'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TerminoBusqueda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('termino', models.CharField(max_length=100)),
+                ('tipo', models.SmallIntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terminos', to='cuentas.account')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'termino'], name='termino_user_idx')],
+            },
+        ),
+        migrations.RunPython(indexar_cuentas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copiar_created_at(apps, schema_editor):
+    # Los archivos existentes quedan como modificados al crearse, no al migrar
+    VaultFile = apps.get_model('cuentas', 'VaultFile')
+    VaultFile.objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cuentas', '0018_terminobusqueda'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Borrado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('cuenta', 'Cuenta'), ('archivo', 'Archivo')], max_length=10)),
+                ('objeto_id', models.CharField(max_length=36)),
+                ('borrado_en', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='vaultfile',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(copiar_created_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(fields=['user', 'updated_at'], name='account_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vaultfile',
+            index=models.Index(fields=['user', 'updated_at'], name='vaultfile_user_updated_idx'),
+        ),
+        migrations.AddField(
+            model_name='borrado',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='borrado',
+            index=models.Index(fields=['user', 'borrado_en'], name='borrado_user_fecha_idx'),
+        ),
+    ]
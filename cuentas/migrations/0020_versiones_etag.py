@@ -0,0 +1,40 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:24
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copiar_creado_en(apps, schema_editor):
+    Anuncio = apps.get_model('cuentas', 'Anuncio')
+    Anuncio.objects.update(actualizado_en=F('creado_en'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cuentas', '0019_sync_borrados'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='anuncio',
+            name='actualizado_en',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(copiar_creado_en, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='profile',
+            name='version_archivos',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='version_cuentas',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='version_perfil',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
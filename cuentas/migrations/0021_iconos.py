@@ -0,0 +1,87 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:27
+
+import re
+from urllib.parse import urlparse
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+# Copia de cuentas/iconos.py al momento de esta migración: si aquel módulo cambia,
+# esta debe seguir haciendo lo mismo
+PREFIJO_URL = "/api/iconos/"
+PREFIJO_DUCKDUCKGO = "https://icons.duckduckgo.com/ip3/"
+_DOMINIO_VALIDO = re.compile(r"^[a-z0-9-]+(\.[a-z0-9-]+)*\.[a-z][a-z0-9-]*$")
+_SUFIJOS_INTERNOS = ('.localhost', '.localdomain', '.local', '.internal', '.lan', '.arpa')
+
+
+def dominio_de(url):
+    if not url:
+        return ""
+    try:
+        host = urlparse(url if "//" in url else f"//{url}").hostname or ""
+        host = host.rstrip(".").lower().encode("idna").decode("ascii")
+    except (UnicodeError, ValueError):
+        return ""
+    if host.startswith("www."):
+        host = host[4:]
+    if len(host) > 253 or not _DOMINIO_VALIDO.match(host) or f".{host}".endswith(_SUFIJOS_INTERNOS):
+        return ""
+    return host
+
+
+def url_de_icono(dominio):
+    return f"{PREFIJO_URL}{dominio}/"
+
+
+def dejar_duckduckgo(apps, schema_editor):
+    """Las cuentas que apuntaban a DuckDuckGo pasan a la caché local y sus dominios quedan en cola."""
+    Account = apps.get_model('cuentas', 'Account')
+    Icono = apps.get_model('cuentas', 'Icono')
+    Profile = apps.get_model('cuentas', 'Profile')
+    ahora = timezone.now()
+    cambiadas, dominios, usuarios = [], set(), set()
+    cuentas = Account.objects.filter(site_icon_url__startswith=PREFIJO_DUCKDUCKGO).only(
+        'id', 'user_id', 'site_url', 'site_icon_url')
+    for account in cuentas.iterator(chunk_size=1000):
+        dominio = dominio_de(account.site_url)
+        account.site_icon_url = url_de_icono(dominio) if dominio else None
+        # Para que /api/sync/ y los ETag de /api/cuentas/ informen el cambio
+        account.updated_at = ahora
+        cambiadas.append(account)
+        usuarios.add(account.user_id)
+        if dominio:
+            dominios.add(dominio)
+        if len(cambiadas) >= 1000:
+            Account.objects.bulk_update(cambiadas, ['site_icon_url', 'updated_at'])
+            cambiadas = []
+    Account.objects.bulk_update(cambiadas, ['site_icon_url', 'updated_at'])
+    Profile.objects.filter(user_id__in=usuarios).update(version_cuentas=F('version_cuentas') + 1)
+    Icono.objects.bulk_create([Icono(dominio=d) for d in dominios], batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cuentas', '0020_versiones_etag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Icono',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dominio', models.CharField(max_length=253, unique=True)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('listo', 'Listo'), ('sin_icono', 'El sitio no tiene icono'), ('error', 'Error al descargar')], default='pendiente', max_length=10)),
+                ('contenido', models.BinaryField(blank=True, default=b'')),
+                ('content_type', models.CharField(blank=True, max_length=50)),
+                ('huella', models.CharField(blank=True, max_length=64)),
+                ('intentos', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('obtenido_en', models.DateTimeField(blank=True, null=True)),
+                ('vence_en', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(dejar_duckduckgo, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:29
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def marcar_congeladas(apps, schema_editor):
+    # Solo los usuarios con más cuentas que su cupo tienen algo que congelar
+    Account = apps.get_model('cuentas', 'Account')
+    Profile = apps.get_model('cuentas', 'Profile')
+    totales = Account.objects.values('user_id').annotate(n=Count('id')).order_by()
+    for fila in totales:
+        profile = Profile.objects.select_related('plan').filter(user_id=fila['user_id']).first()
+        if profile is None:
+            continue
+        cupo = (profile.plan.slots_cuentas_base if profile.plan else 10) + profile.extra_slots_cuentas
+        if fila['n'] <= cupo:
+            continue
+        editables = Account.objects.filter(user_id=fila['user_id']).order_by('created_at', 'id').values('id')[:cupo]
+        Account.objects.filter(user_id=fila['user_id']).exclude(id__in=editables).update(congelada=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cuentas', '0021_iconos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='congelada',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(marcar_congeladas, migrations.RunPython.noop),
+    ]
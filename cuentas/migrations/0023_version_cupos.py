@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-17 06:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cuentas', '0022_account_congelada'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='version_cupos',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -1,8 +1,14 @@
 import uuid
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Case, F, Q, Value, When
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
 from django.contrib.auth.models import User
 from django.utils import timezone
-from urllib.parse import urlparse
+from core.crypto import olvidar_llave, DEK_DESTRUIDA
+from .busqueda import terminos_de, TIPO_PALABRA
+from .iconos import dominio_de, url_de_icono, es_url_de_icono
+from .cupos import Cupos, SIN_PLAN
 
 import os
 
@@ -17,6 +23,8 @@ class Anuncio(models.Model):
     titulo = models.CharField(max_length=150)
     mensaje = models.TextField(help_text="Puedes usar saltos de línea.")
     creado_en = models.DateTimeField(auto_now_add=True)
+    # Para el ETag de /api/anuncios/
+    actualizado_en = models.DateTimeField(auto_now=True)
     expira_en = models.DateTimeField(
         help_text="Fecha y hora en que dejará de mostrarse el anuncio.")
     tipo = models.CharField(
@@ -33,25 +41,347 @@ class Anuncio(models.Model):
         return f"{self.titulo} (Expira: {self.expira_en})"
 
 
+class VaultBlob(models.Model):
+    """
+    Contenido cifrado guardado una sola vez por usuario. Los VaultFile con el
+    mismo contenido apuntan al mismo blob; el archivo físico se borra cuando
+    ref_count llega a 0.
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="blobs")
+    # HMAC del texto plano con llave propia de cada usuario (null en blobs antiguos)
+    digest = models.CharField(max_length=64, null=True, blank=True)
+    file = models.FileField(upload_to="vault/%Y/%m/")
+    # Tamaño lógico (el del archivo original): es lo que cuenta para la cuota
+    size_bytes = models.BigIntegerField()
+    # Lo que ocupa realmente en disco, ya comprimido y cifrado
+    stored_bytes = models.BigIntegerField(default=0)
+    # Compresión aplicada antes de cifrar: 'identity' o 'zlib'
+    codec = models.CharField(max_length=10, default='identity')
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'digest'], name='unique_blob_por_usuario'),
+        ]
+
+    def __str__(self):
+        return f"Blob {self.digest or self.pk} ({self.ref_count} refs)"
+
+    @classmethod
+    def obtener_o_crear(cls, user, digest, size_bytes, contenido):
+        """
+        Suma una referencia al blob con ese digest o lo crea con `contenido`
+        (un File por guardar, o el nombre de un archivo ya guardado en storage).
+        Devuelve (blob, creado). Llamar dentro de una transacción.
+        """
+        for _ in range(3):
+            blob = cls.objects.filter(user=user, digest=digest).first()
+            if blob is not None:
+                # Solo si sigue vivo: un borrado concurrente pudo dejarlo en 0
+                vivos = cls.objects.filter(pk=blob.pk, ref_count__gt=0).update(
+                    ref_count=models.F('ref_count') + 1)
+                if vivos:
+                    if isinstance(contenido, str):
+                        default_storage.delete(contenido)
+                    blob.refresh_from_db(fields=['ref_count'])
+                    return blob, False
+                continue
+
+            blob = cls(user=user, digest=digest, size_bytes=size_bytes, ref_count=1,
+                       codec=getattr(contenido, 'codec', 'identity'))
+            if isinstance(contenido, str):
+                blob.file.name = contenido
+            else:
+                blob.file = contenido
+            try:
+                with transaction.atomic():
+                    blob.save()
+                    blob.stored_bytes = blob.file.size
+                    blob.save(update_fields=['stored_bytes'])
+            except IntegrityError:
+                # Otra subida idéntica ganó la carrera: usamos la suya
+                if not isinstance(contenido, str):
+                    blob.file.delete(save=False)
+                continue
+            return blob, True
+
+        raise IntegrityError("No se pudo registrar el blob del archivo.")
+
+    @classmethod
+    def guardar(cls, user, digest, size_bytes, contenido, reservado=False):
+        """
+        obtener_o_crear + cuota. Si el contenido es nuevo reserva el espacio antes
+        de escribir (salvo que ya venga `reservado`, como en las subidas por
+        partes); si termina siendo un duplicado la reserva se devuelve.
+        """
+        if not reservado and not cls.objects.filter(user=user, digest=digest).exists():
+            Profile.reservar(user, bytes=size_bytes)
+            reservado = True
+        try:
+            with transaction.atomic():
+                blob, creado = cls.obtener_o_crear(user, digest, size_bytes, contenido)
+                if creado and not reservado:
+                    # El blob que íbamos a reutilizar desapareció entremedio
+                    Profile.ajustar_uso(user, bytes=size_bytes)
+                elif not creado and reservado:
+                    Profile.ajustar_uso(user, bytes=-size_bytes)
+        except Exception:
+            if reservado:
+                Profile.ajustar_uso(user, bytes=-size_bytes)
+            raise
+        return blob, creado
+
+    @classmethod
+    def liberar(cls, blob_id):
+        """Resta una referencia y borra el blob (y su archivo) si nadie más lo usa."""
+        with transaction.atomic():
+            blob = cls.objects.select_for_update().filter(pk=blob_id).first()
+            if blob is None:
+                return
+            blob.ref_count -= 1
+            if blob.ref_count > 0:
+                blob.save(update_fields=['ref_count'])
+                return
+            name = blob.file.name
+            blob.delete()
+            Profile.ajustar_uso(blob.user_id, bytes=-blob.size_bytes)
+            transaction.on_commit(lambda: default_storage.delete(name))
+
+
 class VaultFile(models.Model):
     user = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="files")
     file = models.FileField(upload_to="vault/%Y/%m/")
+    blob = models.ForeignKey(
+        VaultBlob, on_delete=models.CASCADE, null=True, blank=True, related_name="files")
     name = models.CharField(max_length=255)
     # Guardamos el peso para sumar rápido
     size_bytes = models.BigIntegerField(editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='vaultfile_user_created_idx'),
+            # Sincronización: WHERE user_id = ? AND updated_at >= ?
+            models.Index(fields=['user', 'updated_at'], name='vaultfile_user_updated_idx'),
+        ]
+
+    @classmethod
+    def limpiar_nombre(cls, nombre):
+        """
+        Nombre de archivo que manda el cliente, sin directorios ('../x', 'C:\\a\\b').
+        Lanza ValueError si no queda un nombre con el que se pueda guardar.
+        """
+        nombre = os.path.basename(str(nombre).replace('\\', '/')).strip()
+        limite = cls._meta.get_field('name').max_length
+        if len(nombre) > limite:
+            raise ValueError(f"El nombre del archivo supera los {limite} caracteres.")
+        try:
+            # El .enc en storage usa este nombre (ver VaultBlob.file)
+            default_storage.get_valid_name(nombre)
+        except SuspiciousFileOperation:
+            raise ValueError("El nombre del archivo no es válido.")
+        return nombre
 
     def save(self, *args, **kwargs):
         # Auto-guardar el tamaño del archivo al crearlo
         if self.file and not self.size_bytes:
             self.size_bytes = self.file.size
         super().save(*args, **kwargs)
+        Profile.tocar(self.user_id, 'archivos')
 
     def __str__(self):
         return self.name
 
 
+class UploadSession(models.Model):
+    """
+    Subida reanudable: el cliente declara el archivo, envía los trozos numerados
+    (cada uno se cifra y se guarda apenas llega) y al final se arma el VaultFile.
+    Vive en la BD para sobrevivir reinicios del worker.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="upload_sessions")
+    name = models.CharField(max_length=255)
+    size_bytes = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    # Cabecera del .enc final (versión, id de llave y prefijo de nonce)
+    header = models.BinaryField()
+    chunks_recibidos = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Subida {self.name} ({len(self.chunks_recibidos)}/{self.total_chunks})"
+
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.size_bytes // self.chunk_size))
+
+    def chunk_length(self, index):
+        if index < self.total_chunks - 1:
+            return self.chunk_size
+        return self.size_bytes - self.chunk_size * (self.total_chunks - 1)
+
+    @property
+    def chunks_faltantes(self):
+        recibidos = set(self.chunks_recibidos)
+        return [i for i in range(self.total_chunks) if i not in recibidos]
+
+    @property
+    def directorio(self):
+        return f"vault/uploads/{self.id}"
+
+    def chunk_path(self, index):
+        return f"{self.directorio}/{index:06d}.part"
+
+    def borrar_partes(self):
+        try:
+            _, archivos = default_storage.listdir(self.directorio)
+        except FileNotFoundError:
+            return
+        for nombre in archivos:
+            default_storage.delete(f"{self.directorio}/{nombre}")
+
+    @classmethod
+    def purgar_expiradas(cls):
+        """Borra las sesiones vencidas y sus trozos. Devuelve cuántas se borraron."""
+        expiradas = list(cls.objects.filter(expires_at__lt=timezone.now()))
+        for session in expiradas:
+            session.cancelar()
+        return len(expiradas)
+
+    def cancelar(self):
+        """Borra la sesión y sus trozos, y devuelve el espacio reservado."""
+        with transaction.atomic():
+            borradas, _ = UploadSession.objects.filter(pk=self.pk).delete()
+            if borradas:
+                Profile.ajustar_uso(self.user_id, bytes=-self.size_bytes)
+        self.borrar_partes()
+
+
+class CursorMantenimiento(models.Model):
+    """
+    Punto de avance de una tarea de mantenimiento larga (recorridos del storage,
+    re-cifrados...), para que una ejecución cortada siga donde quedó.
+    """
+    nombre = models.CharField(max_length=100, unique=True)
+    cursor = models.TextField(blank=True, default="")
+    actualizado_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Cursor de mantenimiento"
+        verbose_name_plural = "Cursores de mantenimiento"
+
+    def __str__(self):
+        return f"{self.nombre}: {self.cursor or '(inicio)'}"
+
+    @classmethod
+    def leer(cls, nombre):
+        return cls.objects.filter(nombre=nombre).values_list('cursor', flat=True).first() or ""
+
+    @classmethod
+    def guardar(cls, nombre, cursor):
+        cls.objects.update_or_create(nombre=nombre, defaults={'cursor': cursor})
+
+
+class PurgaCuenta(models.Model):
+    """
+    Borrado diferido de un usuario que se autodestruyó (10 intentos fallidos).
+    La cuenta queda bloqueada al instante y el comando `purgar_cuentas` borra
+    sus datos por lotes, dejando aquí el avance.
+    """
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('en_curso', 'En curso'),
+        ('completada', 'Completada'),
+        ('error', 'Error'),
+    ]
+    MOTIVOS = [
+        ('pin', 'PIN de bóveda'),
+        ('login', 'Inicio de sesión'),
+    ]
+
+    # Queda en NULL al terminar; user_id_original sirve de referencia
+    user = models.OneToOneField(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name="purga")
+    user_id_original = models.IntegerField(db_index=True)
+    motivo = models.CharField(max_length=10, choices=MOTIVOS)
+    estado = models.CharField(max_length=12, choices=ESTADOS, default='pendiente', db_index=True)
+    cuentas_borradas = models.IntegerField(default=0)
+    archivos_borrados = models.IntegerField(default=0)
+    bytes_liberados = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    creada_en = models.DateTimeField(auto_now_add=True)
+    actualizada_en = models.DateTimeField(auto_now=True)
+    completada_en = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-creada_en']
+        verbose_name = "Purga de cuenta"
+        verbose_name_plural = "Purgas de cuentas"
+
+    def __str__(self):
+        return f"Purga user {self.user_id_original} ({self.get_estado_display()})"
+
+    @classmethod
+    def programar(cls, user, motivo):
+        """
+        Bloquea al usuario y deja su borrado en cola. Se libera el email y el
+        username para que pueda registrarse de nuevo sin esperar la purga.
+        """
+        with transaction.atomic():
+            User.objects.filter(pk=user.pk).update(
+                is_active=False,
+                email="",
+                username=f"purgado-{user.pk}",
+                password="!",
+            )
+            # Sin su llave de datos la bóveda ya es ilegible, aunque los datos
+            # tarden en borrarse
+            Profile.objects.filter(user=user).update(dek_cifrada=DEK_DESTRUIDA)
+            # Los access tokens no consultan al usuario: así dejan de valer ya
+            Profile.renovar_tokens([user.pk])
+            purga, _ = cls.objects.get_or_create(
+                user=user, defaults={'user_id_original': user.pk, 'motivo': motivo})
+        olvidar_llave(user.pk)
+        return purga
+
+
+class Borrado(models.Model):
+    """
+    Lápida de una cuenta o archivo borrado, para que /api/sync/ se lo informe a
+    los clientes sin conexión. `podar_borrados` las elimina pasados
+    VAULT_SYNC_RETENCION_DIAS; un token más viejo que eso obliga a resincronizar todo.
+    """
+    TIPOS = [
+        ('cuenta', 'Cuenta'),
+        ('archivo', 'Archivo'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    tipo = models.CharField(max_length=10, choices=TIPOS)
+    objeto_id = models.CharField(max_length=36)
+    borrado_en = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'borrado_en'], name='borrado_user_fecha_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo} {self.objeto_id}"
+
+    @classmethod
+    def registrar(cls, user_id, tipo, ids):
+        cls.objects.bulk_create([cls(user_id=user_id, tipo=tipo, objeto_id=str(i)) for i in ids])
+
+
 class PlanConfig(models.Model):
     """Control de planes: Estándar, Premium, etc."""
     nombre = models.CharField(max_length=50, unique=True)
@@ -67,6 +397,22 @@ class PlanConfig(models.Model):
     def __str__(self):
         return f"Plan {self.nombre} (${self.precio_mensual})"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Cambian los límites que ve cada perfil con este plan
+        perfiles = Profile.objects.filter(plan=self)
+        perfiles.update(version_perfil=models.F('version_perfil') + 1)
+        Profile.renovar_tokens(list(perfiles.values_list('user_id', flat=True)))
+        Profile.recalcular_congeladas_en(perfiles, self.slots_cuentas_base)
+
+    def delete(self, *args, **kwargs):
+        usuarios = list(Profile.objects.filter(plan=self).values_list('user_id', flat=True))
+        resultado = super().delete(*args, **kwargs)
+        # Sus perfiles quedan sin plan, con el cupo base
+        Profile.renovar_tokens(usuarios)
+        Profile.recalcular_congeladas_en(Profile.objects.filter(user_id__in=usuarios), SIN_PLAN['cuentas'])
+        return resultado
+
 
 class PackConfig(models.Model):
     """Control de Packs: Pack 4k, Pack 10k, etc."""
@@ -105,13 +451,181 @@ class Profile(models.Model):
     ultima_vez_anuncio = models.DateTimeField(null=True, blank=True)
     fecha_registro = models.DateTimeField(auto_now_add=True)
 
+    # Uso desnormalizado: solo se modifica con F() (ver reservar/ajustar_uso)
+    # y el comando recalcular_uso corrige cualquier desfase.
+    bytes_usados = models.BigIntegerField(default=0, editable=False)
+    cuentas_usadas = models.IntegerField(default=0, editable=False)
+
+    CONTADORES = ('bytes_usados', 'cuentas_usadas')
+
+    # Versiones para los ETag de los listados (ver cuentas/condicional.py): se
+    # incrementan con F() en cada escritura, sin leerlas (ver tocar)
+    version_perfil = models.BigIntegerField(default=0, editable=False)
+    version_cuentas = models.BigIntegerField(default=0, editable=False)
+    version_archivos = models.BigIntegerField(default=0, editable=False)
+    # Va en el access token (ver core/auth/jwt.py): al cambiar plan o extras, o
+    # al bloquear la cuenta, los tokens emitidos dejan de valer y se renuevan
+    version_cupos = models.BigIntegerField(default=0, editable=False)
+
+    VERSIONES = ('version_perfil', 'version_cuentas', 'version_archivos', 'version_cupos')
+
+    # Llave de datos del usuario envuelta con la maestra (ver core/crypto.py).
+    # Vacía hasta el primer uso; borrarla deja ilegible todo lo cifrado con ella.
+    dek_cifrada = models.TextField(blank=True, default="", editable=False)
+
     def __str__(self):
         return f"Perfil de {self.user.username}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Para saber en save() si cambió el cupo de cuentas
+        instance._cupo_cargado = instance._cupo()
+        instance._extras_cargados = instance._extras()
+        return instance
+
+    def _cupo(self):
+        return (self.__dict__.get('plan_id'), self.__dict__.get('extra_slots_cuentas'))
+
+    def _extras(self):
+        return tuple(self.__dict__.get(campo) for campo in (
+            'extra_gb_almacenamiento', 'extra_slots_notas', 'extra_slots_recordatorios'))
+
+    def save(self, *args, **kwargs):
+        # Un save() completo con los contadores viejos en memoria pisaría los
+        # incrementos concurrentes, así que se excluyen salvo que se pidan.
+        # Lo mismo con la DEK, que se crea aparte con un update condicional,
+        # y con las versiones.
+        adding = self._state.adding
+        if not adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.CONTADORES + self.VERSIONES + ('dek_cifrada',)
+            ]
+        super().save(*args, **kwargs)
+        if not adding:
+            Profile.tocar(self.user_id, 'perfil')
+            # Plan nuevo, pack o recompensa por anuncios: cambia qué cuentas entran en el cupo
+            cambio_cupo = getattr(self, '_cupo_cargado', None) != self._cupo()
+            if cambio_cupo:
+                Profile.recalcular_congeladas(self.user_id)
+            if cambio_cupo or getattr(self, '_extras_cargados', None) != self._extras():
+                Profile.renovar_tokens([self.user_id])
+        self._cupo_cargado = self._cupo()
+        self._extras_cargados = self._extras()
+
+    @property
+    def cupos(self):
+        """Límites y uso (ver cuentas/cupos.py). En un request, mejor cupos_de(request)."""
+        return Cupos(self)
+
     @property
     def total_cuentas_permitidas(self):
-        base = self.plan.slots_cuentas_base if self.plan else 10
-        return base + self.extra_slots_cuentas
+        return self.cupos.cuentas
+
+    @property
+    def limite_bytes(self):
+        return self.cupos.bytes
+
+    @classmethod
+    def verificar_cupo(cls, user, bytes=0, cuentas=0):
+        """
+        Bloquea el perfil hasta el fin de la transacción en curso y lanza
+        CuotaExcedida si lo pedido no cabe. No descuenta nada: lo hace quien
+        da el alta (reservar, o Account.save para las cuentas).
+        """
+        profile = cls.objects.select_related('plan').select_for_update(of=('self',)).get(user=user)
+        if bytes and profile.bytes_usados + bytes > profile.limite_bytes:
+            raise CuotaExcedida('almacenamiento', profile)
+        if cuentas and profile.cuentas_usadas + cuentas > profile.total_cuentas_permitidas:
+            raise CuotaExcedida('cuentas', profile)
+        return profile
+
+    @classmethod
+    def reservar(cls, user, bytes=0, cuentas=0):
+        """
+        Verifica el cupo y lo descuenta con el perfil bloqueado, para que dos
+        altas concurrentes no pasen el límite. Lanza CuotaExcedida si no cabe.
+        """
+        with transaction.atomic():
+            cls.verificar_cupo(user, bytes=bytes, cuentas=cuentas)
+            cls.ajustar_uso(user, bytes=bytes, cuentas=cuentas)
+
+    @classmethod
+    def ajustar_uso(cls, user, bytes=0, cuentas=0):
+        """Suma (o resta) a los contadores sin leerlos, con F()."""
+        cambios = {}
+        if bytes:
+            cambios['bytes_usados'] = models.F('bytes_usados') + bytes
+        if cuentas:
+            cambios['cuentas_usadas'] = models.F('cuentas_usadas') + cuentas
+        if cambios:
+            cls.objects.filter(user=user).update(**cambios)
+
+    @classmethod
+    def recalcular_congeladas(cls, user):
+        """
+        Efecto congelador: las cuentas que exceden el cupo (se salvan las más
+        antiguas) quedan de solo lectura con Account.congelada. Se llama al cambiar
+        el cupo y al crear o borrar cuentas. Es un solo UPDATE que solo escribe
+        las filas que cambian; devuelve cuántas fueron.
+        """
+        profile = cls.objects.select_related('plan').filter(user=user).first()
+        if profile is None:
+            return 0
+        cuentas = Account.objects.filter(user=user)
+        cupo = profile.total_cuentas_permitidas
+        if profile.cuentas_usadas <= cupo:
+            # Todas entran: solo puede haber que descongelar
+            cambiadas = cuentas.filter(congelada=True).update(congelada=False, updated_at=timezone.now())
+        else:
+            editables = cuentas.order_by('created_at', 'id').values('id')[:cupo]
+            cambiadas = cuentas.filter(
+                Q(congelada=True, id__in=editables) | Q(Q(congelada=False), ~Q(id__in=editables))
+            ).update(
+                congelada=Case(When(id__in=editables, then=Value(False)), default=Value(True)),
+                updated_at=timezone.now(),
+            )
+        if cambiadas:
+            cls.tocar(user, 'cuentas')
+        return cambiadas
+
+    @classmethod
+    def recalcular_congeladas_en(cls, perfiles, base):
+        """recalcular_congeladas() para los `perfiles` que con un cupo base `base` pueden cambiar."""
+        afectados = perfiles.filter(
+            Q(cuentas_usadas__gt=F('extra_slots_cuentas') + base) | Q(user__accounts__congelada=True)
+        ).values_list('user_id', flat=True).distinct()
+        for user_id in list(afectados):
+            cls.recalcular_congeladas(user_id)
+
+    @classmethod
+    def renovar_tokens(cls, user_ids):
+        """
+        Sube version_cupos: los access tokens ya emitidos (con el plan y los
+        límites viejos) se rechazan y el cliente los renueva.
+        """
+        from core.auth.jwt import olvidar_versiones
+        cls.objects.filter(user_id__in=user_ids).update(version_cupos=models.F('version_cupos') + 1)
+        olvidar_versiones(user_ids)
+
+    @classmethod
+    def tocar(cls, user, *recursos):
+        """
+        Sube la versión de 'perfil', 'cuentas' y/o 'archivos' del usuario, lo que
+        invalida los ETag ya entregados. Toda escritura que cambie esos listados
+        debe llamarlo (dentro de su transacción, si la tiene).
+        """
+        cls.objects.filter(user=user).update(**{
+            f'version_{recurso}': models.F(f'version_{recurso}') + 1 for recurso in recursos
+        })
+
+
+class CuotaExcedida(Exception):
+    def __init__(self, recurso, profile):
+        self.recurso = recurso
+        self.profile = profile
+        super().__init__(f"Cuota de {recurso} excedida")
 
 
 class Account(models.Model):
@@ -128,24 +642,155 @@ class Account(models.Model):
     site_icon_url = models.URLField(max_length=500, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Fuera del cupo del plan: solo lectura (ver Profile.recalcular_congeladas)
+    congelada = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        indexes = [
+            # Listado paginado por cursor: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+            models.Index(fields=['user', '-created_at', '-id'], name='account_user_created_idx'),
+            # Sincronización: WHERE user_id = ? AND updated_at >= ?
+            models.Index(fields=['user', 'updated_at'], name='account_user_updated_idx'),
+        ]
 
     def save(self, *args, **kwargs):
-        # Lógica: Si el usuario puso una URL del sitio, pero NO subió un icono propio
-        if self.site_url and not self.site_icon_url:
-            try:
-                parsed = urlparse(self.site_url)
+        self.preparar()
+        adding = self._state.adding
+        with transaction.atomic():
+            # Guardamos normalmente
+            super().save(*args, **kwargs)
+            TerminoBusqueda.indexar([self])
+            Icono.pedir([self])
+            Profile.tocar(self.user_id, 'cuentas')
+            if adding:
+                # El contador y las congeladas siguen a toda alta, venga de donde venga.
+                # El cupo lo verifica antes quien la pide (ver Profile.verificar_cupo).
+                Profile.ajustar_uso(self.user_id, cuentas=1)
+                Profile.recalcular_congeladas(self.user_id)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            resultado = super().delete(*args, **kwargs)
+            Profile.ajustar_uso(self.user_id, cuentas=-1)
+            Profile.tocar(self.user_id, 'cuentas')
+            # Si sobraban cuentas, la siguiente en antigüedad deja de estar congelada
+            Profile.recalcular_congeladas(self.user_id)
+        return resultado
+
+    def preparar(self):
+        """
+        Calcula los campos derivados. save() lo llama solo; para insertar
+        muchas de una vez está insertar_lote(), que tampoco pasa por save.
+        """
+        # Sin icono propio del usuario se usa el de la caché del servidor
+        # (ver cuentas/iconos.py), que sigue al site_url si este cambia
+        if not self.site_icon_url or es_url_de_icono(self.site_icon_url):
+            dominio = dominio_de(self.site_url)
+            self.site_icon_url = url_de_icono(dominio) if dominio else None
 
-                domain = parsed.netloc if parsed.netloc else parsed.path.split(
-                    '/')[0]
+    def __str__(self):
+        return f"{self.site_name or self.email}"
 
-                if domain:
-                    self.site_icon_url = f"https://icons.duckduckgo.com/ip3/{domain}.ico"
+    @classmethod
+    def insertar_lote(cls, user, accounts, batch_size=500):
+        """
+        Inserta con bulk_create cuentas ya preparadas (ver preparar) y hace lo que
+        save() haría por cada una: índice de búsqueda, iconos, uso, congeladas y
+        versión. El cupo lo verifica quien llama, con el perfil bloqueado.
+        """
+        accounts = list(accounts)
+        if not accounts:
+            return accounts
+        with transaction.atomic():
+            cls.objects.bulk_create(accounts, batch_size=batch_size)
+            TerminoBusqueda.indexar(accounts)
+            Icono.pedir(accounts)
+            Profile.ajustar_uso(user, cuentas=len(accounts))
+            Profile.tocar(user, 'cuentas')
+            Profile.recalcular_congeladas(user)
+        return accounts
+
+    @classmethod
+    def borrar_lote(cls, user, ids):
+        """
+        Borra de una vez las cuentas `ids` del usuario y hace lo que delete()
+        haría por cada una: uso, versión y congeladas. Devuelve cuántas borró.
+        """
+        with transaction.atomic():
+            borradas = cls.objects.filter(user=user, id__in=ids).delete()[1].get(cls._meta.label, 0)
+            if borradas:
+                Profile.ajustar_uso(user, cuentas=-borradas)
+                Profile.tocar(user, 'cuentas')
+                Profile.recalcular_congeladas(user)
+        return borradas
+
+
+class TerminoBusqueda(models.Model):
+    """
+    Índice de búsqueda de cuentas: palabras normalizadas (ver cuentas/busqueda.py)
+    y el dominio registrado del sitio. Se reconstruye en cada save() de la cuenta.
+    """
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name="terminos")
+    # Repetido desde la cuenta para que el índice filtre por usuario sin join
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    termino = models.CharField(max_length=100)
+    tipo = models.SmallIntegerField(default=TIPO_PALABRA)
 
-            except Exception as e:
-                print(f"No se pudo generar el icono: {e}")
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'termino'], name='termino_user_idx'),
+        ]
 
-        # Guardamos normalmente
-        super().save(*args, **kwargs)
+    def __str__(self):
+        return self.termino
+
+    @classmethod
+    def indexar(cls, accounts):
+        """Reemplaza los términos de `accounts` (recién guardadas o editadas)."""
+        accounts = list(accounts)
+        if not accounts:
+            return
+        filas = [
+            cls(account_id=account.pk, user_id=account.user_id, termino=termino, tipo=tipo)
+            for account in accounts
+            for termino, tipo in terminos_de(account)
+        ]
+        with transaction.atomic():
+            cls.objects.filter(account_id__in=[a.pk for a in accounts]).delete()
+            cls.objects.bulk_create(filas, batch_size=1000)
+
+
+class Icono(models.Model):
+    """
+    Favicon de un dominio, compartido por todas las cuentas que lo usan.
+    Lo descarga y refresca el comando `actualizar_iconos`; /api/iconos/ lo sirve.
+    """
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('listo', 'Listo'),
+        ('sin_icono', 'El sitio no tiene icono'),
+        ('error', 'Error al descargar'),
+    ]
+
+    dominio = models.CharField(max_length=253, unique=True)
+    estado = models.CharField(max_length=10, choices=ESTADOS, default='pendiente')
+    contenido = models.BinaryField(blank=True, default=b"")
+    content_type = models.CharField(max_length=50, blank=True)
+    # Huella del contenido, sirve de ETag
+    huella = models.CharField(max_length=64, blank=True)
+    intentos = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    obtenido_en = models.DateTimeField(null=True, blank=True)
+    # Cuándo le toca (volver a) descargarse; los pendientes vencen al crearse
+    vence_en = models.DateTimeField(default=timezone.now, db_index=True)
 
     def __str__(self):
-        return f"{self.site_name or self.email}"
+        return f"{self.dominio} ({self.get_estado_display()})"
+
+    @classmethod
+    def pedir(cls, accounts):
+        """Deja en cola los dominios de `accounts` que todavía no tienen fila."""
+        dominios = {dominio_de(a.site_url) for a in accounts if a.site_url}
+        dominios.discard("")
+        if dominios:
+            cls.objects.bulk_create([cls(dominio=d) for d in dominios], ignore_conflicts=True)
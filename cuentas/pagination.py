@@ -0,0 +1,30 @@
+# cuentas/pagination.py
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class PaginacionPorCursor(CursorPagination):
+    """
+    Paginación por cursor (keyset) sobre (created_at, id), la misma clave del
+    índice compuesto por usuario: cada página cuesta lo mismo aunque el usuario
+    tenga 10 o 100.000 filas, cosa que con OFFSET no pasa.
+
+    Se activa cuando el cliente manda `?page_size=` o `?cursor=`; sin ellos se
+    responde la lista completa como siempre, para no romper clientes actuales.
+    Con `?search=` tampoco se pagina.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.page_size = settings.VAULT_PAGE_SIZE
+        self.max_page_size = settings.VAULT_MAX_PAGE_SIZE
+
+    def get_page_size(self, request):
+        params = request.query_params
+        if self.page_size_query_param not in params and self.cursor_query_param not in params:
+            return None
+        if params.get('search'):
+            # La búsqueda ya viene ordenada por relevancia y acotada (ver BusquedaIndexada)
+            return None
+        return super().get_page_size(request)
@@ -1,5 +1,5 @@
 from rest_framework import permissions
-from .models import Account
+from .cupos import cupos_de
 
 
 class IsAccountOwnerAndWithinLimit(permissions.BasePermission):
@@ -10,15 +10,15 @@ class IsAccountOwnerAndWithinLimit(permissions.BasePermission):
        quedó fuera del límite tras un downgrade (es decir, es de solo lectura).
     """
     message = "Límite de plan excedido."
+    mensaje_congelada = "Esta cuenta está congelada (Solo Lectura) porque excede tu límite actual."
 
     def has_permission(self, request, view):
-        if request.method == 'POST':
-            profile = request.user.profile
-            # Contamos cuántas tiene actualmente
-            current_count = Account.objects.filter(user=request.user).count()
-
-            if current_count >= profile.total_cuentas_permitidas:
-                self.message = f"Has alcanzado tu límite de {profile.total_cuentas_permitidas} cuentas. Sube de nivel para seguir agregando."
+        # Solo el alta consume cupo (otros POST, como revelar, no)
+        if request.method == 'POST' and getattr(view, 'action', 'create') == 'create':
+            # Contador desnormalizado (la reserva definitiva se hace al guardar)
+            cupos = cupos_de(request)
+            if not cupos.cabe(cuentas=1):
+                self.message = f"Has alcanzado tu límite de {cupos.cuentas} cuentas. Sube de nivel para seguir agregando."
                 return False
 
         # Para listar (GET) u otros, dejamos pasar (la vista filtra por usuario)
@@ -26,25 +26,18 @@ class IsAccountOwnerAndWithinLimit(permissions.BasePermission):
 
     def has_object_permission(self, request, view, obj):
         # Primero validamos que sea el dueño
-        if obj.user != request.user:
+        if obj.user_id != request.user.pk:
             return False
 
         # Si es método seguro (GET, HEAD, OPTIONS), permitimos leer siempre.
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        # Si intenta escribir (PUT, PATCH, DELETE), verificamos si ESTA cuenta es editable
-        profile = request.user.profile
-        limit = profile.total_cuentas_permitidas
-
-        # Obtenemos los IDs de las 'N' cuentas más antiguas (las que entran en el plan)
-        # Esto define cuáles se salvan del congelamiento.
-        editable_ids = Account.objects.filter(user=request.user)\
-                                      .order_by('created_at')\
-                                      .values_list('id', flat=True)[:limit]
-
-        if obj.id not in editable_ids:
-            self.message = "Esta cuenta está congelada (Solo Lectura) porque excede tu límite actual."
+        # Si intenta escribir (PUT, PATCH, DELETE), verificamos si ESTA cuenta es editable.
+        # La marca se mantiene al día al cambiar el plan o el número de cuentas
+        # (ver Profile.recalcular_congeladas), así que basta leerla.
+        if obj.congelada:
+            self.message = self.mensaje_congelada
             return False
 
         return True
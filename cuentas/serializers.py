@@ -4,13 +4,19 @@ from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 from rest_framework.exceptions import ValidationError, AuthenticationFailed
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from django.core.files.base import ContentFile
 from django.contrib.auth.models import User
 from django.contrib.auth.hashers import make_password, check_password
-from django.db.models import Sum
 from django.db import transaction
-from core.utils import encrypt_text, decrypt_text, encrypt_bytes
-from .models import VaultFile, Anuncio, Profile, Account, PlanConfig
+from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
+import mimetypes
+from core.utils import encrypt_text, decrypt_text, StreamEncryptedFile, StreamEncryptor, content_digest, choose_codec
+from core.crypto import llave_de_usuario
+from core.auth.hashers import trabajo_de_hash
+from core.auth.jwt import agregar_claims
+from .models import VaultFile, VaultBlob, Anuncio, Profile, Account, PlanConfig, UploadSession, CuotaExcedida, PurgaCuenta
+from .cupos import cupos_de
 
 class AnuncioSerializer(serializers.ModelSerializer):
     class Meta:
@@ -18,51 +24,121 @@ class AnuncioSerializer(serializers.ModelSerializer):
         fields = ['id', 'titulo', 'mensaje', 'creado_en', 'expira_en', 'tipo']
 
 
+def validar_cuota_almacenamiento(request, size_bytes):
+    # Chequeo rápido con el contador; la reserva real se hace con el perfil bloqueado
+    cupos = cupos_de(request)
+    if not cupos.cabe(bytes=size_bytes):
+        raise serializers.ValidationError(mensaje_cuota_excedida(CuotaExcedida('almacenamiento', cupos.profile)))
+
+
+def mensaje_cuota_excedida(error):
+    cupos = error.profile.cupos
+    if error.recurso == 'cuentas':
+        return (f"Has alcanzado tu límite de {cupos.cuentas} cuentas. "
+                "Sube de nivel para seguir agregando.")
+    return f"Espacio insuficiente. Tienes {cupos.gb}GB y estás intentando superar el límite."
+
+
 class VaultFileSerializer(serializers.ModelSerializer):
+    # True si el contenido ya estaba en la bóveda y no ocupó espacio extra
+    deduplicado = serializers.SerializerMethodField()
+    codec = serializers.CharField(source='blob.codec', read_only=True, default='identity')
+
     class Meta:
         model = VaultFile
-        fields = ['id', 'name', 'file', 'size_bytes', 'created_at']
+        fields = ['id', 'name', 'file', 'size_bytes', 'codec', 'deduplicado', 'created_at']
         read_only_fields = ['size_bytes', 'created_at', 'name']
 
+    def get_deduplicado(self, obj):
+        return bool(obj.blob_id) and obj.blob.ref_count > 1
+
     def validate_file(self, value):
         user = self.context['request'].user
-        LIMIT_MB = 50
+        LIMIT_MB = settings.VAULT_MAX_UPLOAD_MB
         if value.size > LIMIT_MB * 1024 * 1024:
-            raise serializers.ValidationError(f"El archivo excede el límite de {LIMIT_MB}MB para cifrado seguro.")
-
-        profile = user.profile
-        if profile.plan:
-            base_gb = profile.plan.limite_gb_base
-        else:
-            base_gb = 0
-            
-        total_limit_gb = base_gb + profile.extra_gb_almacenamiento
-        total_limit_bytes = total_limit_gb * 1024 * 1024 * 1024
-
-        used_bytes = VaultFile.objects.filter(user=user).aggregate(
-            Sum('size_bytes'))['size_bytes__sum'] or 0
-
-        if (used_bytes + value.size) > total_limit_bytes:
             raise serializers.ValidationError(
-                f"Espacio insuficiente. Tienes {total_limit_gb}GB y estás intentando superar el límite.")
+                f"El archivo excede el límite de {LIMIT_MB}MB por envío. Usa la subida por partes (/api/uploads/).")
 
+        # Si el contenido ya existe en la bóveda no ocupa espacio nuevo
+        value.vault_digest = content_digest(llave_de_usuario(user.id), value.chunks())
+        if not VaultBlob.objects.filter(user=user, digest=value.vault_digest).exists():
+            validar_cuota_almacenamiento(self.context['request'], value.size)
         return value
     
     def create(self, validated_data):
         uploaded_file = validated_data.pop('file')
         user = self.context['request'].user
 
-        file_bytes = uploaded_file.read()
-        encrypted_bytes = encrypt_bytes(file_bytes)
+        llave = llave_de_usuario(user.id)
+        digest = getattr(uploaded_file, 'vault_digest', None) or content_digest(
+            llave, uploaded_file.chunks())
 
-        encrypted_file = ContentFile(encrypted_bytes, name=f"{uploaded_file.name}.enc")
+        # Se comprime (si vale la pena) y se cifra por segmentos mientras el storage
+        # escribe, sin leer todo a memoria. Si el blob ya existe no se escribe nada.
+        codec = choose_codec(uploaded_file, mimetypes.guess_type(uploaded_file.name)[0])
+        encrypted_file = StreamEncryptedFile(
+            uploaded_file, name=f"{uploaded_file.name}.enc", codec=codec, llave=llave)
+
+        try:
+            blob, _ = VaultBlob.guardar(user, digest, uploaded_file.size, encrypted_file)
+        except CuotaExcedida as e:
+            raise serializers.ValidationError({'file': [mensaje_cuota_excedida(e)]})
+
+        try:
+            return VaultFile.objects.create(
+                user=user,
+                blob=blob,
+                file=blob.file.name,
+                name=uploaded_file.name,
+                size_bytes=uploaded_file.size
+            )
+        except Exception:
+            VaultBlob.liberar(blob.pk)
+            raise
 
-        return VaultFile.objects.create(
-            user=user,
-            file=encrypted_file,
-            name=uploaded_file.name,
-            size_bytes=uploaded_file.size
-        )
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    total_chunks = serializers.IntegerField(read_only=True)
+    chunks_faltantes = serializers.ListField(read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'name', 'size_bytes', 'chunk_size', 'total_chunks',
+                  'chunks_recibidos', 'chunks_faltantes', 'created_at', 'expires_at']
+        read_only_fields = ['chunk_size', 'chunks_recibidos', 'created_at', 'expires_at']
+
+    def validate_name(self, value):
+        # Termina en la ruta del .enc al finalizar: sin directorios ni '..'
+        try:
+            return VaultFile.limpiar_nombre(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+
+    def validate_size_bytes(self, value):
+        LIMIT_MB = settings.VAULT_MAX_RESUMABLE_UPLOAD_MB
+        if value <= 0:
+            raise serializers.ValidationError("El archivo está vacío.")
+        if value > LIMIT_MB * 1024 * 1024:
+            raise serializers.ValidationError(f"El archivo excede el límite de {LIMIT_MB}MB.")
+
+        # La cuota se reserva contra el tamaño declarado, antes de recibir nada
+        validar_cuota_almacenamiento(self.context['request'], value)
+        return value
+
+    def create(self, validated_data):
+        validated_data['chunk_size'] = settings.VAULT_UPLOAD_CHUNK_SIZE
+        validated_data['header'] = StreamEncryptor(llave=llave_de_usuario(validated_data['user'].id)).header
+        validated_data['expires_at'] = timezone.now() + timedelta(
+            hours=settings.VAULT_UPLOAD_SESSION_HOURS)
+
+        # El espacio queda reservado hasta finalizar o cancelar la sesión
+        user = validated_data['user']
+        try:
+            with transaction.atomic():
+                Profile.reservar(user, bytes=validated_data['size_bytes'])
+                return super().create(validated_data)
+        except CuotaExcedida as e:
+            raise serializers.ValidationError({'size_bytes': [mensaje_cuota_excedida(e)]})
 
 
 class AccountSerializer(serializers.ModelSerializer):
@@ -78,19 +154,20 @@ class AccountSerializer(serializers.ModelSerializer):
         exclude = ("user", "password_encrypted", "secret_encrypted")
 
     def get_decrypted_password(self, obj):
-        return decrypt_text(obj.password_encrypted)
+        return decrypt_text(obj.password_encrypted, llave_de_usuario(obj.user_id))
 
     def get_decrypted_secret(self, obj):
-        return decrypt_text(obj.secret_encrypted)
+        return decrypt_text(obj.secret_encrypted, llave_de_usuario(obj.user_id))
 
     def create(self, validated_data):
         password_raw = validated_data.pop('password', None)
         secret_raw = validated_data.pop('secret', None)
+        llave = llave_de_usuario(self.context['request'].user.id)
 
         if password_raw:
-            validated_data['password_encrypted'] = encrypt_text(password_raw)
+            validated_data['password_encrypted'] = encrypt_text(password_raw, llave)
         if secret_raw:
-            validated_data['secret_encrypted'] = encrypt_text(secret_raw)
+            validated_data['secret_encrypted'] = encrypt_text(secret_raw, llave)
 
         return super().create(validated_data)
 
@@ -98,14 +175,31 @@ class AccountSerializer(serializers.ModelSerializer):
         password_raw = validated_data.pop('password', None)
         secret_raw = validated_data.pop('secret', None)
 
+        llave = llave_de_usuario(instance.user_id)
+
         if password_raw:
-            validated_data['password_encrypted'] = encrypt_text(password_raw)
+            validated_data['password_encrypted'] = encrypt_text(password_raw, llave)
         if secret_raw:
-            validated_data['secret_encrypted'] = encrypt_text(secret_raw)
+            validated_data['secret_encrypted'] = encrypt_text(secret_raw, llave)
 
         return super().update(instance, validated_data)
 
 
+class AccountMetadataSerializer(serializers.ModelSerializer):
+    """
+    Listado liviano: solo metadatos, sin descifrar nada. La contraseña y el
+    secreto se piden aparte con /cuentas/{id}/revelar/ o /cuentas/revelar/.
+    """
+    tiene_secret = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Account
+        exclude = ("user", "password_encrypted", "secret_encrypted")
+
+    def get_tiene_secret(self, obj):
+        return bool(obj.secret_encrypted)
+
+
 # --- Serializers para Auth y Registro ---
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -137,37 +231,40 @@ class RegisterSerializer(serializers.ModelSerializer):
 
         respuesta_lower = respuesta_raw.strip().lower()
         
-        respuesta_hash = make_password(respuesta_lower)
-        pin_hash = make_password(pin_raw)
-
-        if isinstance(respuesta_hash, bytes): respuesta_hash = respuesta_hash.decode('utf-8')
-        if isinstance(pin_hash, bytes): pin_hash = pin_hash.decode('utf-8')
-
-        with transaction.atomic():
-                    user = User.objects.create_user(**validated_data)
-
-                    plan_free, _ = PlanConfig.objects.get_or_create(
-                        nombre="Plan Gratuito",
-                        defaults={
-                            "precio_mensual": 0,
-                            "slots_cuentas_base": 10,
-                            "limite_gb_base": 2.0,
-                            "slots_notas_base": 5,
-                            "slots_recordatorios_base": 1
-                        }
-                    )
-
-                    Profile.objects.update_or_create(
-                        user=user,
-                        defaults={
-                            'pregunta_seguridad': pregunta_final,
-                            'respuesta_seguridad': respuesta_hash,
-                            'pin_boveda': pin_hash,
-                            'intentos_fallidos': 0,
-                            'plan': plan_free
-                        }
-                    )
-                    
+        # Los tres hashes del registro (respuesta, PIN y contraseña) ocupan un solo
+        # lugar del control de admisión (ver core/auth/hashers.py)
+        with trabajo_de_hash():
+            respuesta_hash = make_password(respuesta_lower)
+            pin_hash = make_password(pin_raw)
+
+            if isinstance(respuesta_hash, bytes): respuesta_hash = respuesta_hash.decode('utf-8')
+            if isinstance(pin_hash, bytes): pin_hash = pin_hash.decode('utf-8')
+
+            with transaction.atomic():
+                user = User.objects.create_user(**validated_data)
+
+                plan_free, _ = PlanConfig.objects.get_or_create(
+                    nombre="Plan Gratuito",
+                    defaults={
+                        "precio_mensual": 0,
+                        "slots_cuentas_base": 10,
+                        "limite_gb_base": 2.0,
+                        "slots_notas_base": 5,
+                        "slots_recordatorios_base": 1
+                    }
+                )
+
+                Profile.objects.update_or_create(
+                    user=user,
+                    defaults={
+                        'pregunta_seguridad': pregunta_final,
+                        'respuesta_seguridad': respuesta_hash,
+                        'pin_boveda': pin_hash,
+                        'intentos_fallidos': 0,
+                        'plan': plan_free
+                    }
+                )
+
         return user
 
 
@@ -198,7 +295,7 @@ class EmailTokenObtainPairSerializer(TokenObtainPairSerializer):
             profile.save()
 
             if profile.intentos_fallidos >= 10:
-                user.delete()
+                PurgaCuenta.programar(user, motivo='login')
                 raise AuthenticationFailed(
                     "Has excedido el límite de 10 intentos de seguridad. "
                     "Tu cuenta y todos tus datos han sido eliminados permanentemente por seguridad."
@@ -210,10 +307,11 @@ class EmailTokenObtainPairSerializer(TokenObtainPairSerializer):
                 f"Te quedan {intentos_restantes} intentos antes de que se elimine la cuenta."
             )
 
-        if not user.check_password(password):
-            registrar_fallo_y_salir()
-
-        if not check_password(security_answer, profile.respuesta_seguridad):
+        # Las dos verificaciones de Argon2 ocupan un solo lugar (ver core/auth/hashers.py)
+        with trabajo_de_hash():
+            correctas = (user.check_password(password)
+                         and check_password(security_answer, profile.respuesta_seguridad))
+        if not correctas:
             registrar_fallo_y_salir()
 
         if not user.is_active:
@@ -224,6 +322,8 @@ class EmailTokenObtainPairSerializer(TokenObtainPairSerializer):
             profile.save()
 
         refresh = self.get_token(user)
+        # El access hereda estos claims: JWTSinConsulta no necesita leer el usuario
+        agregar_claims(refresh, user, profile)
 
         return {
             'refresh': str(refresh),
@@ -0,0 +1,75 @@
+# cuentas/sync.py
+"""
+Sincronización por deltas para los clientes sin conexión (GET /api/sync/).
+
+El servidor entrega un token firmado con el instante de la sincronización; con
+él, la siguiente llamada recibe solo las cuentas y archivos creados o editados
+desde entonces, y los ids borrados (ver Borrado). Sin token se entrega todo.
+
+Los cambios se piden desde un poco antes del instante del token (MARGEN): una
+transacción que escribió su updated_at antes de emitirse el token pero hizo
+commit después igual se informa. El cliente recibe a veces una fila repetida,
+que aplica como un upsert.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+from .models import Account, VaultFile, Borrado
+
+SALT = "cuentas.sync"
+MARGEN = timedelta(seconds=5)
+
+
+class TokenSyncInvalido(Exception):
+    pass
+
+
+class TokenSyncVencido(Exception):
+    """El token es anterior a la retención de lápidas: hay que sincronizar todo."""
+
+
+def emitir_token(user, instante):
+    return signing.dumps({'u': user.pk, 'd': instante.timestamp()}, salt=SALT)
+
+
+def leer_token(user, token):
+    """Devuelve el instante guardado en `token`."""
+    try:
+        datos = signing.loads(token, salt=SALT)
+        instante = datetime.fromtimestamp(float(datos['d']), tz=dt_timezone.utc)
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        raise TokenSyncInvalido("El token de sincronización no es válido.")
+    if datos.get('u') != user.pk:
+        raise TokenSyncInvalido("El token de sincronización no es válido.")
+
+    retencion = timedelta(days=settings.VAULT_SYNC_RETENCION_DIAS)
+    if instante - MARGEN < timezone.now() - retencion:
+        raise TokenSyncVencido("El token de sincronización venció. Sincroniza de nuevo sin token.")
+    return instante
+
+
+def cambios(user, desde=None):
+    """
+    Cuentas, archivos y borrados de `user` desde el instante `desde` (None = todo).
+    Las cuentas vienen con .defer('password_encrypted'): se descifran aparte.
+    """
+    cuentas = Account.objects.filter(user=user).defer('password_encrypted').order_by('updated_at', 'id')
+    archivos = VaultFile.objects.filter(user=user).select_related('blob').order_by('updated_at', 'id')
+    borrados = {'cuentas': [], 'archivos': []}
+    if desde is None:
+        return list(cuentas), list(archivos), borrados
+
+    desde = desde - MARGEN
+    cuentas = list(cuentas.filter(updated_at__gte=desde))
+    archivos = list(archivos.filter(updated_at__gte=desde))
+
+    # Un id borrado que volvió (p.ej. al restaurar un respaldo) va solo como cambio
+    vigentes = {str(a.pk) for a in cuentas} | {str(f.pk) for f in archivos}
+    lapidas = Borrado.objects.filter(user=user, borrado_en__gte=desde).values_list('tipo', 'objeto_id')
+    for tipo, objeto_id in lapidas:
+        if objeto_id not in vigentes:
+            borrados['cuentas' if tipo == 'cuenta' else 'archivos'].append(objeto_id)
+    return cuentas, archivos, borrados
@@ -1,3 +1,1220 @@
 from django.test import TestCase
 
-# Se devolvió a un commit debido a una inconsistencia con los datos
\ No newline at end of file
+# Se devolvió a un commit debido a una inconsistencia con los datos
+
+import io
+import os
+import shutil
+import socket
+import tarfile
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db.models import F
+from django.db.models.fields.files import FieldFile
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.auth.jwt import JWTSinConsulta
+from core.crypto import DEK_DESTRUIDA, DEK_PREFIX, decrypt_many, get_llavero, llave_de_usuario, olvidar_llave
+from core.utils import (
+    SEGMENT_SIZE, EncryptedFormatError, StreamEncryptedFile, encrypt_text, read_stream_header,
+)
+
+from .cupos import SIN_PLAN, cupos_de, olvidar_cupos
+from .iconos import _ConexionPublica, descargar_favicon, direccion_publica, dominio_de
+from .models import (
+    Account, Anuncio, Borrado, CursorMantenimiento, Icono, PlanConfig, Profile, PurgaCuenta, VaultBlob, VaultFile,
+)
+from .sync import emitir_token
+
+PASSWORD = 'pw12345!'
+RESPUESTA = 'azul'
+PIN = '1234'
+
+
+def crear_usuario(nombre='ana', plan=None):
+    """Usuario con perfil y plan gratuito, como lo deja el registro."""
+    user = User.objects.create_user(username=nombre, email=f"{nombre}@niun.local", password=PASSWORD)
+    if plan is None:
+        plan, _ = PlanConfig.objects.get_or_create(
+            nombre="Plan Gratuito",
+            defaults={"precio_mensual": 0, "slots_cuentas_base": 10, "limite_gb_base": 2.0,
+                      "slots_notas_base": 5, "slots_recordatorios_base": 1},
+        )
+    Profile.objects.create(
+        user=user, plan=plan, pregunta_seguridad='color',
+        respuesta_seguridad=make_password(RESPUESTA), pin_boveda=make_password(PIN),
+    )
+    # Tras el rollback de una prueba anterior el id se reutiliza: su DEK no sirve
+    olvidar_llave(user.pk)
+    return user
+
+
+# Hashes rápidos: el control de admisión de Argon2 tiene sus propias pruebas
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class VaultTestCase(TestCase):
+    def setUp(self):
+        # Contadores del límite de intentos y versiones de cupos de la prueba anterior
+        cache.clear()
+        # Los archivos subidos van a un directorio temporal
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        ajuste = override_settings(MEDIA_ROOT=media)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        self.user = crear_usuario()
+        self.client = self.cliente(self.user)
+
+    def cliente(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def login(self, user):
+        r = APIClient().post('/api/auth/login/', {
+            'email': user.email, 'password': PASSWORD, 'security_answer': RESPUESTA,
+        }, format='json')
+        self.assertEqual(r.status_code, 200, r.content)
+        return r.json()
+
+    def cliente_jwt(self, access):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        return client
+
+    def crear_cuenta(self, client=None, **datos):
+        datos = {'email': 'yo@correo.cl', 'password': 'secreta', 'site_url': 'https://ejemplo.cl', **datos}
+        r = (client or self.client).post('/api/cuentas/', datos, format='json')
+        self.assertEqual(r.status_code, 201, r.content)
+        return r.json()
+
+    def subir(self, nombre='nota.txt', contenido=b'hola mundo', client=None):
+        archivo = SimpleUploadedFile(nombre, contenido)
+        r = (client or self.client).post('/api/files/', {'file': archivo}, format='multipart')
+        self.assertEqual(r.status_code, 201, r.content)
+        return r.json()
+
+
+class DescargaTests(VaultTestCase):
+    def setUp(self):
+        super().setUp()
+        # Varios segmentos de cifrado, sin comprimir (bytes aleatorios)
+        self.datos = os.urandom(2 * SEGMENT_SIZE + 100)
+        self.archivo = self.subir('video.bin', self.datos)
+        self.url = f"/api/files/{self.archivo['id']}/download/"
+
+    def descargar(self, **headers):
+        r = self.client.get(self.url, headers=headers)
+        contenido = b''.join(r.streaming_content) if r.streaming else r.content
+        return r, contenido
+
+    def test_completo(self):
+        r, contenido = self.descargar()
+        self.assertEqual((r.status_code, contenido), (200, self.datos))
+        self.assertEqual(r['Content-Length'], str(len(self.datos)))
+        self.assertEqual(r['Accept-Ranges'], 'bytes')
+
+    def test_rangos(self):
+        tam = len(self.datos)
+        casos = {
+            f"bytes={SEGMENT_SIZE - 5}-{SEGMENT_SIZE + 5}": (SEGMENT_SIZE - 5, SEGMENT_SIZE + 6),
+            "bytes=100-": (100, tam),
+            "bytes=-10": (tam - 10, tam),
+            f"bytes=0-{tam * 2}": (0, tam),
+        }
+        for rango, (inicio, fin) in casos.items():
+            r, contenido = self.descargar(Range=rango)
+            self.assertEqual(r.status_code, 206, rango)
+            self.assertEqual(contenido, self.datos[inicio:fin], rango)
+            self.assertEqual(r['Content-Range'], f"bytes {inicio}-{fin - 1}/{tam}")
+
+    def test_rangos_mal_formados_se_ignoran(self):
+        for rango in ("bytes=5-3", "bytes=0-1,5-6", "bytes=-", "bytes=abc", "bytes=+5-", "items=0-5", "bytes=²-"):
+            r, contenido = self.descargar(Range=rango)
+            self.assertEqual((r.status_code, contenido), (200, self.datos), rango)
+
+    def test_rango_fuera_del_archivo(self):
+        for rango in (f"bytes={len(self.datos)}-", "bytes=-0"):
+            r, _ = self.descargar(Range=rango)
+            self.assertEqual(r.status_code, 416, rango)
+            self.assertEqual(r['Content-Range'], f"bytes */{len(self.datos)}")
+
+    def test_if_range(self):
+        r, _ = self.descargar()
+        r, contenido = self.descargar(Range="bytes=0-9", If_Range=r['ETag'])
+        self.assertEqual((r.status_code, contenido), (206, self.datos[:10]))
+        r, contenido = self.descargar(Range="bytes=0-9", If_Range='"otro"')
+        self.assertEqual((r.status_code, contenido), (200, self.datos))
+
+    def test_cierra_el_archivo_si_no_se_puede_descifrar(self):
+        with mock.patch('cuentas.views.StreamDecryptor', side_effect=EncryptedFormatError("cabecera rota")), \
+                mock.patch.object(FieldFile, 'close', autospec=True) as cerrar:
+            r = self.client.get(self.url)
+        self.assertEqual(r.status_code, 500)
+        cerrar.assert_called_once()
+
+
+@override_settings(VAULT_UPLOAD_CHUNK_SIZE=SEGMENT_SIZE)
+class SubidaPorPartesTests(VaultTestCase):
+    def iniciar(self, name='video.mp4', size_bytes=2 * SEGMENT_SIZE + 777):
+        return self.client.post('/api/uploads/', {'name': name, 'size_bytes': size_bytes}, format='json')
+
+    def enviar(self, sesion, index, datos):
+        return self.client.put(f"/api/uploads/{sesion}/chunks/{index}/", data=datos,
+                               content_type='application/octet-stream')
+
+    def trozo(self, datos, index):
+        return datos[index * SEGMENT_SIZE:(index + 1) * SEGMENT_SIZE]
+
+    def test_subida_completa_en_desorden(self):
+        datos = os.urandom(2 * SEGMENT_SIZE + 777)
+        r = self.iniciar(size_bytes=len(datos))
+        self.assertEqual(r.status_code, 201, r.content)
+        sesion = r.json()['id']
+        self.assertEqual(r.json()['total_chunks'], 3)
+
+        for index in (2, 0):
+            self.assertEqual(self.enviar(sesion, index, self.trozo(datos, index)).status_code, 200)
+        r = self.client.post(f"/api/uploads/{sesion}/finalize/")
+        self.assertEqual((r.status_code, r.json()['chunks_faltantes']), (400, [1]))
+
+        # Un trozo de largo incorrecto se rechaza; reenviar uno ya recibido lo reemplaza
+        self.assertEqual(self.enviar(sesion, 1, datos[:5]).status_code, 400)
+        self.assertEqual(self.enviar(sesion, 1, self.trozo(datos, 1)).status_code, 200)
+        self.assertEqual(self.enviar(sesion, 1, self.trozo(datos, 1)).status_code, 200)
+        r = self.client.post(f"/api/uploads/{sesion}/finalize/")
+        self.assertEqual(r.status_code, 201, r.content)
+
+        descarga = self.client.get(f"/api/files/{r.json()['id']}/download/")
+        self.assertEqual(b''.join(descarga.streaming_content), datos)
+        self.assertEqual(self.client.post(f"/api/uploads/{sesion}/finalize/").status_code, 404)
+
+    def test_reserva_la_cuota_al_iniciar(self):
+        r = self.iniciar(size_bytes=1024 ** 3)
+        self.assertEqual(r.status_code, 201, r.content)
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.bytes_usados, 1024 ** 3)
+        # Plan gratuito: 2 GB
+        self.assertEqual(self.iniciar(size_bytes=1024 ** 3 + 1).status_code, 400)
+
+        self.client.delete(f"/api/uploads/{r.json()['id']}/")
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.bytes_usados, 0)
+
+    def test_nombre_sin_directorios(self):
+        for nombre, esperado in (("../../settings.py", "settings.py"), ("C:\\Users\\ana\\foto.jpg", "foto.jpg"),
+                                 ("fotos/2024/playa.jpg", "playa.jpg")):
+            r = self.iniciar(name=nombre)
+            self.assertEqual((r.status_code, r.json()['name']), (201, esperado))
+        for nombre in ("..", "../", "???", " ", "x" * 300):
+            self.assertEqual(self.iniciar(name=nombre).status_code, 400, nombre)
+
+    def test_nombre_largo_cabe_en_la_ruta(self):
+        nombre = f"{'informe-trimestral-' * 12}.pdf"
+        r = self.iniciar(name=nombre, size_bytes=10)
+        sesion = r.json()['id']
+        self.assertEqual(self.enviar(sesion, 0, b'0123456789').status_code, 200)
+        r = self.client.post(f"/api/uploads/{sesion}/finalize/")
+        self.assertEqual(r.status_code, 201, r.content)
+        archivo = VaultFile.objects.get(pk=r.json()['id'])
+        self.assertEqual(archivo.name, nombre)
+        self.assertLessEqual(len(archivo.blob.file.name), VaultBlob._meta.get_field('file').max_length)
+        self.assertTrue(archivo.blob.file.name.endswith('.enc'))
+
+
+class DeduplicacionTests(VaultTestCase):
+    def test_mismo_contenido_comparte_blob(self):
+        primero = self.subir('a.txt', b'x' * 1000)
+        segundo = self.subir('b.txt', b'x' * 1000)
+        self.assertFalse(primero['deduplicado'])
+        self.assertTrue(segundo['deduplicado'])
+        blob = VaultBlob.objects.get(user=self.user)
+        self.assertEqual(blob.ref_count, 2)
+        # La cuota cuenta lo guardado una sola vez
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.bytes_usados, 1000)
+
+    def test_el_blob_se_borra_con_la_ultima_referencia(self):
+        ids = [self.subir(f"{i}.txt", b'igual')['id'] for i in range(2)]
+        blob = VaultBlob.objects.get(user=self.user)
+        nombre = blob.file.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f"/api/files/{ids[0]}/").status_code, 204)
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(default_storage.exists(nombre))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f"/api/files/{ids[1]}/").status_code, 204)
+        self.assertFalse(VaultBlob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(default_storage.exists(nombre))
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.bytes_usados, 0)
+
+    def test_no_se_comparte_entre_usuarios(self):
+        self.subir('a.txt', b'igual')
+        beto = crear_usuario('beto')
+        self.assertFalse(self.subir('a.txt', b'igual', client=self.cliente(beto))['deduplicado'])
+        digests = set(VaultBlob.objects.values_list('digest', flat=True))
+        self.assertEqual(len(digests), 2)
+
+    def test_duplicado_no_choca_con_la_cuota(self):
+        self.subir('a.txt', b'z' * 1000)
+        Profile.objects.filter(user=self.user).update(bytes_usados=F('bytes_usados') + 2 * 1024 ** 3)
+        self.assertTrue(self.subir('b.txt', b'z' * 1000)['deduplicado'])
+        archivo = SimpleUploadedFile('c.txt', b'otro')
+        r = self.client.post('/api/files/', {'file': archivo}, format='multipart')
+        self.assertEqual(r.status_code, 400, r.content)
+        self.assertIn('Espacio insuficiente', str(r.json()))
+
+
+class CompresionTests(VaultTestCase):
+    def test_texto_se_comprime(self):
+        datos = b'linea de texto repetida\n' * 20000
+        archivo = self.subir('registro.txt', datos)
+        self.assertEqual(archivo['codec'], 'zlib')
+        self.assertEqual(archivo['size_bytes'], len(datos))
+        blob = VaultBlob.objects.get(user=self.user)
+        self.assertLess(blob.stored_bytes, len(datos) // 10)
+
+        url = f"/api/files/{archivo['id']}/download/"
+        r = self.client.get(url)
+        self.assertEqual(r['Content-Length'], str(len(datos)))
+        self.assertEqual(b''.join(r.streaming_content), datos)
+        r = self.client.get(url, headers={'Range': 'bytes=300000-300099'})
+        self.assertEqual(r.status_code, 206)
+        self.assertEqual(b''.join(r.streaming_content), datos[300000:300100])
+
+    def test_lo_que_no_baja_se_guarda_tal_cual(self):
+        self.assertEqual(self.subir('azar.bin', os.urandom(5000))['codec'], 'identity')
+        # Por tipo, sin mirar el contenido
+        self.assertEqual(self.subir('foto.jpg', b'a' * 5000)['codec'], 'identity')
+
+
+class ContadoresDeUsoTests(VaultTestCase):
+    def uso(self):
+        profile = Profile.objects.get(user=self.user)
+        return profile.cuentas_usadas, profile.bytes_usados
+
+    def test_siguen_las_altas_y_bajas(self):
+        cuenta = self.crear_cuenta()
+        archivo = self.subir('a.bin', os.urandom(300))
+        self.assertEqual(self.uso(), (1, 300))
+        self.client.delete(f"/api/cuentas/{cuenta['id']}/")
+        self.client.delete(f"/api/files/{archivo['id']}/")
+        self.assertEqual(self.uso(), (0, 0))
+
+    def test_save_con_datos_viejos_no_los_pisa(self):
+        profile = Profile.objects.get(user=self.user)
+        self.crear_cuenta()
+        profile.extra_slots_cuentas = 3
+        profile.save()
+        self.assertEqual(self.uso(), (1, 0))
+
+    def test_cupo_de_cuentas(self):
+        Profile.objects.filter(user=self.user).update(
+            plan=PlanConfig.objects.create(nombre="Mini", slots_cuentas_base=2))
+        self.crear_cuenta()
+        self.crear_cuenta()
+        r = self.client.post('/api/cuentas/', {'email': 'x@correo.cl', 'password': 'x'}, format='json')
+        self.assertEqual(r.status_code, 403)
+        self.assertEqual(self.uso(), (2, 0))
+
+    def test_altas_y_bajas_por_el_orm(self):
+        # Las que no pasan por la vista (shell, admin, comandos) también cuentan
+        Profile.objects.filter(user=self.user).update(
+            plan=PlanConfig.objects.create(nombre="Uno", slots_cuentas_base=1))
+        primera = Account.objects.create(user=self.user, email='a@correo.cl')
+        segunda = Account.objects.create(user=self.user, email='b@correo.cl')
+        self.assertEqual(self.uso(), (2, 0))
+        segunda.refresh_from_db()
+        self.assertTrue(segunda.congelada)
+
+        primera.delete()
+        self.assertEqual(self.uso(), (1, 0))
+        segunda.refresh_from_db()
+        self.assertFalse(segunda.congelada)
+
+        Account.borrar_lote(self.user, [segunda.pk])
+        self.assertEqual(self.uso(), (0, 0))
+
+    def test_recalcular_uso(self):
+        self.crear_cuenta()
+        self.subir('a.bin', os.urandom(300))
+        Profile.objects.filter(user=self.user).update(cuentas_usadas=7, bytes_usados=5)
+
+        salida = io.StringIO()
+        call_command('recalcular_uso', '--dry-run', stdout=salida)
+        self.assertIn('cuentas 7 -> 1, bytes 5 -> 300', salida.getvalue())
+        self.assertEqual(self.uso(), (7, 5))
+
+        call_command('recalcular_uso', stdout=io.StringIO())
+        self.assertEqual(self.uso(), (1, 300))
+
+
+class SubidaEnLoteTests(VaultTestCase):
+    def subir_lote(self, *archivos):
+        return self.client.post('/api/files/batch/', {
+            'files': [SimpleUploadedFile(nombre, contenido) for nombre, contenido in archivos],
+        }, format='multipart')
+
+    def test_nombre_largo_cabe_en_la_ruta(self):
+        nombre = f"{'informe-trimestral-' * 12}.pdf"
+        r = self.subir_lote((nombre, b'contenido largo'), ('corto.txt', b'otro contenido'))
+        self.assertEqual(r.status_code, 201, r.content)
+        limite = VaultBlob._meta.get_field('file').max_length
+        for blob in VaultBlob.objects.filter(user=self.user):
+            self.assertLessEqual(len(blob.file.name), limite)
+        archivo = VaultFile.objects.get(user=self.user, name=nombre)
+        descarga = self.client.get(f"/api/files/{archivo.id}/download/")
+        self.assertEqual(b''.join(descarga.streaming_content), b'contenido largo')
+
+    def test_resultado_por_archivo_y_deduplicacion(self):
+        self.subir('previo.txt', b'ya estaba')
+        r = self.subir_lote(('a.txt', b'nuevo'), ('vacio.txt', b''), ('b.txt', b'nuevo'),
+                            ('c.txt', b'ya estaba'))
+        self.assertEqual(r.status_code, 201, r.content)
+        datos = r.json()
+        self.assertEqual((datos['creados'], datos['fallidos']), (3, 1))
+        resultados = datos['resultados']
+        self.assertEqual([x['name'] for x in resultados], ['a.txt', 'vacio.txt', 'b.txt', 'c.txt'])
+        self.assertEqual([x['ok'] for x in resultados], [True, False, True, True])
+        self.assertEqual([x.get('deduplicado') for x in resultados], [False, None, True, True])
+
+        refs = dict(VaultBlob.objects.filter(user=self.user).values_list('size_bytes', 'ref_count'))
+        self.assertEqual(refs, {len(b'ya estaba'): 2, len(b'nuevo'): 2})
+        self.assertEqual(Profile.objects.get(user=self.user).bytes_usados, len(b'ya estaba') + len(b'nuevo'))
+
+    def test_cuota_para_el_lote_completo(self):
+        Profile.objects.filter(user=self.user).update(bytes_usados=2 * 1024 ** 3 - 10)
+        r = self.subir_lote(('a.bin', b'123456'), ('b.bin', b'7890ab'))
+        self.assertEqual(r.status_code, 400, r.content)
+        self.assertFalse(VaultFile.objects.filter(user=self.user).exists())
+        self.assertEqual(Profile.objects.get(user=self.user).bytes_usados, 2 * 1024 ** 3 - 10)
+
+    def test_error_inesperado_devuelve_la_reserva(self):
+        with mock.patch.object(VaultFile.objects, 'bulk_create', side_effect=RuntimeError("caída")):
+            with self.assertRaises(RuntimeError):
+                self.subir_lote(('a.bin', b'123456'), ('b.bin', b'7890ab'))
+        self.assertEqual(Profile.objects.get(user=self.user).bytes_usados, 0)
+        self.assertFalse(VaultBlob.objects.filter(user=self.user).exists())
+
+
+def tar_de(miembros):
+    """Un .tar en memoria con {nombre: contenido}."""
+    salida = io.BytesIO()
+    with tarfile.open(fileobj=salida, mode='w') as tar:
+        for nombre, contenido in miembros.items():
+            info = tarfile.TarInfo(nombre)
+            info.size = len(contenido)
+            tar.addfile(info, io.BytesIO(contenido))
+    return salida.getvalue()
+
+
+class BackupTests(VaultTestCase):
+    def restaurar(self, respaldo):
+        return self.client.post('/api/backup/restore/', respaldo, content_type='application/x-tar')
+
+    def exportar(self):
+        r = self.client.get('/api/backup/export/')
+        self.assertEqual(r.status_code, 200)
+        return b''.join(r.streaming_content)
+
+    def test_exportar_y_restaurar(self):
+        cuenta = self.crear_cuenta(secret='JBSWY3DP')
+        archivo = self.subir('foto.txt', b'contenido ' * 1000)
+        respaldo = self.exportar()
+        with tarfile.open(fileobj=io.BytesIO(respaldo)) as tar:
+            nombres = tar.getnames()
+        self.assertEqual(nombres[:2], ['manifest.json', 'cuentas/000001.jsonl'])
+        self.assertTrue(nombres[2].startswith(f"archivos/{archivo['id']}"))
+
+        Account.objects.all().delete()
+        self.client.delete(f"/api/files/{archivo['id']}/")
+        r = self.restaurar(respaldo)
+        self.assertEqual(r.status_code, 200, r.content)
+        self.assertEqual((r.json()['cuentas_restauradas'], r.json()['archivos_restaurados']), (1, 1))
+
+        revelada = self.client.get(f"/api/cuentas/{cuenta['id']}/revelar/").json()
+        self.assertEqual((revelada['decrypted_password'], revelada['decrypted_secret']), ('secreta', 'JBSWY3DP'))
+        restaurado = VaultFile.objects.get(user=self.user)
+        descarga = self.client.get(f"/api/files/{restaurado.id}/download/")
+        self.assertEqual(b''.join(descarga.streaming_content), b'contenido ' * 1000)
+
+        # Reenviarlo no duplica nada
+        r = self.restaurar(respaldo)
+        self.assertEqual((r.json()['cuentas_omitidas'], r.json()['archivos_omitidos']), (1, 1))
+
+    def test_cuentas_de_otro_usuario_usan_id_derivado(self):
+        self.crear_cuenta()
+        respaldo = self.exportar()
+        beto = self.cliente(crear_usuario('beto'))
+        for _ in range(2):
+            r = beto.post('/api/backup/restore/', respaldo, content_type='application/x-tar')
+        self.assertEqual(r.json()['cuentas_omitidas'], 1)
+        self.assertEqual(Account.objects.count(), 2)
+
+    def test_restaura_por_lotes(self):
+        cuentas = [self.crear_cuenta(email=f"yo{i}@correo.cl") for i in range(5)]
+        respaldo = self.exportar()
+        for cuenta in cuentas:
+            self.client.delete(f"/api/cuentas/{cuenta['id']}/")
+        with mock.patch('cuentas.backup.ACCOUNTS_PER_MEMBER', 2):
+            r = self.restaurar(respaldo)
+        self.assertEqual(r.json()['cuentas_restauradas'], 5)
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.cuentas_usadas, 5)
+
+    def test_registros_invalidos(self):
+        manifest = b'{"version": 1}'
+        valido = b'{"id": "7d0f6a3c-5f43-4e0b-9a39-9c9a5e0f2b11", "email": "a@correo.cl", "password": "x"}\n'
+        for linea in (b'{"id": ', b'{"email": "a@correo.cl"}', b'{"id": "no-es-uuid", "email": "a@correo.cl"}',
+                      b'{"id": "1d0f6a3c-5f43-4e0b-9a39-9c9a5e0f2b11"}', b'[1, 2]', b'\xff\xfe',
+                      b'{"id": "1d0f6a3c-5f43-4e0b-9a39-9c9a5e0f2b11", "email": "a@correo.cl", "password": 5}',
+                      b'{"id": "1d0f6a3c-5f43-4e0b-9a39-9c9a5e0f2b11", "email": "a@correo.cl",'
+                      b' "site_url": "javascript://%0aalert(1)"}'):
+            r = self.restaurar(tar_de({'manifest.json': manifest, 'cuentas/000001.jsonl': valido + linea}))
+            self.assertEqual(r.status_code, 400, linea)
+            self.assertIn('línea 2', r.json()['error'])
+        self.assertFalse(Account.objects.exists())
+
+    def test_nombres_de_archivo_del_tar(self):
+        salida = io.BytesIO()
+        with tarfile.open(fileobj=salida, mode='w', format=tarfile.PAX_FORMAT) as tar:
+            for nombre, pax in (("archivos/1-a", {'niun.name': "../../../settings.py"}),
+                                ("archivos/2-b", {'niun.name': f"{'anexo-' * 40}.txt"})):
+                info = tarfile.TarInfo(nombre)
+                info.size = 5
+                info.pax_headers = pax
+                tar.addfile(info, io.BytesIO(nombre[-1].encode() * 5))
+        r = self.restaurar(salida.getvalue())
+        self.assertEqual(r.status_code, 200, r.content)
+        nombres = sorted(VaultFile.objects.filter(user=self.user).values_list('name', flat=True))
+        self.assertEqual(nombres, [f"{'anexo-' * 40}.txt", "settings.py"])
+        limite = VaultBlob._meta.get_field('file').max_length
+        for blob in VaultBlob.objects.filter(user=self.user):
+            self.assertTrue(blob.file.name.startswith('vault/'))
+            self.assertLessEqual(len(blob.file.name), limite)
+
+    def test_archivo_que_no_es_respaldo(self):
+        self.assertEqual(self.restaurar(b'no es un tar' * 100).status_code, 400)
+        r = self.restaurar(tar_de({'manifest.json': b'{"version": 99}'}))
+        self.assertEqual(r.status_code, 400)
+        r = self.restaurar(tar_de({'manifest.json': b'[]'}))
+        self.assertEqual(r.status_code, 400)
+
+
+class LimpiarHuerfanosTests(VaultTestCase):
+    def huerfano(self, nombre, viejo=True):
+        nombre = default_storage.save(nombre, io.BytesIO(b'x' * 10))
+        if viejo:
+            hace_dos_dias = time.time() - 48 * 3600
+            os.utime(default_storage.path(nombre), (hace_dos_dias, hace_dos_dias))
+        return nombre
+
+    def limpiar(self, *args):
+        salida = io.StringIO()
+        call_command('limpiar_huerfanos', '--pausa=0', '--borrados-por-segundo=0', *args, stdout=salida)
+        return salida.getvalue()
+
+    def test_borra_solo_los_huerfanos_viejos(self):
+        self.subir('usado.txt', b'en uso')
+        usado = VaultBlob.objects.get(user=self.user).file.name
+        viejo = self.huerfano('vault/2020/01/viejo.enc')
+        nuevo = self.huerfano('vault/2020/01/nuevo.enc', viejo=False)
+
+        self.assertIn(f"huérfano: {viejo}", self.limpiar('--dry-run'))
+        self.assertTrue(default_storage.exists(viejo))
+
+        self.assertIn('huérfanos: 1', self.limpiar())
+        self.assertFalse(default_storage.exists(viejo))
+        self.assertTrue(default_storage.exists(nuevo))
+        self.assertTrue(default_storage.exists(usado))
+
+    def test_sigue_donde_quedo(self):
+        nombres = [self.huerfano(f"vault/2020/0{i}/h.enc") for i in range(1, 4)]
+        self.assertIn('quedan archivos', self.limpiar('--limite=2'))
+        self.assertEqual([default_storage.exists(n) for n in nombres], [False, False, True])
+        salida = self.limpiar()
+        self.assertIn(f"Continuando desde {nombres[1]}", salida)
+        self.assertIn('Revisados: 1', salida)
+        self.assertFalse(default_storage.exists(nombres[2]))
+
+
+class PurgaDiferidaTests(VaultTestCase):
+    @override_settings(VAULT_RATELIMIT_ACTIVO=False)
+    def test_autodestruccion_por_pin(self):
+        for i in range(3):
+            self.crear_cuenta(email=f"yo{i}@correo.cl")
+        self.subir('a.bin', os.urandom(100))
+        self.subir('b.bin', os.urandom(100))
+        enc = list(VaultBlob.objects.values_list('file', flat=True))
+        guardado = sum(VaultBlob.objects.values_list('stored_bytes', flat=True))
+        beto = crear_usuario('beto')
+        self.crear_cuenta(self.cliente(beto))
+
+        for _ in range(10):
+            r = self.client.post('/api/security/', {'pin_boveda': '0000'}, format='json')
+            self.assertEqual(r.status_code, 401)
+        # Bloqueado al instante, con el correo libre; los datos esperan al worker
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertEqual(self.user.email, '')
+        purga = PurgaCuenta.objects.get(user_id_original=self.user.pk)
+        self.assertEqual((purga.estado, purga.motivo), ('pendiente', 'pin'))
+        self.assertEqual(Account.objects.filter(user=self.user).count(), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('purgar_cuentas', '--lote=2', stdout=io.StringIO())
+        purga.refresh_from_db()
+        self.assertEqual(purga.estado, 'completada')
+        self.assertEqual((purga.cuentas_borradas, purga.archivos_borrados, purga.bytes_liberados), (3, 2, guardado))
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(any(default_storage.exists(nombre) for nombre in enc))
+        self.assertEqual(Account.objects.filter(user=beto).count(), 1)
+
+
+class RotacionDeLlavesTests(VaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.vieja = settings.ENCRYPTION_KEY
+        self.nueva = Fernet.generate_key().decode()
+
+    def con_llaves(self, *llaves):
+        olvidar_llave(self.user.pk)
+        return override_settings(ENCRYPTION_KEYS=",".join(llaves))
+
+    def test_recifrar_tras_rotar(self):
+        # Datos de antes de las llaves por usuario: cifrados con la maestra
+        cuenta = self.crear_cuenta()
+        Account.objects.filter(pk=cuenta['id']).update(password_encrypted=encrypt_text('antigua'))
+        subido = SimpleUploadedFile('viejo.bin', b'contenido antiguo' * 100)
+        nombre = default_storage.save('vault/2020/01/viejo.bin', StreamEncryptedFile(subido))
+        blob = VaultBlob.objects.create(user=self.user, file=nombre, size_bytes=subido.size, ref_count=1)
+        archivo = VaultFile.objects.create(user=self.user, blob=blob, file=nombre, name='viejo.bin',
+                                           size_bytes=subido.size)
+        llave_datos = llave_de_usuario(self.user.pk)
+
+        with self.con_llaves(self.nueva, self.vieja):
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('recifrar', '--pausa=0', stdout=io.StringIO(), stderr=io.StringIO())
+            dek = Profile.objects.get(user=self.user).dek_cifrada
+            self.assertTrue(get_llavero().es_vigente(dek.encode()))
+            self.assertTrue(Account.objects.get(pk=cuenta['id']).password_encrypted.startswith(DEK_PREFIX))
+            blob.refresh_from_db()
+            with blob.file.open('rb') as f:
+                self.assertEqual(read_stream_header(f)['key_id'], llave_datos.id)
+            self.assertFalse(default_storage.exists(nombre))
+
+        # Sin la llave vieja todo se sigue leyendo
+        with self.con_llaves(self.nueva):
+            r = self.client.get(f"/api/cuentas/{cuenta['id']}/revelar/")
+            self.assertEqual(r.json()['decrypted_password'], 'antigua')
+            r = self.client.get(f"/api/files/{archivo.pk}/download/")
+            self.assertEqual(b''.join(r.streaming_content), b'contenido antiguo' * 100)
+
+    def test_es_reanudable(self):
+        for nombre in ('beto', 'carla'):
+            llave_de_usuario(crear_usuario(nombre).pk)
+        llave_de_usuario(self.user.pk)
+        with self.con_llaves(self.nueva, self.vieja):
+            CursorMantenimiento.guardar('recifrar:llaves', str(Profile.objects.get(user=self.user).pk))
+            salida = io.StringIO()
+            call_command('recifrar', '--solo=llaves', '--pausa=0', stdout=salida)
+            # Sigue desde el cursor: el perfil de ana ya se había revisado
+            self.assertIn('2 revisadas, 2 re-envueltas', salida.getvalue())
+            salida = io.StringIO()
+            call_command('recifrar', '--solo=llaves', '--pausa=0', '--reiniciar', stdout=salida)
+            self.assertIn('3 revisadas, 1 re-envueltas', salida.getvalue())
+
+
+class LlaveDeDatosTests(VaultTestCase):
+    def test_cada_usuario_cifra_con_su_llave(self):
+        cuenta = Account.objects.get(pk=self.crear_cuenta(password='solo-mia')['id'])
+        self.assertTrue(cuenta.password_encrypted.startswith(DEK_PREFIX))
+        archivo = VaultBlob.objects.get(pk=VaultFile.objects.get(pk=self.subir()['id']).blob_id)
+        with archivo.file.open('rb') as f:
+            self.assertEqual(read_stream_header(f)['key_id'], llave_de_usuario(self.user.pk).id)
+
+        # La DEK de otro usuario (o la maestra) no abre lo de este
+        beto = llave_de_usuario(crear_usuario('beto').pk)
+        self.assertEqual(decrypt_many([cuenta.password_encrypted], beto, error='x'), ['x'])
+        self.assertEqual(decrypt_many([cuenta.password_encrypted], error='x'), ['x'])
+        self.assertEqual(decrypt_many([cuenta.password_encrypted], llave_de_usuario(self.user.pk)),
+                         ['solo-mia'])
+
+    def test_la_dek_se_guarda_envuelta(self):
+        llave = llave_de_usuario(self.user.pk)
+        dek_cifrada = Profile.objects.get(user=self.user).dek_cifrada
+        self.assertEqual(get_llavero().desenvolver(dek_cifrada), llave.fernet_key)
+        olvidar_llave(self.user.pk)
+        self.assertEqual(llave_de_usuario(self.user.pk).id, llave.id)
+
+    def test_destruir_la_dek_deja_ilegible_la_boveda(self):
+        cuenta = self.crear_cuenta()
+        PurgaCuenta.programar(self.user, motivo='pin')
+        # Los datos siguen ahí hasta que pase el worker, pero ya sin llave
+        self.assertTrue(Account.objects.filter(pk=cuenta['id']).exists())
+        self.assertEqual(Profile.objects.get(user=self.user).dek_cifrada, DEK_DESTRUIDA)
+        # Y no se genera una nueva
+        with self.assertRaises(ValueError):
+            llave_de_usuario(self.user.pk)
+
+
+class ListadoMetadatosTests(VaultTestCase):
+    def test_metadatos_sin_descifrar(self):
+        self.crear_cuenta(secret='JBSWY3DP')
+        self.crear_cuenta(email='otro@correo.cl')
+        with mock.patch('core.utils.decrypt_many') as descifrar:
+            r = self.client.get('/api/cuentas/?modo=metadatos')
+        descifrar.assert_not_called()
+        cuentas = r.json()
+        self.assertEqual(sorted(c['tiene_secret'] for c in cuentas), [False, True])
+        for cuenta in cuentas:
+            self.assertFalse({'decrypted_password', 'password_encrypted', 'secret_encrypted'} & set(cuenta))
+
+        # Sin el parámetro también: el listado nunca descifra
+        with mock.patch('core.utils.decrypt_many') as descifrar:
+            r = self.client.get('/api/cuentas/')
+        descifrar.assert_not_called()
+        self.assertEqual([c['id'] for c in r.json()], [c['id'] for c in cuentas])
+        self.assertFalse({'decrypted_password'} & set(r.json()[0]))
+
+    def test_revelar_lote(self):
+        mias = [self.crear_cuenta(password=f"clave{i}")['id'] for i in range(2)]
+        ajena = self.crear_cuenta(self.cliente(crear_usuario('beto')))['id']
+        r = self.client.post('/api/cuentas/revelar/', {'ids': mias + [ajena]}, format='json')
+        self.assertEqual(r.status_code, 200, r.content)
+        self.assertEqual({c['id']: c['decrypted_password'] for c in r.json()['cuentas']},
+                         {mias[0]: 'clave0', mias[1]: 'clave1'})
+        self.assertEqual(r.json()['no_encontradas'], [ajena])
+
+    @override_settings(VAULT_REVEAL_MAX_IDS=2)
+    def test_revelar_lote_valida_los_ids(self):
+        for ids in ([], ['no-es-uuid'], [str(uuid.uuid4()) for _ in range(3)]):
+            r = self.client.post('/api/cuentas/revelar/', {'ids': ids}, format='json')
+            self.assertEqual(r.status_code, 400, ids)
+
+    def test_revelar_con_el_cupo_lleno(self):
+        Profile.objects.filter(user=self.user).update(
+            plan=PlanConfig.objects.create(nombre="Mini", slots_cuentas_base=1))
+        cuenta = self.crear_cuenta()
+        r = self.client.post('/api/cuentas/revelar/', {'ids': [cuenta['id']]}, format='json')
+        self.assertEqual(r.status_code, 200, r.content)
+
+
+class PaginacionTests(VaultTestCase):
+    def recorrer(self, url):
+        vistos = []
+        while url:
+            r = self.client.get(url)
+            self.assertEqual(r.status_code, 200, r.content)
+            vistos += [x['id'] for x in r.json()['results']]
+            url = r.json()['next']
+        return vistos
+
+    def test_cuentas_por_cursor(self):
+        ids = [self.crear_cuenta(email=f"yo{i}@correo.cl")['id'] for i in range(5)]
+        self.crear_cuenta(self.cliente(crear_usuario('beto')))
+        self.assertEqual(self.recorrer('/api/cuentas/?modo=metadatos&page_size=2'), ids[::-1])
+
+    def test_archivos_por_cursor(self):
+        ids = [self.subir(f"{i}.txt", f"contenido {i}".encode())['id'] for i in range(3)]
+        self.assertEqual(self.recorrer('/api/files/?page_size=2'), ids[::-1])
+
+    def test_sin_parametros_lista_completa(self):
+        for i in range(3):
+            self.crear_cuenta(email=f"yo{i}@correo.cl")
+        self.assertEqual(len(self.client.get('/api/cuentas/?modo=metadatos').json()), 3)
+
+    @override_settings(VAULT_MAX_PAGE_SIZE=2)
+    def test_tope_de_pagina(self):
+        for i in range(3):
+            self.crear_cuenta(email=f"yo{i}@correo.cl")
+        r = self.client.get('/api/cuentas/?modo=metadatos&page_size=500')
+        self.assertEqual(len(r.json()['results']), 2)
+
+
+class BusquedaTests(VaultTestCase):
+    def buscar(self, consulta):
+        r = self.client.get('/api/cuentas/', {'modo': 'metadatos', 'search': consulta})
+        self.assertEqual(r.status_code, 200, r.content)
+        return [c['site_name'] for c in r.json()]
+
+    def test_prefijo_tildes_y_ranking(self):
+        self.crear_cuenta(site_name='GitLab', site_url='https://gitlab.com')
+        self.crear_cuenta(site_name='GitHub', site_url='https://github.com')
+        self.crear_cuenta(site_name='Código en github', site_url='https://ejemplo.cl')
+        self.crear_cuenta(site_name='Banco', site_url='https://banco.cl', email='pepe@correo.cl')
+
+        self.assertEqual(self.buscar('github')[:2], ['GitHub', 'Código en github'])
+        self.assertEqual(set(self.buscar('git')), {'GitLab', 'GitHub', 'Código en github'})
+        self.assertEqual(self.buscar('codigo'), ['Código en github'])
+        self.assertEqual(self.buscar('gitlab.c'), ['GitLab'])
+        self.assertEqual(self.buscar('pepe'), ['Banco'])
+        self.assertEqual(self.buscar('git banco'), [])
+
+    def test_el_indice_sigue_a_la_cuenta(self):
+        cuenta = self.crear_cuenta(site_name='Viejo')
+        self.client.patch(f"/api/cuentas/{cuenta['id']}/", {'site_name': 'Nuevo'}, format='json')
+        self.assertEqual(self.buscar('viejo'), [])
+        self.assertEqual(self.buscar('nuevo'), ['Nuevo'])
+        self.client.delete(f"/api/cuentas/{cuenta['id']}/")
+        self.assertEqual(self.buscar('nuevo'), [])
+
+    def test_no_ve_cuentas_ajenas(self):
+        self.crear_cuenta(self.cliente(crear_usuario('beto')), site_name='Secreto')
+        self.assertEqual(self.buscar('secreto'), [])
+
+
+class SincronizacionTests(VaultTestCase):
+    def sync(self, token=None, client=None):
+        r = (client or self.client).get('/api/sync/', {'token': token} if token else {})
+        return r.status_code, r.json()
+
+    def test_deltas_con_lapidas(self):
+        a, b, c = (self.crear_cuenta(email=f"{n}@correo.cl")['id'] for n in 'abc')
+        archivo = self.subir()
+        estado, datos = self.sync()
+        self.assertEqual((estado, datos['completo'], len(datos['cuentas'])), (200, True, 3))
+        # Lo ya sincronizado queda fuera del margen del token
+        hace_una_hora = timezone.now() - timedelta(hours=1)
+        Account.objects.filter(user=self.user).update(updated_at=hace_una_hora)
+        VaultFile.objects.filter(user=self.user).update(updated_at=hace_una_hora)
+
+        self.client.patch(f"/api/cuentas/{b}/", {'site_name': 'Editada'}, format='json')
+        self.client.delete(f"/api/cuentas/{c}/")
+        self.client.delete(f"/api/files/{archivo['id']}/")
+        d = self.crear_cuenta(email='d@correo.cl')['id']
+
+        estado, delta = self.sync(datos['token'])
+        self.assertEqual(estado, 200)
+        self.assertFalse(delta['completo'])
+        self.assertEqual({x['id'] for x in delta['cuentas']}, {b, d})
+        self.assertEqual(delta['borrados'], {'cuentas': [c], 'archivos': [str(archivo['id'])]})
+        self.assertEqual(delta['archivos'], [])
+        self.assertNotIn(a, {x['id'] for x in delta['cuentas']})
+
+    def test_token_ajeno_o_manipulado(self):
+        _, datos = self.sync()
+        self.assertEqual(self.sync(datos['token'], self.cliente(crear_usuario('beto')))[0], 400)
+        self.assertEqual(self.sync(datos['token'] + 'x')[0], 400)
+
+    def test_token_anterior_a_la_retencion(self):
+        viejo = emitir_token(self.user, timezone.now() - timedelta(days=settings.VAULT_SYNC_RETENCION_DIAS + 1))
+        self.assertEqual(self.sync(viejo)[0], 410)
+
+    def test_podar_borrados(self):
+        cuenta = self.crear_cuenta()
+        self.client.delete(f"/api/cuentas/{cuenta['id']}/")
+        Borrado.objects.update(borrado_en=timezone.now() - timedelta(days=settings.VAULT_SYNC_RETENCION_DIAS + 1))
+        otra = self.crear_cuenta(email='otra@correo.cl')['id']
+        self.client.delete(f"/api/cuentas/{otra}/")
+        call_command('podar_borrados', stdout=io.StringIO())
+        self.assertEqual(list(Borrado.objects.values_list('objeto_id', flat=True)), [otra])
+
+
+class GetCondicionalTests(VaultTestCase):
+    def etag(self, url, client=None):
+        r = (client or self.client).get(url)
+        self.assertEqual(r.status_code, 200, r.content)
+        return r['ETag']
+
+    def revalidar(self, url, etag):
+        return self.client.get(url, headers={'If-None-Match': etag}).status_code
+
+    def test_304_hasta_que_algo_cambia(self):
+        self.crear_cuenta()
+        cuentas, archivos, perfil = (self.etag(u) for u in ('/api/cuentas/', '/api/files/', '/api/profile/me/'))
+        for url, etag in (('/api/cuentas/', cuentas), ('/api/files/', archivos), ('/api/profile/me/', perfil)):
+            self.assertEqual(self.revalidar(url, etag), 304)
+
+        # Una cuenta nueva cambia el listado de cuentas y el perfil, no el de archivos
+        self.crear_cuenta(email='otra@correo.cl')
+        self.assertEqual(self.revalidar('/api/cuentas/', cuentas), 200)
+        self.assertEqual(self.revalidar('/api/profile/me/', perfil), 200)
+        self.assertEqual(self.revalidar('/api/files/', archivos), 304)
+
+        self.subir()
+        self.assertEqual(self.revalidar('/api/files/', archivos), 200)
+
+    def test_el_etag_depende_de_la_url_y_del_usuario(self):
+        self.crear_cuenta()
+        etag = self.etag('/api/cuentas/')
+        self.assertEqual(self.revalidar('/api/cuentas/?modo=metadatos', etag), 200)
+        beto = self.cliente(crear_usuario('beto'))
+        self.assertNotEqual(self.etag('/api/cuentas/', beto), etag)
+
+    def test_no_se_guarda_en_caches_compartidas(self):
+        r = self.client.get('/api/cuentas/')
+        self.assertIn('private', r['Cache-Control'])
+        self.assertIn('no-cache', r['Cache-Control'])
+        self.assertIn('Authorization', r['Vary'])
+
+    def test_anuncios(self):
+        anuncio = Anuncio.objects.create(titulo='Hola', mensaje='x', expira_en=timezone.now() + timedelta(days=1))
+        etag = self.etag('/api/anuncios/')
+        self.assertEqual(self.revalidar('/api/anuncios/', etag), 304)
+        anuncio.mensaje = 'editado'
+        anuncio.save()
+        self.assertEqual(self.revalidar('/api/anuncios/', etag), 200)
+
+
+class IconosTests(VaultTestCase):
+    def test_dominio_de(self):
+        self.assertEqual(dominio_de("https://WWW.GitHub.com:443/login"), "github.com")
+        self.assertEqual(dominio_de("ñandú.cl"), "xn--and-6ma2c.cl")
+        for url in ("http://169.254.169.254/latest/meta-data/", "10.0.0.1", "http://127.1/", "http://[::1]/",
+                    "localhost", "localhost.localdomain", "impresora.local", "api.internal", "javascript:alert(1)"):
+            self.assertEqual(dominio_de(url), "", url)
+
+    def test_cuenta_con_ip_no_pide_icono(self):
+        cuenta = self.crear_cuenta(site_url="http://169.254.169.254/latest/meta-data/")
+        self.assertIsNone(cuenta['site_icon_url'])
+        self.assertFalse(Icono.objects.exists())
+        self.assertEqual(APIClient().get("/api/iconos/169.254.169.254/").status_code, 404)
+
+    @override_settings(VAULT_ICONOS_FETCHER='cuentas.iconos.sin_red')
+    def test_actualizar_con_sin_red(self):
+        cuenta = self.crear_cuenta(site_url="https://www.github.com/login")
+        self.assertEqual(cuenta['site_icon_url'], "/api/iconos/github.com/")
+        call_command('actualizar_iconos', stdout=io.StringIO())
+        self.assertEqual(Icono.objects.get(dominio="github.com").estado, 'sin_icono')
+
+    def test_no_se_conecta_a_direcciones_internas(self):
+        for ips in (["169.254.169.254"], ["10.0.0.1"], ["127.0.0.1"], ["93.184.216.34", "192.168.0.10"], ["::1"]):
+            resolucion = [(socket.AF_INET6 if ':' in ip else socket.AF_INET, socket.SOCK_STREAM, 6, '', (ip, 443))
+                          for ip in ips]
+            with mock.patch('socket.getaddrinfo', return_value=resolucion), \
+                    mock.patch('socket.create_connection', side_effect=AssertionError("no debía conectarse")):
+                self.assertIsNone(descargar_favicon("atacante.cl"), ips)
+
+    def test_direccion_publica(self):
+        resolucion = [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ("93.184.216.34", 443))]
+        with mock.patch('socket.getaddrinfo', return_value=resolucion):
+            self.assertEqual(direccion_publica("ejemplo.cl", 443), "93.184.216.34")
+
+    def test_no_sigue_redirecciones(self):
+        respuesta = mock.Mock(status=302, headers={'Location': 'http://169.254.169.254/'})
+        with mock.patch.object(_ConexionPublica, 'request'), \
+                mock.patch.object(_ConexionPublica, 'getresponse', return_value=respuesta):
+            self.assertIsNone(descargar_favicon("ejemplo.cl"))
+        respuesta.read.assert_not_called()
+
+    @override_settings(VAULT_ICONOS_FETCHER='cuentas.tests.favicon_de_prueba')
+    def test_sirve_el_icono_guardado(self):
+        self.crear_cuenta(site_url="https://github.com")
+        self.crear_cuenta(site_url="https://caido.cl")
+        call_command('actualizar_iconos', stdout=io.StringIO())
+
+        r = APIClient().get("/api/iconos/github.com/")
+        self.assertEqual((r.status_code, r.content, r['Content-Type']), (200, PNG, 'image/png'))
+        self.assertIn('public', r['Cache-Control'])
+        r = APIClient().get("/api/iconos/github.com/", headers={'If-None-Match': r['ETag']})
+        self.assertEqual(r.status_code, 304)
+
+        # Un fallo se reintenta más tarde, sin servir nada mientras tanto
+        caido = Icono.objects.get(dominio="caido.cl")
+        self.assertEqual((caido.estado, caido.intentos), ('error', 1))
+        self.assertGreater(caido.vence_en, timezone.now())
+        self.assertEqual(APIClient().get("/api/iconos/caido.cl/").status_code, 404)
+
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 20
+
+
+def favicon_de_prueba(dominio):
+    """Fetcher para las pruebas: github.com tiene icono y caido.cl falla."""
+    if dominio == "caido.cl":
+        raise OSError("HTTP 503")
+    return PNG, 'application/octet-stream'
+
+
+class CuentasCongeladasTests(VaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ids = [self.crear_cuenta(email=f"yo{i}@correo.cl")['id'] for i in range(3)]
+
+    def congeladas(self):
+        return set(Account.objects.filter(user=self.user, congelada=True).values_list('id', flat=True))
+
+    def bajar_cupo(self, slots):
+        profile = Profile.objects.get(user=self.user)
+        profile.plan = PlanConfig.objects.create(nombre=f"Mini {slots}", slots_cuentas_base=slots)
+        profile.save()
+
+    def test_bajar_de_plan_congela_las_mas_nuevas(self):
+        self.bajar_cupo(2)
+        self.assertEqual(self.congeladas(), {uuid.UUID(self.ids[2])})
+        url = f"/api/cuentas/{self.ids[2]}/"
+        self.assertEqual(self.client.get(url).status_code, 200)
+        r = self.client.patch(url, {'site_name': 'x'}, format='json')
+        self.assertEqual(r.status_code, 403)
+        self.assertIn('congelada', r.json()['detail'])
+        self.assertEqual(self.client.patch(f"/api/cuentas/{self.ids[0]}/", {'site_name': 'x'},
+                                           format='json').status_code, 200)
+
+    def test_borrar_una_libera_a_la_congelada(self):
+        self.bajar_cupo(2)
+        self.client.delete(f"/api/cuentas/{self.ids[0]}/")
+        self.assertEqual(self.congeladas(), set())
+
+    def test_cambiar_el_plan_mismo(self):
+        self.bajar_cupo(1)
+        self.assertEqual(len(self.congeladas()), 2)
+        plan = Profile.objects.get(user=self.user).plan
+        plan.slots_cuentas_base = 5
+        plan.save()
+        self.assertEqual(self.congeladas(), set())
+        # Y al bajarlo otra vez se vuelve a congelar la más nueva
+        plan.slots_cuentas_base = 2
+        plan.save()
+        self.assertEqual(self.congeladas(), {uuid.UUID(self.ids[2])})
+
+    def test_el_listado_marca_las_congeladas(self):
+        self.bajar_cupo(2)
+        marcas = {c['id']: c['congelada'] for c in self.client.get('/api/cuentas/?modo=metadatos').json()}
+        self.assertEqual(marcas, {self.ids[0]: False, self.ids[1]: False, self.ids[2]: True})
+
+
+class CuposTests(VaultTestCase):
+    def test_plan_mas_extras(self):
+        Profile.objects.filter(user=self.user).update(extra_slots_cuentas=3, extra_gb_almacenamiento=1.5)
+        self.crear_cuenta()
+        limites = self.client.get('/api/profile/me/').json()['limites']
+        self.assertEqual(limites['cuentas'], {'usadas': 1, 'total': 13, 'restantes': 12})
+        self.assertEqual(limites['almacenamiento']['total_gb'], 3.5)
+
+    def test_sin_plan(self):
+        Profile.objects.filter(user=self.user).update(plan=None)
+        cupos = Profile.objects.get(user=self.user).cupos
+        self.assertEqual((cupos.nombre_plan, cupos.cuentas, cupos.gb), (SIN_PLAN['nombre'], SIN_PLAN['cuentas'], 0))
+        self.assertFalse(cupos.cabe(bytes=1))
+
+    def test_una_lectura_por_request(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        # El Request de DRF comparte lo leído con el HttpRequest que envuelve
+        with self.assertNumQueries(1):
+            self.assertIs(cupos_de(request), cupos_de(Request(request)))
+        olvidar_cupos(request)
+        with self.assertNumQueries(1):
+            cupos_de(request)
+
+    def test_la_recompensa_se_ve_en_el_mismo_request(self):
+        Profile.objects.filter(user=self.user).update(total_anuncios_vistos=9)
+        r = self.client.post('/api/ads/reward/')
+        self.assertTrue(r.json()['recompensa_obtenida'])
+        self.assertEqual(r.json()['total_slots'], 11)
+
+
+class ImportacionTests(VaultTestCase):
+    def importar(self, texto):
+        archivo = SimpleUploadedFile('passwords.csv', texto.encode('utf-8-sig'), content_type='text/csv')
+        return self.client.post('/api/cuentas/importar/', {'archivo': archivo}, format='multipart')
+
+    def test_chrome(self):
+        r = self.importar(
+            "name,url,username,password\n"
+            "GitHub,https://github.com/login,yo@correo.cl,uno\n"
+            "Banco,banco.cl,yo@correo.cl,dos\n"
+        )
+        self.assertEqual(r.status_code, 201, r.content)
+        self.assertEqual(r.json()['formato'], 'chrome')
+        self.assertEqual(r.json()['importadas'], 2)
+        banco = Account.objects.get(user=self.user, site_name='Banco')
+        self.assertEqual(banco.site_url, 'https://banco.cl')
+        self.assertEqual(banco.site_icon_url, '/api/iconos/banco.cl/')
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.cuentas_usadas, 2)
+
+    def test_firefox_y_bitwarden(self):
+        r = self.importar(
+            "url,username,password,httpRealm,formActionOrigin,guid,timeCreated\n"
+            "https://www.github.com,yo@correo.cl,uno,,,{1},1\n"
+        )
+        self.assertEqual((r.json()['formato'], r.json()['importadas']), ('firefox', 1))
+        self.assertEqual(Account.objects.get(user=self.user).site_name, 'github.com')
+
+        r = self.importar(
+            "folder,favorite,type,name,notes,fields,reprompt,login_uri,login_username,login_password,login_totp\n"
+            ",,login,Banco,,,,\"https://banco.cl,https://m.banco.cl\",yo@correo.cl,dos,JBSWY3DP\n"
+            ",,note,Nota,texto,,,,,,\n"
+        )
+        self.assertEqual((r.json()['formato'], r.json()['importadas']), ('bitwarden', 1))
+        self.assertEqual(r.json()['rechazadas'][0]['fila'], 3)
+        banco = Account.objects.get(user=self.user, site_name='Banco')
+        self.assertEqual(banco.site_url, 'https://banco.cl')
+        self.assertEqual(self.client.get(f"/api/cuentas/{banco.id}/revelar/").json()['decrypted_secret'], 'JBSWY3DP')
+
+    def test_rechaza_filas_invalidas(self):
+        largo = f"{'a' * 250}@correo.cl"
+        r = self.importar(
+            "name,url,username,password\n"
+            "Bueno,https://bueno.cl,yo@correo.cl,uno\n"
+            "XSS,javascript://%0aalert(1),yo@correo.cl,dos\n"
+            "FTP,ftp://archivos.cl,yo@correo.cl,tres\n"
+            f"Largo,https://largo.cl,{largo},cuatro\n"
+            "SinPassword,https://nada.cl,yo@correo.cl,\n"
+            "NoCorreo,https://nada.cl,usuario,cinco\n"
+        )
+        self.assertEqual(r.json()['importadas'], 1)
+        self.assertEqual([f['fila'] for f in r.json()['rechazadas']], [3, 4, 5, 6, 7])
+        self.assertEqual(list(Account.objects.filter(user=self.user).values_list('site_name', flat=True)), ['Bueno'])
+
+    def test_duplicadas_y_sin_cupo(self):
+        self.crear_cuenta(site_url='https://github.com')
+        filas = "".join(f"Sitio{i},https://sitio{i}.cl,yo@correo.cl,x\n" for i in range(12))
+        r = self.importar(
+            "name,url,username,password\n"
+            "GitHub,https://www.github.com/login,YO@correo.cl,uno\n"
+            "Banco,https://banco.cl,yo@correo.cl,dos\n"
+            "Banco,https://banco.cl/otra,yo@correo.cl,tres\n" + filas
+        )
+        self.assertEqual([f['fila'] for f in r.json()['duplicadas']], [2, 4])
+        # Plan gratuito: 10 cuentas, una ya ocupada
+        self.assertEqual((r.json()['importadas'], r.json()['sin_cupo']), (9, 4))
+        self.assertEqual(Account.objects.filter(user=self.user).count(), 10)
+
+    def test_formato_desconocido(self):
+        r = self.importar("sitio,clave\nx,y\n")
+        self.assertEqual(r.status_code, 400)
+
+    @override_settings(VAULT_IMPORT_MAX_FILAS=2)
+    def test_demasiadas_filas(self):
+        r = self.importar("name,url,username,password\n" + "".join(
+            f"S{i},https://s{i}.cl,yo@correo.cl,x\n" for i in range(3)))
+        self.assertEqual(r.status_code, 400)
+        self.assertFalse(Account.objects.exists())
+
+
+class OperacionesEnLoteTests(VaultTestCase):
+    def lote(self, *operaciones):
+        r = self.client.post('/api/cuentas/batch/', {'operaciones': list(operaciones)}, format='json')
+        self.assertEqual(r.status_code, 200, r.content)
+        return r.json()['resultados']
+
+    def test_resultado_por_operacion(self):
+        editar, borrar = (self.crear_cuenta(email=f"{n}@correo.cl")['id'] for n in ('editar', 'borrar'))
+        ajena = self.crear_cuenta(self.cliente(crear_usuario('beto')))['id']
+        resultados = self.lote(
+            {'op': 'crear', 'datos': {'email': 'nueva@correo.cl', 'password': 'n1', 'site_name': 'Nueva'}},
+            {'op': 'editar', 'id': editar, 'datos': {'site_name': 'Editada'}},
+            {'op': 'borrar', 'id': borrar},
+            {'op': 'borrar', 'id': ajena},
+            {'op': 'crear', 'datos': {'email': 'no-es-correo'}},
+            {'op': 'renombrar', 'id': editar},
+        )
+        self.assertEqual([r['status'] for r in resultados], [201, 200, 204, 404, 400, 400])
+        self.assertEqual(resultados[1]['cuenta']['site_name'], 'Editada')
+
+        nueva = resultados[0]['id']
+        r = self.client.get(f"/api/cuentas/{nueva}/revelar/")
+        self.assertEqual(r.json()['decrypted_password'], 'n1')
+        self.assertFalse(Account.objects.filter(pk=borrar).exists())
+        self.assertTrue(Account.objects.filter(pk=ajena).exists())
+        self.assertEqual(Profile.objects.get(user=self.user).cuentas_usadas, 2)
+        self.assertEqual(list(Borrado.objects.filter(user=self.user).values_list('objeto_id', flat=True)), [borrar])
+
+    def test_un_borrado_libera_cupo_en_el_mismo_lote(self):
+        Profile.objects.filter(user=self.user).update(
+            plan=PlanConfig.objects.create(nombre="Mini", slots_cuentas_base=1))
+        vieja = self.crear_cuenta()['id']
+        crear = {'op': 'crear', 'datos': {'email': 'x@correo.cl', 'password': 'x'}}
+        resultados = self.lote(crear, {'op': 'borrar', 'id': vieja}, crear, crear)
+        self.assertEqual([r['status'] for r in resultados], [403, 204, 201, 403])
+        self.assertEqual(Account.objects.filter(user=self.user).count(), 1)
+
+    def test_congelada_no_se_toca(self):
+        ids = [self.crear_cuenta(email=f"yo{i}@correo.cl")['id'] for i in range(2)]
+        profile = Profile.objects.get(user=self.user)
+        profile.plan = PlanConfig.objects.create(nombre="Mini", slots_cuentas_base=1)
+        profile.save()
+        resultados = self.lote({'op': 'editar', 'id': ids[1], 'datos': {'site_name': 'x'}},
+                               {'op': 'borrar', 'id': ids[1]})
+        self.assertEqual([r['status'] for r in resultados], [403, 403])
+
+    @override_settings(VAULT_BATCH_MAX_OPS=2)
+    def test_lote_invalido(self):
+        for cuerpo in ({}, {'operaciones': []}, {'operaciones': [{'op': 'borrar', 'id': str(uuid.uuid4())}] * 3}):
+            self.assertEqual(self.client.post('/api/cuentas/batch/', cuerpo, format='json').status_code, 400)
+
+
+class JWTSinConsultaTests(VaultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tokens = self.login(self.user)
+        self.jwt = self.cliente_jwt(self.tokens['access'])
+
+    def test_el_dueno_opera_sobre_sus_cuentas(self):
+        # El pk del token llega como texto: los permisos por objeto deben reconocer al dueño
+        cuenta = self.crear_cuenta(self.jwt)
+        url = f"/api/cuentas/{cuenta['id']}/"
+        self.assertEqual(self.jwt.get(url).status_code, 200)
+        self.assertEqual(self.jwt.patch(url, {'site_name': 'Otro'}, format='json').status_code, 200)
+        r = self.jwt.get(f"{url}revelar/")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()['decrypted_password'], 'secreta')
+        self.assertEqual(self.jwt.delete(url).status_code, 204)
+
+    def test_no_opera_sobre_cuentas_ajenas(self):
+        ajena = self.crear_cuenta(self.cliente(crear_usuario('beto')))
+        self.assertEqual(self.jwt.get(f"/api/cuentas/{ajena['id']}/").status_code, 404)
+
+    def test_restaurar_dos_veces_no_duplica(self):
+        for i in range(3):
+            self.crear_cuenta(self.jwt, email=f"yo{i}@correo.cl")
+        respaldo = b''.join(self.jwt.get('/api/backup/export/').streaming_content)
+        Account.objects.filter(user=self.user).delete()
+
+        for restauradas, omitidas in ((3, 0), (0, 3)):
+            r = self.jwt.post('/api/backup/restore/', respaldo, content_type='application/x-tar')
+            self.assertEqual(r.status_code, 200, r.content)
+            self.assertEqual(r.json()['cuentas_restauradas'], restauradas)
+            self.assertEqual(r.json()['cuentas_omitidas'], omitidas)
+        self.assertEqual(Account.objects.filter(user=self.user).count(), 3)
+
+    def test_usuario_desactivado_pierde_acceso(self):
+        self.assertEqual(self.jwt.get('/api/cuentas/').status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.jwt.get('/api/cuentas/').status_code, 401)
+
+    def test_cambio_de_plan_pide_renovar_el_token(self):
+        self.assertEqual(self.jwt.get('/api/cuentas/').status_code, 200)
+        profile = self.user.profile
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.plan = PlanConfig.objects.create(nombre="Premium", slots_cuentas_base=100)
+            profile.save()
+
+        r = self.jwt.get('/api/cuentas/')
+        self.assertEqual(r.status_code, 401)
+        self.assertEqual(r.json()['code'], 'token_not_valid')
+
+        r = APIClient().post('/api/token/refresh/', {'refresh': self.tokens['refresh']}, format='json')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.cliente_jwt(r.json()['access']).get('/api/cuentas/').status_code, 200)
+
+    def test_no_consulta_al_usuario(self):
+        self.jwt.get('/api/profile/me/')
+        with self.assertNumQueries(0):
+            user = JWTSinConsulta().get_user(AccessToken(self.tokens['access']))
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(user.email, self.user.email)
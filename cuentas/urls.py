@@ -1,10 +1,12 @@
 from rest_framework.routers import DefaultRouter
-from .views import AccountViewSet, VaultFileViewSet, MercadoPagoWebhookView, CreatePaymentView, UserProfileView
+from .views import AccountViewSet, VaultFileViewSet, UploadSessionViewSet, MercadoPagoWebhookView, CreatePaymentView, UserProfileView
+from .views import BackupExportView, BackupRestoreView, SyncView, IconoView
 from django.urls import path
 
 router = DefaultRouter()
 router.register("cuentas", AccountViewSet, basename="cuentas")
 router.register("files", VaultFileViewSet, basename="files")
+router.register("uploads", UploadSessionViewSet, basename="uploads")
 
 urlpatterns = router.urls + [
     path('profile/me/',
@@ -13,4 +15,12 @@ urlpatterns = router.urls + [
          MercadoPagoWebhookView.as_view(), name='mp-webhook'),
     path('payment/create/',
          CreatePaymentView.as_view(), name='payment-create'),
+    path('backup/export/',
+         BackupExportView.as_view(), name='backup-export'),
+    path('backup/restore/',
+         BackupRestoreView.as_view(), name='backup-restore'),
+    path('sync/',
+         SyncView.as_view(), name='sync'),
+    path('iconos/<str:dominio>/',
+         IconoView.as_view(), name='icono'),
 ]
@@ -1,27 +1,51 @@
 # cuentas/views.py
 
-from rest_framework import viewsets, generics, filters
+from rest_framework import viewsets, generics, mixins
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
 from .serializers import EmailTokenObtainPairSerializer, VaultFileSerializer, AnuncioSerializer
-from .models import Account, VaultFile, PlanConfig, PackConfig, Anuncio
-from .serializers import AccountSerializer, RegisterSerializer
+from .serializers import UploadSessionSerializer, mensaje_cuota_excedida
+from .models import Account, VaultFile, VaultBlob, PlanConfig, PackConfig, Anuncio, UploadSession
+from .models import Profile, CuotaExcedida, PurgaCuenta, Borrado, Icono
+from .serializers import AccountSerializer, AccountMetadataSerializer, RegisterSerializer
 from .permissions import IsAccountOwnerAndWithinLimit
+from .pagination import PaginacionPorCursor
+from .filters import BusquedaIndexada
+from .condicional import con_etag
+from .cupos import cupos_de, olvidar_cupos
+from .iconos import dominio_de, es_url_de_icono
+from .backup import iter_backup, restaurar_backup, BackupInvalido
+from .importacion import importar_csv, ImportacionInvalida
+from .sync import emitir_token, leer_token, cambios, TokenSyncInvalido, TokenSyncVencido
 from django.contrib.auth.models import User
 from django.contrib.auth.hashers import make_password, check_password
 from django.core.mail import send_mail
 from django.conf import settings
 from django.utils import timezone
-from django.http import HttpResponse
-from django.db.models import Sum
-from core.utils import encrypt_text, decrypt_text, decrypt_bytes
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.db.models import Sum, F
+from django.db import transaction, IntegrityError, DatabaseError
+from django.core.files.storage import default_storage
+from core.utils import StreamDecryptor, StreamEncryptor, GeneratedFile, EncryptedFormatError, content_digest
+from core.utils import CODEC_IDENTITY, iter_decompress, iter_slice, choose_codec, StreamEncryptedFile
+from core.crypto import llave_de_usuario, encrypt_many, decrypt_many
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import logging
 import mimetypes
 import mercadopago
+import re
 import traceback
+import uuid
+
+logger = logging.getLogger(__name__)
 
 
 class AnuncioListView(generics.ListAPIView):
@@ -29,6 +53,10 @@ class AnuncioListView(generics.ListAPIView):
     # O AllowAny si quieres que se vean en el login
     permission_classes = [IsAuthenticated]
 
+    @con_etag('anuncios')
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
     def get_queryset(self):
         return Anuncio.objects.all()
         # ahora = timezone.now()
@@ -42,54 +70,19 @@ class AnuncioListView(generics.ListAPIView):
 class UserProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @con_etag('perfil')
     def get(self, request):
         user = request.user
+        cupos = cupos_de(request)
+        profile = cupos.profile
+        limites = cupos.resumen()
 
-        if not hasattr(user, 'profile'):
-            from .models import Profile
-            Profile.objects.create(user=user)
-
-        profile = user.profile
-
-        # Valores por defecto
-        base_gb = 0
-        base_cuentas = 10
-        base_notas = 10  # Valor por defecto para notas
-        nombre_plan = "Plan Gratuito"
-        es_premium = False
-
-        if profile.plan:
-            nombre_plan = profile.plan.nombre
-            es_premium = profile.plan.sin_anuncios
-
-            # --- USAMOS LOS NOMBRES REALES DEL LOG ---
-            base_gb = getattr(profile.plan, 'limite_gb_base', 0)
-            base_cuentas = getattr(profile.plan, 'slots_cuentas_base', 10)
-            base_notas = getattr(profile.plan, 'slots_notas_base', 10)
-
-        # --- SUMAMOS LOS EXTRAS (Packs comprados) ---
-        total_gb = base_gb + getattr(profile, 'extra_gb_almacenamiento', 0)
-        total_cuentas = base_cuentas + getattr(profile, 'extra_slots_cuentas', 0)
-        total_notas = base_notas + getattr(profile, 'extra_slots_notas', 0)
-
-        # --- CÁLCULO DE USO ---
-        cuentas_usadas = Account.objects.filter(user=user).count()
-
-        # --- 🚀 CORRECCIÓN CRÍTICA AQUÍ ---
-        # Usamos aggregate para pedirle a la Base de Datos que sume el campo 'size_bytes'.
-        # Esto NO toca los archivos físicos, por lo que es rápido y no falla si faltan archivos.
-        total_bytes = VaultFile.objects.filter(user=user).aggregate(
+        # Lo que suman los archivos sin deduplicar; la diferencia no cuenta en la cuota
+        logico_bytes = VaultFile.objects.filter(user=user).aggregate(
             total=Sum('size_bytes')
         )['total'] or 0
-        
-        usado_mb = round(total_bytes / (1024 * 1024), 2)
-
-        # Calcular porcentaje
-        total_mb_permitidos = total_gb * 1024
-        porcentaje_storage = 0
-        if total_mb_permitidos > 0:
-            porcentaje_storage = round(
-                (usado_mb / total_mb_permitidos) * 100, 1)
+        limites["almacenamiento"]["deduplicado_mb"] = round(
+            max(logico_bytes - cupos.bytes_usados, 0) / (1024 * 1024), 2)
 
         return Response({
             "usuario": {
@@ -98,27 +91,13 @@ class UserProfileView(APIView):
                 "fecha_unio": user.date_joined.strftime("%Y-%m-%d"),
             },
             "preferencias": {
-                "theme": user.profile.theme
+                "theme": profile.theme
             },
             "plan": {
-                "nombre": nombre_plan,
-                "es_premium": es_premium,
-            },
-            "limites": {
-                "cuentas": {
-                    "usadas": cuentas_usadas,
-                    "total": total_cuentas,
-                    "restantes": max(0, total_cuentas - cuentas_usadas)
-                },
-                "almacenamiento": {
-                    "usado_mb": usado_mb,
-                    "total_gb": total_gb,
-                    "porcentaje": porcentaje_storage
-                },
-                "notas": {
-                    "total": total_notas
-                }
+                "nombre": cupos.nombre_plan,
+                "es_premium": cupos.es_premium,
             },
+            "limites": limites,
             "gamificacion": {
                 "anuncios_vistos": profile.total_anuncios_vistos,
                 "progreso_recompensa": profile.total_anuncios_vistos % 10,
@@ -357,7 +336,7 @@ class SecurityView(APIView):
         profile.save()
 
         if profile.intentos_fallidos >= 10:
-            user.delete()
+            PurgaCuenta.programar(user, motivo='pin')
             return Response(
                 {"error": "Límite de intentos excedido. Cuenta eliminada por seguridad."}, 
                 status=401
@@ -373,7 +352,7 @@ class AdRewardView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        profile = request.user.profile
+        profile = cupos_de(request).profile
         ahora = timezone.now()
 
         if profile.ultima_vez_anuncio and profile.ultima_vez_anuncio.date() != ahora.date():
@@ -392,12 +371,13 @@ class AdRewardView(APIView):
             gano_recompensa = True
 
         profile.save()
+        olvidar_cupos(request)
 
         return Response({
             "mensaje": "Anuncio registrado correctamente",
             "recompensa_obtenida": gano_recompensa,
             "progreso_para_siguiente": profile.total_anuncios_vistos % 10,
-            "total_slots": profile.total_cuentas_permitidas
+            "total_slots": profile.cupos.cuentas
         })
 
 
@@ -405,49 +385,502 @@ class VaultFileViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = VaultFileSerializer
     parser_classes = (MultiPartParser, FormParser)
+    pagination_class = PaginacionPorCursor
 
     def get_queryset(self):
-        return VaultFile.objects.filter(user=self.request.user).order_by('-created_at')
+        return VaultFile.objects.filter(user=self.request.user).select_related('blob').order_by('-created_at', '-id')
+
+    @con_etag('archivos')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            pk = instance.pk
+            instance.delete()
+            Borrado.registrar(instance.user_id, 'archivo', [pk])
+            Profile.tocar(instance.user_id, 'archivos')
+            if instance.blob_id:
+                VaultBlob.liberar(instance.blob_id)
+
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch(self, request):
+        """
+        Subida de varios archivos en un solo request (campo `files` repetido).
+        Uso: POST /api/files/batch/
+        La cuota se verifica una vez para el total, los archivos nuevos se cifran
+        en paralelo y las filas se insertan con bulk_create. Responde el
+        resultado de cada archivo en el mismo orden en que llegaron.
+        """
+        user = request.user
+        archivos = request.FILES.getlist('files')
+        if not archivos:
+            return Response({"error": "Envía al menos un archivo en el campo 'files'."}, status=400)
+        if len(archivos) > settings.VAULT_BATCH_MAX_FILES:
+            return Response({"error": f"Máximo {settings.VAULT_BATCH_MAX_FILES} archivos por lote."}, status=400)
+
+        resultados = [{"name": f.name} for f in archivos]
+        limite_bytes = settings.VAULT_MAX_UPLOAD_MB * 1024 * 1024
+
+        # La DEK se resuelve aquí: los hilos no tocan la BD
+        llave = llave_de_usuario(user.id)
+
+        with ThreadPoolExecutor(max_workers=settings.VAULT_BATCH_WORKERS) as pool:
+            # 1. Huella de cada archivo (en paralelo) para deduplicar
+            digests = list(pool.map(lambda f: content_digest(llave, f.chunks()), archivos))
+            existentes = {
+                blob.digest: blob
+                for blob in VaultBlob.objects.filter(user=user, digest__in=set(digests))
+            }
+
+            nuevos = {}  # digest -> índice del primer archivo con ese contenido
+            validos = []
+            for i, (archivo, digest) in enumerate(zip(archivos, digests)):
+                if archivo.size == 0:
+                    resultados[i]["error"] = "El archivo está vacío."
+                elif archivo.size > limite_bytes:
+                    resultados[i]["error"] = f"El archivo excede el límite de {settings.VAULT_MAX_UPLOAD_MB}MB."
+                else:
+                    validos.append(i)
+                    if digest not in existentes and digest not in nuevos:
+                        nuevos[digest] = i
+
+            # 2. Una sola verificación de cuota para todo lo que ocupa espacio nuevo
+            reservado = sum(archivos[i].size for i in nuevos.values())
+            try:
+                Profile.reservar(user, bytes=reservado)
+            except CuotaExcedida as e:
+                return Response({"error": mensaje_cuota_excedida(e)}, status=400)
+
+            # Desde aquí lo reservado se devuelve si algo falla: nada más lo descontaría
+            cifrados = {}
+            try:
+                # 3. Cifrado en paralelo (los hilos solo tocan el storage, no la BD)
+                futuros = {digest: pool.submit(_cifrar_blob, archivos[i], llave) for digest, i in nuevos.items()}
+                for digest, futuro in futuros.items():
+                    i = nuevos[digest]
+                    try:
+                        cifrados[digest] = futuro.result()
+                    except Exception:
+                        logger.warning("Error al cifrar %s", archivos[i].name, exc_info=True)
+                        Profile.ajustar_uso(user, bytes=-archivos[i].size)
+                        reservado -= archivos[i].size
+
+                # 4. Inserción en bloque: blobs nuevos y luego todas las filas VaultFile
+                usos = {}
+                for i in validos:
+                    digest = digests[i]
+                    if digest in existentes or digest in cifrados:
+                        usos[digest] = usos.get(digest, 0) + 1
+                    else:
+                        resultados[i]["error"] = "No se pudo cifrar el archivo."
+
+                with transaction.atomic():
+                    blobs = VaultBlob.objects.bulk_create([
+                        VaultBlob(user=user, digest=digest, file=name, codec=codec,
+                                  size_bytes=archivos[nuevos[digest]].size,
+                                  stored_bytes=stored, ref_count=usos[digest])
+                        for digest, (name, codec, stored) in cifrados.items()
+                    ])
+                    for blob in existentes.values():
+                        if blob.digest in usos:
+                            VaultBlob.objects.filter(pk=blob.pk).update(
+                                ref_count=F('ref_count') + usos[blob.digest])
+                    por_digest = {**existentes, **{blob.digest: blob for blob in blobs}}
+
+                    filas = [
+                        VaultFile(user=user, blob=por_digest[digests[i]], file=por_digest[digests[i]].file.name,
+                                  name=archivos[i].name, size_bytes=archivos[i].size)
+                        for i in validos if "error" not in resultados[i]
+                    ]
+                    VaultFile.objects.bulk_create(filas)
+                    Profile.tocar(user, 'archivos')
+            except BaseException as e:
+                Profile.ajustar_uso(user, bytes=-reservado)
+                for name, _, _ in cifrados.values():
+                    default_storage.delete(name)
+                if not isinstance(e, IntegrityError):
+                    raise
+                # Otra subida creó alguno de estos blobs entremedio: se deshace el lote
+                return Response({"error": "Conflicto con otra subida simultánea, reintenta."}, status=409)
+
+        filas_por_indice = iter(filas)
+        for i in validos:
+            if "error" in resultados[i]:
+                continue
+            vault_file = next(filas_por_indice)
+            resultados[i].update({
+                "ok": True,
+                "id": vault_file.id,
+                "size_bytes": vault_file.size_bytes,
+                "deduplicado": digests[i] in existentes or nuevos.get(digests[i]) != i,
+            })
+        for resultado in resultados:
+            resultado.setdefault("ok", False)
+
+        creados = sum(1 for r in resultados if r["ok"])
+        return Response({"creados": creados, "fallidos": len(resultados) - creados,
+                         "resultados": resultados}, status=201 if creados else 400)
+
     @action(detail=True, methods=['get'])
     def download(self, request, pk=None):
         """
         Endpoint para descargar y descifrar el archivo.
         Uso: GET /api/files/{id}/download/
+        Soporta `Range: bytes=inicio-fin` (un solo rango) e `If-Range`, para
+        reanudar descargas y saltar dentro de PDFs o videos.
         """
         # get_object() ya asegura que el archivo pertenezca al usuario autenticado
         vault_file = self.get_object() 
         
+        f = None
         try:
-            # 1. Leer el contenido cifrado (.enc) desde el disco
-            with vault_file.file.open('rb') as f:
-                encrypted_data = f.read()
-            
-            # 2. Descifrar los bytes usando la llave maestra
-            decrypted_data = decrypt_bytes(encrypted_data)
-
-            # 3. Determinar el tipo de contenido original (image/png, application/pdf, etc.)
-            content_type, _ = mimetypes.guess_type(vault_file.name)
-            if not content_type:
-                content_type = 'application/octet-stream'
-
-            # 4. Devolver la respuesta con el archivo original descifrado
-            response = HttpResponse(decrypted_data, content_type=content_type)
-            # Se usa el nombre original guardado en el modelo para la descarga
-            response['Content-Disposition'] = f'attachment; filename="{vault_file.name}"'
-            
-            return response
-
+            # 1. Abrir el contenido cifrado (.enc) y leer su cabecera
+            f = vault_file.file.open('rb')
+            decryptor = StreamDecryptor(f, llave_de_usuario(vault_file.user_id))
         except Exception as e:
+            # Todavía no hay respuesta en streaming que lo cierre al terminar
+            if f is not None:
+                f.close()
             print(f"Error al descifrar archivo {pk}: {e}")
             return Response(
                 {"error": "No se pudo procesar el archivo o la llave es incorrecta."}, 
                 status=500
             )
 
+        # 2. Determinar el tipo de contenido original (image/png, application/pdf, etc.)
+        content_type, _ = mimetypes.guess_type(vault_file.name)
+        if not content_type:
+            content_type = 'application/octet-stream'
+
+        codec = vault_file.blob.codec if vault_file.blob_id else CODEC_IDENTITY
+        # Comprimido: el tamaño real es el lógico guardado en el modelo
+        size = decryptor.size if codec == CODEC_IDENTITY else vault_file.size_bytes
+        etag = f'"{vault_file.pk}-{size}-{int(vault_file.created_at.timestamp())}"'
+        last_modified = http_date(vault_file.created_at.timestamp())
+
+        # 3. Resolver el rango pedido (si el If-Range no calza se envía completo)
+        rango = None
+        if _if_range_matches(request.headers.get('If-Range'), etag, last_modified):
+            rango = _parse_range(request.headers.get('Range'), size)
+
+        if rango == 'invalido':
+            f.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        start, stop = rango or (0, size)
+
+        # 4. Descifrar segmento a segmento mientras se envía. Si está comprimido
+        #    no se puede saltar directo al segmento: se descomprime desde el inicio
+        #    y se descarta lo anterior al rango (igual en streaming).
+        if codec == CODEC_IDENTITY:
+            chunks = decryptor.iter_range(start, stop)
+        else:
+            chunks = iter_slice(iter_decompress(decryptor.iter_range(), codec), start, stop)
+
+        response = StreamingHttpResponse(
+            _stream_and_close(chunks, f),
+            status=206 if rango else 200,
+            content_type=content_type,
+        )
+        response['Content-Length'] = str(stop - start)
+        if rango:
+            response['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        # Se usa el nombre original guardado en el modelo para la descarga
+        response['Content-Disposition'] = f'attachment; filename="{vault_file.name}"'
+        return response
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.ListModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    Subida reanudable por partes:
+      POST   /api/uploads/                      {name, size_bytes} -> sesión
+      PUT    /api/uploads/{id}/chunks/{n}/      cuerpo binario del trozo n
+      GET    /api/uploads/{id}/                 qué trozos faltan (para reanudar)
+      POST   /api/uploads/{id}/finalize/        arma el VaultFile
+      DELETE /api/uploads/{id}/                 cancela y borra los trozos
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = UploadSessionSerializer
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(
+            user=self.request.user, expires_at__gte=timezone.now()).order_by('-created_at')
+
+    def perform_create(self, serializer):
+        # Aprovechamos para limpiar sesiones abandonadas (de cualquier usuario)
+        UploadSession.purgar_expiradas()
+        serializer.save(user=self.request.user)
+
+    def perform_destroy(self, instance):
+        instance.cancelar()
+
+    @action(detail=True, methods=['put'], url_path=r'chunks/(?P<index>\d+)')
+    def chunk(self, request, pk=None, index=None):
+        session = self.get_object()
+        index = int(index)
+
+        if index >= session.total_chunks:
+            return Response({"error": f"El trozo {index} no existe (total {session.total_chunks})."}, status=400)
+
+        expected = session.chunk_length(index)
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or -1)
+        except ValueError:
+            content_length = -1
+        if content_length != expected:
+            return Response({"error": f"El trozo {index} debe medir exactamente {expected} bytes."}, status=400)
+
+        # Se cifra mientras se lee el cuerpo; un reintento reemplaza el trozo anterior
+        path = session.chunk_path(index)
+        default_storage.delete(path)
+        encryptor = StreamEncryptor(header=session.header, llave=llave_de_usuario(session.user_id))
+        segments_per_chunk = session.chunk_size // encryptor.segment_size
+        chunks = encryptor.iter_encrypt_chunk(
+            request.stream,
+            first_index=index * segments_per_chunk,
+            length=expected,
+            final=index == session.total_chunks - 1,
+        )
+        try:
+            saved = default_storage.save(path, GeneratedFile(chunks))
+        except EncryptedFormatError as e:
+            default_storage.delete(path)
+            return Response({"error": str(e)}, status=400)
+
+        if saved != path:
+            # Otro envío del mismo trozo ganó la carrera
+            default_storage.delete(saved)
+            return Response({"error": "El trozo se está enviando dos veces a la vez."}, status=409)
+
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update().get(pk=session.pk)
+            if index not in session.chunks_recibidos:
+                session.chunks_recibidos = sorted(session.chunks_recibidos + [index])
+                session.save(update_fields=['chunks_recibidos'])
+
+        return Response(self.get_serializer(session).data)
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        session = self.get_object()
+        if session.chunks_faltantes:
+            return Response({
+                "error": "Faltan trozos por subir.",
+                "chunks_faltantes": session.chunks_faltantes,
+            }, status=400)
+
+        def iter_encrypted():
+            yield bytes(session.header)
+            for index in range(session.total_chunks):
+                with default_storage.open(session.chunk_path(index), 'rb') as part:
+                    yield from part.chunks()
+
+        # Se arma el .enc final y se calcula su huella para deduplicar
+        campo = VaultBlob._meta.get_field('file')
+        name = campo.generate_filename(None, f"{session.name}.enc")
+        # Con nombres largos la ruta se recorta para que quepa en la columna
+        name = default_storage.save(name, GeneratedFile(iter_encrypted()), max_length=campo.max_length)
+        with default_storage.open(name, 'rb') as f:
+            llave = llave_de_usuario(request.user.id)
+            digest = content_digest(llave, StreamDecryptor(f, llave).iter_range())
+
+        with transaction.atomic():
+            # Se borra la sesión primero: si otro finalize llegó antes, este no la encuentra
+            borradas, _ = UploadSession.objects.filter(pk=session.pk).delete()
+            if not borradas:
+                default_storage.delete(name)
+                return Response({"error": "La subida ya fue finalizada."}, status=409)
+
+            # El espacio se reservó al crear la sesión (si era duplicado se devuelve)
+            blob, _ = VaultBlob.guardar(
+                request.user, digest, session.size_bytes, name, reservado=True)
+            vault_file = VaultFile.objects.create(
+                user=request.user,
+                blob=blob,
+                file=blob.file.name,
+                name=session.name,
+                size_bytes=session.size_bytes,
+            )
+        session.borrar_partes()
+
+        return Response(VaultFileSerializer(vault_file, context={'request': request}).data, status=201)
+
+
+def _cifrar_blob(archivo, llave):
+    """Comprime (si conviene), cifra y guarda un archivo subido. Devuelve (nombre, codec, tamaño guardado)."""
+    codec = choose_codec(archivo, mimetypes.guess_type(archivo.name)[0])
+    campo = VaultBlob._meta.get_field('file')
+    name = campo.generate_filename(None, f"{archivo.name}.enc")
+    name = default_storage.save(
+        name, StreamEncryptedFile(archivo, codec=codec, llave=llave), max_length=campo.max_length)
+    return name, codec, default_storage.size(name)
+
+
+def _stream_and_close(chunks, f):
+    try:
+        yield from chunks
+    except Exception as e:
+        # Ya se enviaron las cabeceras: solo queda cortar la conexión
+        print(f"Error al descifrar durante la descarga: {e}")
+        raise
+    finally:
+        f.close()
+
+
+def _if_range_matches(if_range, etag, last_modified):
+    if not if_range:
+        return True
+    return if_range.strip() in (etag, last_modified)
+
+
+# Un solo rango: inicio-fin, inicio- o -sufijo (varios separados por coma se ignoran)
+_RANGO = re.compile(r'(\d*)-(\d*)', re.ASCII)
+
+
+def _parse_range(header, size):
+    """
+    Interpreta `Range: bytes=...` y devuelve (inicio, fin_exclusivo).
+    None = ignorar el header (ausente, mal formado, fin antes del inicio o
+    varios rangos), como pide RFC 9110; 'invalido' = rango fuera del archivo (416).
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    rango = _RANGO.fullmatch(header[len('bytes='):].strip())
+    if not rango or rango.group(0) == '-':
+        return None
+
+    first, last = rango.groups()
+    if first == '':
+        # Sufijo: los últimos N bytes
+        length = int(last)
+        if length <= 0:
+            return 'invalido'
+        return (max(size - length, 0), size)
+    start = int(first)
+    stop = int(last) + 1 if last else size
+
+    if last and stop <= start:
+        # bytes=5-3 no es un rango válido: se ignora y se envía todo
+        return None
+    if start >= size:
+        return 'invalido'
+    return (start, min(stop, size))
+
+
+class BackupExportView(APIView):
+    """
+    Descarga un .tar con todas las cuentas y archivos del usuario.
+    Uso: GET /api/backup/export/
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        response = StreamingHttpResponse(iter_backup(request.user), content_type='application/x-tar')
+        fecha = timezone.now().strftime("%Y%m%d")
+        response['Content-Disposition'] = f'attachment; filename="niun-respaldo-{fecha}.tar"'
+        return response
+
+
+class BackupRestoreView(APIView):
+    """
+    Restaura un respaldo generado por /api/backup/export/.
+    Uso: POST /api/backup/restore/ con el .tar como cuerpo (application/x-tar).
+    Si se corta a la mitad, volver a enviarlo continúa donde quedó.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if request.stream is None:
+            return Response({"error": "Envía el archivo .tar como cuerpo del request."}, status=400)
+
+        resumen = {}
+        try:
+            restaurar_backup(request.user, request.stream, resumen)
+        except BackupInvalido as e:
+            return Response({"error": str(e), "resumen": resumen}, status=400)
+        except Exception:
+            traceback.print_exc()
+            return Response({
+                "error": "La restauración se interrumpió. Vuelve a enviar el respaldo para continuar.",
+                "resumen": resumen,
+            }, status=500)
+
+        return Response(resumen)
+
+
+class SyncView(APIView):
+    """
+    Sincronización por deltas para la app sin conexión.
+    Uso: GET /api/sync/?token=<token de la sincronización anterior>
+    Sin token entrega todo. Responde las cuentas (solo metadatos) y archivos
+    creados o editados, los ids borrados y el token para la próxima vez.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        # El instante se toma antes de leer: lo que cambie durante la lectura sale en la próxima
+        instante = timezone.now()
+        token = request.query_params.get('token')
+        desde = None
+        if token:
+            try:
+                desde = leer_token(request.user, token)
+            except TokenSyncInvalido as e:
+                return Response({"error": str(e)}, status=400)
+            except TokenSyncVencido as e:
+                return Response({"error": str(e)}, status=410)
+
+        cuentas, archivos, borrados = cambios(request.user, desde)
+        contexto = {'request': request}
+        return Response({
+            "token": emitir_token(request.user, instante),
+            "completo": desde is None,
+            "cuentas": AccountMetadataSerializer(cuentas, many=True, context=contexto).data,
+            "archivos": VaultFileSerializer(archivos, many=True, context=contexto).data,
+            "borrados": borrados,
+        })
+
+
+class IconoView(APIView):
+    """
+    Favicon de un dominio desde la caché del servidor (ver cuentas/iconos.py).
+    Uso: GET /api/iconos/<dominio>/, la URL que queda en Account.site_icon_url.
+    Es pública, como lo era DuckDuckGo: un <img> no manda el token.
+    """
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def get(self, request, dominio):
+        icono = Icono.objects.filter(dominio=dominio, estado='listo').defer('contenido').first()
+        if icono is None:
+            # Puede estar en cola: que el cliente vuelva a intentar en un rato
+            respuesta = HttpResponse(status=404)
+            patch_cache_control(respuesta, public=True, max_age=300)
+            return respuesta
+
+        etag = f'"{icono.huella}"'
+        respuesta = get_conditional_response(request, etag=etag)
+        if respuesta is None:
+            # El contenido se lee recién aquí: un 304 no lo trae de la BD
+            respuesta = HttpResponse(bytes(icono.contenido), content_type=icono.content_type)
+        respuesta['ETag'] = etag
+        respuesta['X-Content-Type-Options'] = 'nosniff'
+        patch_cache_control(respuesta, public=True, max_age=settings.VAULT_ICONOS_MAX_AGE)
+        return respuesta
+
 
 class EmailTokenObtainPairView(TokenObtainPairView):
     serializer_class = EmailTokenObtainPairSerializer
@@ -457,14 +890,243 @@ class AccountViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, IsAccountOwnerAndWithinLimit]
 
     serializer_class = AccountSerializer
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['site_name', 'site_url', 'email']
+    filter_backends = [BusquedaIndexada]
+    pagination_class = PaginacionPorCursor
 
     def get_queryset(self):
-        return Account.objects.filter(user=self.request.user).order_by('-created_at')
+        queryset = Account.objects.filter(user=self.request.user).order_by('-created_at', '-id')
+        if self.action == 'list':
+            queryset = queryset.defer('password_encrypted')
+        return queryset
+
+    @con_etag('cuentas')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    def get_serializer_class(self):
+        # El listado va sin descifrar (solo metadatos): las contraseñas se piden
+        # con revelar / revelar_lote. ?modo=metadatos se sigue aceptando y no cambia nada.
+        if self.action == 'list':
+            return AccountMetadataSerializer
+        return AccountSerializer
+
+    @action(detail=True, methods=['get'])
+    def revelar(self, request, pk=None):
+        """
+        Descifra una sola cuenta.
+        Uso: GET /api/cuentas/{id}/revelar/
+        """
+        account = self.get_object()
+        return Response(_revelar([account], request.user)[0])
+
+    @action(detail=False, methods=['post'], url_path='revelar', url_name='revelar-lote')
+    def revelar_lote(self, request):
+        """
+        Descifra varias cuentas elegidas de una vez.
+        Uso: POST /api/cuentas/revelar/ con {"ids": ["uuid", ...]}
+        """
+        ids, error = _ids_de_cuentas(request, settings.VAULT_REVEAL_MAX_IDS)
+        if error:
+            return Response({"error": error}, status=400)
+
+        cuentas = list(self.get_queryset().filter(id__in=ids))
+        encontrados = {str(a.id) for a in cuentas}
+        return Response({
+            "cuentas": _revelar(cuentas, request.user),
+            "no_encontradas": [i for i in ids if i not in encontrados],
+        })
+
+    @action(detail=False, methods=['post'])
+    def iconos(self, request):
+        """
+        Iconos de una página de cuentas en una sola respuesta, como data URI.
+        Uso: POST /api/cuentas/iconos/ con {"ids": ["uuid", ...]}
+        Responde {"cuentas": {id: dominio}, "iconos": {dominio: "data:..."}}; las
+        cuentas con icono propio o sin icono descargado todavía no aparecen.
+        """
+        ids, error = _ids_de_cuentas(request, settings.VAULT_ICONOS_MAX_LOTE)
+        if error:
+            return Response({"error": error}, status=400)
+
+        por_cuenta = {}
+        for pk, site_url, site_icon_url in self.get_queryset().filter(id__in=ids).values_list(
+                'id', 'site_url', 'site_icon_url'):
+            if site_icon_url and not es_url_de_icono(site_icon_url):
+                continue
+            dominio = dominio_de(site_url)
+            if dominio:
+                por_cuenta[str(pk)] = dominio
+
+        iconos = {
+            dominio: f"data:{content_type};base64,{base64.b64encode(contenido).decode()}"
+            for dominio, content_type, contenido in Icono.objects.filter(
+                dominio__in=set(por_cuenta.values()), estado='listo').values_list(
+                'dominio', 'content_type', 'contenido')
+        }
+        return Response({
+            "cuentas": {pk: dominio for pk, dominio in por_cuenta.items() if dominio in iconos},
+            "iconos": iconos,
+        })
+
+    @action(detail=False, methods=['post'], parser_classes=(MultiPartParser,))
+    def importar(self, request):
+        """
+        Importa las contraseñas exportadas desde Chrome, Firefox o Bitwarden.
+        Uso: POST /api/cuentas/importar/ multipart con el CSV en "archivo".
+        Responde cuántas se importaron y qué filas quedaron fuera (duplicadas,
+        rechazadas o sin cupo).
+        """
+        archivo = request.FILES.get('archivo')
+        if archivo is None:
+            return Response({"error": "Envía el CSV exportado en el campo 'archivo'."}, status=400)
+
+        try:
+            resumen = importar_csv(request.user, archivo.file)
+        except ImportacionInvalida as e:
+            return Response({"error": str(e)}, status=400)
+        finally:
+            archivo.close()
+        return Response(resumen, status=201 if resumen['importadas'] else 200)
+
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch(self, request):
+        """
+        Varias altas, ediciones y borrados en un solo request y una sola transacción.
+        Uso: POST /api/cuentas/batch/ con
+            {"operaciones": [{"op": "crear", "datos": {...}},
+                             {"op": "editar", "id": "uuid", "datos": {...}},
+                             {"op": "borrar", "id": "uuid"}]}
+        El cupo y las cuentas congeladas se leen una sola vez para todo el lote.
+        Una operación que falla no anula las demás: responde {"resultados": [...]}
+        en el mismo orden, cada uno con su "status" (201, 200, 204, 400, 403, 404).
+        """
+        user = request.user
+        operaciones = request.data.get('operaciones')
+        if not isinstance(operaciones, list) or not operaciones:
+            return Response({"error": "Envía una lista 'operaciones' con al menos una operación."}, status=400)
+        if len(operaciones) > settings.VAULT_BATCH_MAX_OPS:
+            return Response({"error": f"Máximo {settings.VAULT_BATCH_MAX_OPS} operaciones por lote."}, status=400)
+
+        resultados = [{"op": op.get('op') if isinstance(op, dict) else None} for op in operaciones]
+        ids = {}
+        for i, op in enumerate(operaciones):
+            if not isinstance(op, dict) or op.get('op') not in ('crear', 'editar', 'borrar'):
+                resultados[i].update(status=400, error="Cada operación lleva 'op': crear, editar o borrar.")
+            elif op['op'] != 'crear':
+                try:
+                    ids[i] = str(uuid.UUID(str(op.get('id'))))
+                except ValueError:
+                    resultados[i].update(status=400, error="Falta el 'id' de la cuenta o no es válido.")
+
+        with transaction.atomic():
+            # Una sola lectura del cupo (con el perfil bloqueado) y de las cuentas tocadas
+            profile = Profile.objects.select_related('plan').select_for_update(of=('self',)).get(user=user)
+            disponibles = profile.cupos.cuentas - profile.cuentas_usadas
+            cuentas = {str(a.id): a for a in self.get_queryset().filter(id__in=set(ids.values()))}
+
+            nuevas, borradas = [], []
+            for i, op in enumerate(operaciones):
+                if 'status' in resultados[i]:
+                    continue
+                resultado = resultados[i]
+                datos = op.get('datos') or {}
+
+                if op['op'] == 'crear':
+                    serializer = AccountSerializer(data=datos, context={'request': request})
+                    if not serializer.is_valid():
+                        resultado.update(status=400, errores=serializer.errors)
+                    elif disponibles <= 0:
+                        resultado.update(status=403, error=mensaje_cuota_excedida(CuotaExcedida('cuentas', profile)))
+                    else:
+                        disponibles -= 1
+                        nuevas.append((resultado, serializer.validated_data))
+                    continue
+
+                resultado['id'] = ids[i]
+                account = cuentas.get(ids[i])
+                if account is None:
+                    resultado.update(status=404, error="Cuenta no encontrada.")
+                elif account.congelada:
+                    resultado.update(status=403, error=IsAccountOwnerAndWithinLimit.mensaje_congelada)
+                elif op['op'] == 'borrar':
+                    # Liberan su lugar para las altas que vienen después en el lote
+                    del cuentas[ids[i]]
+                    disponibles += 1
+                    borradas.append(ids[i])
+                    resultado['status'] = 204
+                else:
+                    serializer = AccountSerializer(account, data=datos, partial=True, context={'request': request})
+                    if not serializer.is_valid():
+                        resultado.update(status=400, errores=serializer.errors)
+                        continue
+                    try:
+                        # Punto de guardado: si falla esta edición, las demás siguen
+                        with transaction.atomic():
+                            serializer.save()
+                    except DatabaseError:
+                        traceback.print_exc()
+                        resultado.update(status=400, error="No se pudo guardar la cuenta.")
+                        continue
+                    resultado.update(status=200, cuenta=AccountMetadataSerializer(account).data)
+
+            if borradas:
+                Account.borrar_lote(user, borradas)
+                Borrado.registrar(user.pk, 'cuenta', borradas)
+            if nuevas:
+                llave = llave_de_usuario(user.id)
+                passwords = encrypt_many([d.get('password') for _, d in nuevas], llave)
+                secrets = encrypt_many([d.get('secret') for _, d in nuevas], llave)
+                creadas = []
+                for (resultado, datos), password, secret in zip(nuevas, passwords, secrets):
+                    campos = {k: v for k, v in datos.items() if k not in ('password', 'secret')}
+                    account = Account(user=user, password_encrypted=password or "", secret_encrypted=secret, **campos)
+                    account.preparar()
+                    creadas.append(account)
+                Account.insertar_lote(user, creadas)
+                for (resultado, _), account in zip(nuevas, creadas):
+                    resultado.update(status=201, id=str(account.id), cuenta=AccountMetadataSerializer(account).data)
+
+        return Response({"resultados": resultados})
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        # El cupo se verifica con el perfil bloqueado, en la misma transacción del
+        # alta; el contador lo suma Account.save()
+        try:
+            with transaction.atomic():
+                Profile.verificar_cupo(self.request.user, cuentas=1)
+                serializer.save(user=self.request.user)
+        except CuotaExcedida as e:
+            raise PermissionDenied(mensaje_cuota_excedida(e))
+
+    def perform_destroy(self, instance):
+        # Contador, versión y congeladas los actualiza Account.delete()
+        with transaction.atomic():
+            pk = instance.pk
+            instance.delete()
+            Borrado.registrar(instance.user_id, 'cuenta', [pk])
+
+
+def _ids_de_cuentas(request, maximo):
+    """Lee {"ids": [...]} del cuerpo. Devuelve (ids normalizados, None) o (None, mensaje de error)."""
+    ids = request.data.get('ids')
+    if not isinstance(ids, list) or not ids:
+        return None, "Envía una lista 'ids' con al menos una cuenta."
+    if len(ids) > maximo:
+        return None, f"Máximo {maximo} cuentas por solicitud."
+    try:
+        return [str(uuid.UUID(str(i))) for i in ids], None
+    except ValueError:
+        return None, "Hay ids que no son válidos."
+
+
+def _revelar(cuentas, user):
+    llave = llave_de_usuario(user.id)
+    passwords = decrypt_many([a.password_encrypted for a in cuentas], llave)
+    secrets = decrypt_many([a.secret_encrypted for a in cuentas], llave)
+    return [
+        {"id": str(a.id), "decrypted_password": p, "decrypted_secret": s}
+        for a, p, s in zip(cuentas, passwords, secrets)
+    ]
 
 
 class RegisterView(generics.CreateAPIView):
@@ -10,6 +10,11 @@ BASE_DIR = Path(__file__).resolve().parent.parent.parent
 
 SECRET_KEY = os.getenv("DJANGO_SECRET_KEY", "insecure-dev-key")
 ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY')
+# Rotación: llaves separadas por coma, la primera es la vigente (ver core/crypto.py)
+ENCRYPTION_KEYS = os.getenv('ENCRYPTION_KEYS', '')
+# Caché en memoria de las llaves de datos por usuario ya desenvueltas
+VAULT_DEK_CACHE_SIZE = 1024
+VAULT_DEK_CACHE_TTL = 300  # segundos
 MERCADOPAGO_ACCESS_TOKEN = os.getenv('MERCADOPAGO_ACCESS_TOKEN')
 
 SIMPLE_JWT = {
@@ -29,6 +34,9 @@ SIMPLE_JWT = {
     'ALGORITHM': 'HS256',
     'SIGNING_KEY': SECRET_KEY,
     'AUTH_HEADER_TYPES': ('Bearer',),
+
+    # Renovación con el plan y la versión de cupos al día (ver core/auth/jwt.py)
+    'TOKEN_REFRESH_SERIALIZER': 'core.auth.jwt.RefreshConClaimsSerializer',
 }
 
 INSTALLED_APPS = [
@@ -56,13 +64,16 @@ EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # Arma el usuario con los claims del token, sin consultar la base
+        'core.auth.jwt.JWTSinConsulta',
     ),
 }
 
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    # Antes de sesiones, autenticación y vistas: el intento rechazado no cuesta nada
+    "core.middleware.LimiteDeIntentosMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -70,10 +81,12 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    "core.middleware.ServidorOcupadoMiddleware",
 ]
 
 PASSWORD_HASHERS = [
-    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    # Argon2 con control de admisión (ver core/auth/hashers.py)
+    "core.auth.hashers.Argon2Limitado",
     "django.contrib.auth.hashers.PBKDF2PasswordHasher",
     "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
     "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
@@ -110,6 +123,64 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# --- BÓVEDA DE ARCHIVOS ---
+# Tope por POST multipart normal (/api/files/)
+VAULT_MAX_UPLOAD_MB = 50
+# Tope para subidas reanudables por partes (/api/uploads/)
+VAULT_MAX_RESUMABLE_UPLOAD_MB = int(os.getenv('VAULT_MAX_RESUMABLE_UPLOAD_MB', 2048))
+# Tamaño de cada trozo (múltiplo del segmento de cifrado de 64 KiB)
+VAULT_UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+# Las sesiones de subida sin terminar se borran pasado este tiempo
+VAULT_UPLOAD_SESSION_HOURS = 24
+# Subida en lote (/api/files/batch/): máximo de archivos e hilos de cifrado
+VAULT_BATCH_MAX_FILES = 50
+VAULT_BATCH_WORKERS = 4
+# Operaciones por POST /api/cuentas/batch/
+VAULT_BATCH_MAX_OPS = 200
+# Máximo de cuentas que se descifran en un solo POST /api/cuentas/revelar/
+VAULT_REVEAL_MAX_IDS = 100
+# Paginación por cursor de cuentas y archivos (?page_size=, ?cursor=)
+VAULT_PAGE_SIZE = 50
+VAULT_MAX_PAGE_SIZE = 200
+# Tope de resultados de ?search= en cuentas (salen por relevancia, sin paginar)
+VAULT_SEARCH_MAX_RESULTS = 100
+# Días que se guardan las lápidas de borrados para /api/sync/ (ver podar_borrados)
+VAULT_SYNC_RETENCION_DIAS = 30
+# Caché de favicons (ver cuentas/iconos.py y el comando actualizar_iconos)
+VAULT_ICONOS_FETCHER = os.getenv('VAULT_ICONOS_FETCHER', 'cuentas.iconos.descargar_favicon')
+VAULT_ICONOS_TTL_DIAS = 30
+VAULT_ICONOS_TIMEOUT = 5  # segundos por descarga
+VAULT_ICONOS_MAX_BYTES = 100 * 1024
+VAULT_ICONOS_MAX_AGE = 24 * 3600  # Cache-Control de /api/iconos/<dominio>/
+VAULT_ICONOS_MAX_LOTE = 200  # cuentas por POST /api/cuentas/iconos/
+# Máximo de cuentas por CSV en POST /api/cuentas/importar/
+VAULT_IMPORT_MAX_FILAS = 5000
+# Control de admisión de Argon2, por proceso (ver core/auth/hashers.py):
+# hashes simultáneos, cuántos más pueden esperar y cuántos segundos cada uno
+VAULT_HASH_CONCURRENCIA = int(os.getenv('VAULT_HASH_CONCURRENCIA', 2))
+VAULT_HASH_COLA = int(os.getenv('VAULT_HASH_COLA', 4))
+VAULT_HASH_ESPERA = float(os.getenv('VAULT_HASH_ESPERA', 2))
+# Límite de intentos por ventana deslizante (ver core/middleware.py):
+# (método, ruta, clave, límite, ventana en segundos), clave = 'ip', 'email' o 'user'
+VAULT_RATELIMIT_ACTIVO = True
+VAULT_RATELIMIT_REGLAS = [
+    ('POST', '/api/auth/login/', 'ip', 20, 60),
+    ('POST', '/api/auth/login/', 'email', 5, 15 * 60),
+    ('POST', '/api/auth/register/', 'ip', 5, 60 * 60),
+    ('POST', '/api/security/', 'ip', 20, 60),
+    ('POST', '/api/security/', 'user', 5, 15 * 60),
+    ('PUT', '/api/security/', 'user', 10, 60 * 60),
+]
+# ContadorEnCache comparte los contadores entre workers si CACHES es Redis o Memcached
+VAULT_RATELIMIT_BACKEND = 'core.middleware.ContadorEnCache'
+VAULT_RATELIMIT_CACHE = 'default'
+# Proxies propios delante de gunicorn (0: se usa REMOTE_ADDR)
+VAULT_RATELIMIT_PROXIES = int(os.getenv('VAULT_RATELIMIT_PROXIES', 0))
+VAULT_RATELIMIT_MAX_CUERPO = 16 * 1024  # bytes que se leen para buscar el email; más: 413
+# Caché de Profile.version_cupos para validar los access tokens (ver core/auth/jwt.py)
+VAULT_JWT_CACHE = 'default'
+VAULT_JWT_VERSION_TTL = 60  # segundos
+
 AUTHENTICATION_BACKENDS = [
     'cuentas.backends.EmailBackend',  # Nuestro login por correo
     # El login normal (por seguridad)
@@ -19,6 +19,7 @@ from django.urls import path, include
 from rest_framework_simplejwt.views import (
     TokenObtainPairView, TokenRefreshView)
 from cuentas.views import RegisterView, EmailTokenObtainPairView, AdRewardView, SecurityView, AnuncioListView
+from core.views import MetricasHashView
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -37,4 +38,6 @@ urlpatterns = [
          SecurityView.as_view(), name='security-check'),
     path('api/anuncios/', 
          AnuncioListView.as_view(), name='anuncios-list'),
+    path('api/metricas/hash/',
+         MetricasHashView.as_view(), name='metricas-hash'),
 ]